@@ -0,0 +1,97 @@
+"""Grouped, time-bucketed statistics over price rows.
+
+Rows are collected into a DataFrame of just the columns aggregation needs and
+reduced with one pandas groupby, so the client receives one row per
+(group, bucket) instead of every raw price.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from downsample import lttb, series_bounds
+
+GROUP_COLUMNS = {
+    "none": [],
+    "region": ["region_id"],
+    "commodity": ["commodity_id"],
+    "both": ["region_id", "commodity_id"],
+}
+
+# Period each bucket is truncated to; buckets are labelled by their first day
+BUCKET_PERIODS = {"day": "D", "week": "W-SUN", "month": "M", "quarter": "Q", "year": "Y"}
+
+STATISTICS = ("mean", "min", "max", "median", "last", "count")
+
+# Columns to fetch; date and id are also the keyset pagination key
+SOURCE_COLUMNS = "id,region_id,commodity_id,date,price"
+
+
+def _collect(pages: Iterable[List[Dict[str, Any]]]) -> pd.DataFrame:
+    columns = ["region_id", "commodity_id", "date", "price"]
+    frames = [pd.DataFrame(page, columns=columns) for page in pages]
+    frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    frame["date"] = pd.to_datetime(frame["date"])
+    frame["price"] = pd.to_numeric(frame["price"])
+    return frame
+
+
+def aggregate(pages: Iterable[List[Dict[str, Any]]], group_by: str = "both",
+              bucket: Optional[str] = None, stats: Iterable[str] = ("mean", "min", "max", "count")) -> List[Dict[str, Any]]:
+    """Reduce pages of price rows to one row per group and bucket.
+
+    Each output row has the group columns, ``bucket`` (ISO date of the first
+    day of the bucket, when bucketing) and one key per statistic.
+    """
+    keys = list(GROUP_COLUMNS[group_by])
+    stats = list(dict.fromkeys(stats))
+
+    frame = _collect(pages)
+
+    if bucket:
+        frame["bucket"] = frame["date"].dt.to_period(BUCKET_PERIODS[bucket]).dt.start_time
+        keys.append("bucket")
+
+    if "last" in stats:
+        # groupby().last() takes the last row in frame order, so order by date first
+        frame = frame.sort_values("date", kind="stable")
+
+    if keys:
+        result = frame.groupby(keys, sort=True)["price"].agg(stats).reset_index()
+    else:
+        # One constant group, so "last" goes through the same groupby path as keyed results
+        whole = np.zeros(len(frame), dtype=np.int64)
+        result = frame.groupby(whole)["price"].agg(stats).reset_index(drop=True) if len(frame) else pd.DataFrame(
+            [{stat: 0 if stat == "count" else None for stat in stats}]
+        )
+
+    if "bucket" in result.columns:
+        result["bucket"] = result["bucket"].dt.strftime("%Y-%m-%d")
+    if "count" in result.columns:
+        result["count"] = result["count"].astype(int)
+    result = result.astype(object).where(result.notna(), None)
+    return result.to_dict("records")
+
+
+def downsampled_series(pages: Iterable[List[Dict[str, Any]]], max_points: int) -> List[Dict[str, Any]]:
+    """Raw points of each (region, commodity) series, reduced to at most
+    ``max_points`` per series with LTTB."""
+    frame = _collect(pages).dropna(subset=["date", "price"])
+    frame = frame.sort_values(["region_id", "commodity_id", "date"], kind="stable").reset_index(drop=True)
+    if frame.empty:
+        return []
+    series = frame.groupby(["region_id", "commodity_id"], sort=False).ngroup().to_numpy()
+    starts, lengths = series_bounds(series)
+    days = frame["date"].to_numpy("datetime64[D]").astype(np.int64)
+    keep = lttb(days, frame["price"].to_numpy(), starts, lengths, max_points)
+
+    result = frame.iloc[keep]
+    return [
+        {"region_id": region_id, "commodity_id": commodity_id, "date": day, "price": price}
+        for region_id, commodity_id, day, price in zip(
+            result["region_id"].tolist(),
+            result["commodity_id"].tolist(),
+            result["date"].dt.strftime("%Y-%m-%d").tolist(),
+            result["price"].tolist(),
+        )
+    ]
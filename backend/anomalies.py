@@ -0,0 +1,225 @@
+"""Online anomaly scores for prices as they are written.
+
+Each (region, commodity) series keeps constant-size state: an exponentially
+weighted mean and variance of its log price, the number of prices seen, and
+its last day and price. A price about to be written is scored in O(1):
+
+- ``z``: distance from the series' weighted mean in weighted standard
+  deviations, once the series has ``MIN_HISTORY`` prices
+- ``cross_z``: robust z-score (median and MAD) against the other regions'
+  prices of the same commodity on the same day, when at least ``MIN_PEERS``
+  regions have one
+
+Log prices make an extra zero a jump of log(10) at any price level. A price
+is flagged when either score exceeds the threshold; flags are returned with
+the write and kept, newest last, in a bounded in-memory list for review.
+
+The state is a write listener: each written price is folded in, clipped to
+``threshold`` standard deviations so one typo cannot blow up the variance
+(a real level shift is still followed within a few prices). Prices dated
+before the series' last day are scored but not folded in, and removed rows
+are not taken back out; the weighted state forgets them instead. It is
+built from the whole table in one pass: prices are laid out as an
+(observation, series) matrix and the recursion runs for all series at once,
+one NumPy step per observation.
+"""
+import threading
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aggregation import SOURCE_COLUMNS
+
+Series = Tuple[str, str]
+
+# Prices a series needs before its own z-score is used
+MIN_HISTORY = 10
+# Other regions with a price that day needed for the cross-region score
+MIN_PEERS = 5
+# Lower bound of the standard deviation (in log price), so a long run of
+# unchanged prices does not make every small move an anomaly
+MIN_SCALE = 0.02
+# MAD -> standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+
+# State fields
+MEAN, VAR, COUNT, LAST_DAY, LAST_PRICE = range(5)
+
+
+def _parse(row: Dict[str, Any]):
+    return (row["region_id"], row["commodity_id"]), date.fromisoformat(str(row["date"])[:10]), float(row["price"])
+
+
+def _step(mean, var, count, x, alpha: float, threshold: float):
+    """One EWMA update of log prices ``x``; works on scalars and arrays alike"""
+    scale = np.maximum(np.sqrt(var), MIN_SCALE)
+    diff = x - mean
+    diff = np.where(count >= MIN_HISTORY, np.clip(diff, -threshold * scale, threshold * scale), diff)
+    first = count == 0
+    mean = np.where(first, x, mean + alpha * diff)
+    var = np.where(first, 0.0, (1 - alpha) * (var + alpha * diff * diff))
+    return mean, var, count + 1
+
+
+class AnomalyDetector:
+    def __init__(self, client, alpha: float = 0.1, threshold: float = 5.0, cross_region: bool = True,
+                 capacity: int = 1000, page_size: int = 1000):
+        self.client = client
+        self.alpha = alpha
+        self.threshold = threshold
+        self.cross_region = cross_region
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        # series -> [mean, var, count, last day, last price]
+        self.state: Optional[Dict[Series, list]] = None
+        self.regions: Dict[str, set] = {}
+        self.flagged: "deque[Dict[str, Any]]" = deque(maxlen=capacity)
+
+    # Building
+    def load(self, frame: pd.DataFrame) -> None:
+        """Replace the state with one built from the ``region_id, commodity_id, date, id, price`` rows of ``frame``"""
+        frame = frame.dropna(subset=["price"])
+        frame = frame.assign(date=pd.to_datetime(frame["date"].astype(str).str[:10]), price=frame["price"].astype(float))
+        frame = frame[frame["price"] > 0].sort_values(["region_id", "commodity_id", "date", "id"], kind="stable")
+        series = frame.groupby(["region_id", "commodity_id"], sort=False).ngroup().to_numpy()
+        lasts = frame.groupby(series)[["region_id", "commodity_id", "date", "price"]].last()
+        step = frame.groupby(series).cumcount().to_numpy()
+
+        values = np.full((step.max() + 1 if len(step) else 0, len(lasts)), np.nan)
+        values[step, series] = np.log(frame["price"].to_numpy())
+        mean, var = np.zeros(len(lasts)), np.zeros(len(lasts))
+        count = np.zeros(len(lasts), dtype=np.int64)
+        for x in values:
+            present = ~np.isnan(x)
+            new_mean, new_var, new_count = _step(mean, var, count, np.where(present, x, 0.0), self.alpha, self.threshold)
+            mean = np.where(present, new_mean, mean)
+            var = np.where(present, new_var, var)
+            count = np.where(present, new_count, count)
+
+        state, regions = {}, {}
+        for i, (region_id, commodity_id, day, price) in enumerate(zip(
+            lasts["region_id"].tolist(), lasts["commodity_id"].tolist(), lasts["date"].dt.date.tolist(), lasts["price"].tolist()
+        )):
+            state[(region_id, commodity_id)] = [float(mean[i]), float(var[i]), int(count[i]), day, price]
+            regions.setdefault(commodity_id, set()).add(region_id)
+        with self.lock:
+            self.state = state
+            self.regions = regions
+
+    def build(self) -> None:
+        """Load every row of the table"""
+        columns = SOURCE_COLUMNS.split(",")
+        frames = []
+        start = 0
+        while True:
+            page = (
+                self.client.table("prices")
+                .select(SOURCE_COLUMNS)
+                .order("id")
+                .range(start, start + self.page_size - 1)
+                .execute()
+                .data
+            )
+            if page:
+                frames.append(pd.DataFrame(page, columns=columns))
+            if len(page) < self.page_size:
+                break
+            start += self.page_size
+        self.load(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns))
+
+    def ready(self) -> None:
+        """Build the state unless it exists (also run in the background at startup)"""
+        with self.build_lock:
+            if self.state is None:
+                self.build()
+
+    # Scoring
+    def _cross_z(self, series: Series, day: date, x: float) -> Optional[float]:
+        region_id, commodity_id = series
+        peers = [
+            self.state[(other, commodity_id)][LAST_PRICE]
+            for other in self.regions.get(commodity_id, ())
+            if other != region_id and self.state[(other, commodity_id)][LAST_DAY] == day
+        ]
+        if len(peers) < MIN_PEERS:
+            return None
+        logs = np.log(peers)
+        median = float(np.median(logs))
+        scale = max(MAD_SCALE * float(np.median(np.abs(logs - median))), MIN_SCALE)
+        return (x - median) / scale
+
+    def score(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Scores of a price about to be written: ``{"flagged", "z", "cross_z",
+        "expected"}``, or None when there is nothing to compare it with"""
+        self.ready()
+        series, day, price = _parse(row)
+        if price <= 0:
+            return {"flagged": True, "z": None, "cross_z": None, "expected": None}
+        x = float(np.log(price))
+        with self.lock:
+            if self.state is None:  # reset by a bulk write meanwhile
+                return None
+            state = self.state.get(series)
+            z = expected = None
+            if state and state[COUNT] >= MIN_HISTORY:
+                z = (x - state[MEAN]) / max(float(np.sqrt(state[VAR])), MIN_SCALE)
+                expected = float(np.exp(state[MEAN]))
+            cross_z = self._cross_z(series, day, x) if self.cross_region else None
+        if z is None and cross_z is None:
+            return None
+        scores = [abs(value) for value in (z, cross_z) if value is not None]
+        return {
+            "flagged": bool(max(scores) > self.threshold),
+            "z": None if z is None else round(float(z), 2),
+            "cross_z": None if cross_z is None else round(float(cross_z), 2),
+            "expected": None if expected is None else round(expected, 2),
+        }
+
+    def record(self, rows: List[Dict[str, Any]], result: Optional[Dict[str, Any]]) -> None:
+        """Keep the written rows of a flagged price for review"""
+        if not result or not result["flagged"]:
+            return
+        flagged_at = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            for row in rows:
+                self.flagged.append({**row, **result, "flagged_at": flagged_at})
+
+    def review(self, limit: int) -> List[Dict[str, Any]]:
+        """Flagged rows, newest first"""
+        with self.lock:
+            return list(self.flagged)[::-1][:limit]
+
+    def dismiss(self, price_id: str) -> int:
+        with self.lock:
+            kept = [entry for entry in self.flagged if entry.get("id") != price_id]
+            dismissed = len(self.flagged) - len(kept)
+            self.flagged = deque(kept, maxlen=self.flagged.maxlen)
+        return dismissed
+
+    # Write listener interface
+    def rows_changed(self, removed, added) -> None:
+        with self.lock:
+            if self.state is None:
+                return
+            for row in added:
+                series, day, price = _parse(row)
+                if price <= 0:
+                    continue
+                state = self.state.get(series)
+                if state is None:
+                    state = self.state[series] = [0.0, 0.0, 0, day, price]
+                    self.regions.setdefault(series[1], set()).add(series[0])
+                elif day < state[LAST_DAY]:
+                    continue
+                mean, var, count = _step(state[MEAN], state[VAR], state[COUNT], np.log(price), self.alpha, self.threshold)
+                state[MEAN], state[VAR], state[COUNT] = float(mean), float(var), int(count)
+                state[LAST_DAY], state[LAST_PRICE] = day, price
+
+    def reset(self) -> None:
+        with self.lock:
+            self.state = None
+            self.regions = {}
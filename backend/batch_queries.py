@@ -0,0 +1,123 @@
+"""Shared scans for batches of ``/data`` filter sets.
+
+A batch is planned into as few scans as possible without reading rows that
+no filter set wants:
+
+1. filter sets with the same regions and commodities whose date ranges
+   overlap or touch share one scan over the merged range;
+2. scans over the same commodities and dates are merged across regions, and
+   then scans over the same regions and dates across commodities. The merged
+   scan reads exactly the union of the rows of the scans it replaces.
+
+Every scan is read once in (date, id) order. Its rows are handed to each
+member filter set they match until that set has its limit, and the scan
+stops early once no member needs more rows.
+"""
+from datetime import date, timedelta
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Sequence
+
+Ids = Optional[FrozenSet[str]]
+
+# Open date bounds; ISO strings so rows are matched by string comparison
+FIRST_DAY = date.min.isoformat()
+LAST_DAY = date.max.isoformat()
+
+
+def _union(first: Ids, second: Ids) -> Ids:
+    return None if first is None or second is None else first | second
+
+
+class Filter(NamedTuple):
+    region_ids: Ids
+    commodity_ids: Ids
+    start: str
+    end: str
+
+    @classmethod
+    def of(cls, region_ids: Optional[Sequence[str]], commodity_ids: Optional[Sequence[str]],
+           start_date: Optional[date], end_date: Optional[date]) -> "Filter":
+        return cls(
+            frozenset(region_ids) if region_ids else None,
+            frozenset(commodity_ids) if commodity_ids else None,
+            start_date.isoformat() if start_date else FIRST_DAY,
+            end_date.isoformat() if end_date else LAST_DAY,
+        )
+
+    def matches(self, row: Dict[str, Any]) -> bool:
+        return (
+            (self.region_ids is None or row["region_id"] in self.region_ids)
+            and (self.commodity_ids is None or row["commodity_id"] in self.commodity_ids)
+            and self.start <= row["date"][:10] <= self.end
+        )
+
+    def query_args(self):
+        """``(region_ids, commodity_ids, start_date, end_date)`` as the read helpers take them"""
+        return (
+            sorted(self.region_ids) if self.region_ids is not None else None,
+            sorted(self.commodity_ids) if self.commodity_ids is not None else None,
+            date.fromisoformat(self.start) if self.start != FIRST_DAY else None,
+            date.fromisoformat(self.end) if self.end != LAST_DAY else None,
+        )
+
+
+class Scan(NamedTuple):
+    filter: Filter
+    # Positions of the filter sets served by this scan
+    members: List[int]
+
+
+def _touches(end: str, start: str) -> bool:
+    """Whether a range starting at ``start`` overlaps or directly follows one ending at ``end``"""
+    return end == LAST_DAY or start <= (date.fromisoformat(end) + timedelta(days=1)).isoformat()
+
+
+def _merge_dates(scans: List[Scan]) -> List[Scan]:
+    groups: Dict[tuple, List[Scan]] = {}
+    for scan in scans:
+        groups.setdefault((scan.filter.region_ids, scan.filter.commodity_ids), []).append(scan)
+    merged = []
+    for group in groups.values():
+        group.sort(key=lambda scan: scan.filter.start)
+        current = group[0]
+        for scan in group[1:]:
+            if _touches(current.filter.end, scan.filter.start):
+                end = max(current.filter.end, scan.filter.end)
+                current = Scan(current.filter._replace(end=end), current.members + scan.members)
+            else:
+                merged.append(current)
+                current = scan
+        merged.append(current)
+    return merged
+
+
+def _merge_ids(scans: List[Scan], field: str) -> List[Scan]:
+    """Merge scans that differ only in ``field`` (region_ids or commodity_ids)"""
+    groups: Dict[tuple, Scan] = {}
+    for scan in scans:
+        key = tuple(value for name, value in scan.filter._asdict().items() if name != field)
+        if key in groups:
+            current = groups[key]
+            ids = _union(getattr(current.filter, field), getattr(scan.filter, field))
+            groups[key] = Scan(current.filter._replace(**{field: ids}), current.members + scan.members)
+        else:
+            groups[key] = scan
+    return list(groups.values())
+
+
+def plan(filters: Sequence[Filter]) -> List[Scan]:
+    scans = _merge_dates([Scan(f, [i]) for i, f in enumerate(filters)])
+    scans = _merge_ids(scans, "region_ids")
+    scans = _merge_ids(scans, "commodity_ids")
+    return sorted(scans, key=lambda scan: scan.members[0])
+
+
+def take(page: List[Dict[str, Any]], scan: Scan, filters: Sequence[Filter], limits: Sequence[int],
+         results: List[List[Dict[str, Any]]]) -> bool:
+    """Hand a page of scan rows to the scan's members; True once none of them needs more"""
+    members = [(filters[i], limits[i], results[i]) for i in scan.members]
+    for row in page:
+        for f, limit, rows in members:
+            if len(rows) < limit and f.matches(row):
+                rows.append(row)
+    last_day = page[-1]["date"][:10] if page else LAST_DAY
+    return all(len(rows) >= limit or f.end < last_day for f, limit, rows in members)
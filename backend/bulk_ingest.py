@@ -0,0 +1,236 @@
+"""Bulk loading of price data.
+
+Source files come in three shapes:
+
+* wide   - ``data prep/train|test/<Commodity>.csv``: a ``Date`` column plus one
+           column per region
+* keyed  - ``outputfinal.csv``: ``id`` is ``Commodity/Region/Date`` plus ``price``
+* tidy   - ``region``, ``commodity``, ``date``, ``price`` (and optionally
+           ``created_by``) columns, the shape of ``PriceData``
+
+All of them are normalised into one tidy frame, validated and mapped to ids
+with vectorized pandas, then written in batched inserts (or upserts on the
+natural key) spread over a small thread pool.
+
+CLI::
+
+    python bulk_ingest.py --created-by <user uuid> [--upsert] [paths ...]
+
+Without paths the train/test files and ``outputfinal.csv`` under ``data_prep``
+are loaded.
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from id_mapping import region_map, commodity_map
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "4"))
+
+TIDY_COLUMNS = ["region", "commodity", "date", "price"]
+# Natural key of a price, backed by a unique index (see README)
+NATURAL_KEY = "region_id,commodity_id,date"
+DATA_PREP_DIR = os.path.join(os.path.dirname(__file__), "..", "data_prep")
+
+
+def melt_wide(frame: pd.DataFrame, commodity: str) -> pd.DataFrame:
+    """``Date`` + one column per region -> tidy rows for a single commodity"""
+    tidy = frame.melt(id_vars="Date", var_name="region", value_name="price")
+    tidy = tidy.rename(columns={"Date": "date"})
+    tidy["commodity"] = commodity
+    return tidy[TIDY_COLUMNS]
+
+
+def split_keyed(frame: pd.DataFrame) -> pd.DataFrame:
+    """``id`` = ``Commodity/Region/Date`` -> tidy rows"""
+    parts = frame["id"].str.split("/", n=2, expand=True)
+    return pd.DataFrame({
+        "region": parts[1],
+        "commodity": parts[0],
+        "date": parts[2],
+        "price": frame["price"],
+    })
+
+
+def normalize_frame(frame: pd.DataFrame, commodity: Optional[str] = None) -> pd.DataFrame:
+    """Bring any of the supported shapes into the tidy layout"""
+    columns = set(frame.columns)
+    if set(TIDY_COLUMNS) <= columns:
+        keep = TIDY_COLUMNS + (["created_by"] if "created_by" in columns else [])
+        return frame[keep]
+    if {"id", "price"} <= columns:
+        return split_keyed(frame)
+    if "Date" in columns:
+        if not commodity:
+            raise ValueError("Wide files need a commodity (taken from the file name)")
+        return melt_wide(frame, commodity)
+    raise ValueError(f"Unrecognised columns: {', '.join(map(str, frame.columns))}")
+
+
+def read_frame(source, filename: str, commodity: Optional[str] = None) -> pd.DataFrame:
+    """Read a CSV or Parquet file (path or file object) into the tidy layout"""
+    if filename.lower().endswith(".parquet"):
+        frame = pd.read_parquet(source)
+    else:
+        frame = pd.read_csv(source)
+    if commodity is None:
+        commodity = os.path.splitext(os.path.basename(filename))[0]
+    return normalize_frame(frame, commodity)
+
+
+def default_paths() -> List[str]:
+    paths = []
+    for split in ("train", "test"):
+        paths.extend(sorted(glob.glob(os.path.join(DATA_PREP_DIR, "data prep", split, "*.csv"))))
+    paths.append(os.path.join(DATA_PREP_DIR, "outputfinal.csv"))
+    return paths
+
+
+def load_paths(paths: Iterable[str]) -> pd.DataFrame:
+    frames = [read_frame(path, path) for path in paths]
+    if not frames:
+        return pd.DataFrame(columns=TIDY_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def prepare_rows(frame: pd.DataFrame, created_by: Optional[str] = None,
+                 skip_missing: bool = False) -> Tuple[List[Dict[str, Any]], pd.DataFrame]:
+    """Validate a tidy frame and map names to ids.
+
+    Returns ``(rows, rejected)``: rows ready for ``prices`` and a frame of the
+    rejected input rows with a ``reason`` column. With ``skip_missing`` rows
+    without a positive price (gaps in the prep files) are dropped silently
+    instead of being rejected. Later duplicates of a (region, commodity, date)
+    replace earlier ones.
+    """
+    frame = frame.reset_index(drop=True)
+    region_ids = frame["region"].astype(str).str.strip().map(region_map)
+    commodity_ids = frame["commodity"].astype(str).str.strip().map(commodity_map)
+    dates = pd.to_datetime(frame["date"], errors="coerce").dt.strftime("%Y-%m-%d")
+    prices = pd.to_numeric(frame["price"].astype(str).str.replace(",", "", regex=False), errors="coerce")
+    if "created_by" in frame.columns:
+        owners = frame["created_by"].fillna(created_by)
+    else:
+        owners = pd.Series(created_by, index=frame.index, dtype=object)
+
+    missing_price = prices.isna() | (prices <= 0)
+    if skip_missing:
+        keep = ~missing_price
+        frame, region_ids, commodity_ids = frame[keep], region_ids[keep], commodity_ids[keep]
+        dates, prices, owners = dates[keep], prices[keep], owners[keep]
+        missing_price = missing_price[keep]
+
+    reason = pd.Series(None, index=frame.index, dtype=object)
+    reason[owners.isna()] = "missing created_by"
+    reason[missing_price] = "missing or non-positive price"
+    reason[dates.isna()] = "invalid date"
+    reason[commodity_ids.isna()] = "unknown commodity"
+    reason[region_ids.isna()] = "unknown region"
+    bad = reason.notna()
+
+    rejected = frame[bad].assign(reason=reason[bad])
+    good = pd.DataFrame({
+        "region_id": region_ids[~bad],
+        "commodity_id": commodity_ids[~bad],
+        "date": dates[~bad],
+        "price": prices[~bad].astype(float),
+        "created_by": owners[~bad],
+    })
+    good = good.drop_duplicates(subset=["region_id", "commodity_id", "date"], keep="last")
+    # zip over plain lists is several times faster than DataFrame.to_dict
+    names = list(good.columns)
+    rows = [dict(zip(names, values)) for values in zip(*(good[name].tolist() for name in names))]
+    return rows, rejected
+
+
+class PartialWriteError(Exception):
+    """A batch failed; the batches written before it stay committed.
+
+    ``written`` holds the committed rows as returned by the client and
+    ``committed`` how many input rows they were; ``error`` is the failure.
+    """
+
+    def __init__(self, written: List[Dict[str, Any]], committed: int, error: Exception):
+        super().__init__(f"{committed} rows were committed before a batch failed: {error}")
+        self.written = written
+        self.committed = committed
+        self.error = error
+
+
+def write_rows(client, rows: List[Dict[str, Any]], batch_size: int = BULK_BATCH_SIZE,
+               workers: int = BULK_WORKERS, upsert: bool = False) -> List[Dict[str, Any]]:
+    """Insert rows in batches of ``batch_size``, ``workers`` batches at a time.
+
+    With ``upsert`` rows whose natural key exists update that row instead.
+    Batches are not rolled back: once one fails no further batch is started,
+    and PartialWriteError reports the ones already committed.
+    """
+    batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+    failed = threading.Event()
+
+    def insert(batch):
+        if failed.is_set():
+            return None, None
+        table = client.table("prices")
+        try:
+            if upsert:
+                # default_to_null=False: new rows get the column defaults (id, timestamps)
+                return table.upsert(batch, on_conflict=NATURAL_KEY, default_to_null=False).execute().data or [], None
+            return table.insert(batch).execute().data or [], None
+        except Exception as e:
+            failed.set()
+            return None, e
+
+    if workers <= 1 or len(batches) <= 1:
+        results = [insert(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(insert, batches))
+    written = [row for result, _ in results if result for row in result]
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        committed = sum(len(batch) for batch, (result, _) in zip(batches, results) if result is not None)
+        raise PartialWriteError(written, committed, errors[0]) from errors[0]
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load price files into the prices table")
+    parser.add_argument("paths", nargs="*", help="CSV/Parquet files (default: data_prep train/test and outputfinal.csv)")
+    parser.add_argument("--created-by", required=True, help="UUID recorded as created_by")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS)
+    parser.add_argument("--dry-run", action="store_true", help="Validate only, write nothing")
+    parser.add_argument("--upsert", action="store_true", help="Update rows whose (region, commodity, date) exists")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    frame = load_paths(args.paths or default_paths())
+    rows, rejected = prepare_rows(frame, args.created_by, skip_missing=True)
+    print(f"Prepared {len(rows)} rows from {len(frame)} input rows in {time.perf_counter() - started:.1f}s")
+    if len(rejected):
+        print(f"Rejected {len(rejected)} rows:")
+        print(rejected["reason"].value_counts().to_string())
+    if args.dry_run:
+        return
+
+    from supabase_client import supabase
+
+    started = time.perf_counter()
+    try:
+        written = write_rows(supabase, rows, args.batch_size, args.workers, args.upsert)
+    except PartialWriteError as e:
+        raise SystemExit(f"Failed after committing {e.committed} of {len(rows)} rows: {e.error}")
+    print(f"{'Upserted' if args.upsert else 'Inserted'} {len(written) or len(rows)} rows "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Bounded log of row changes, for clients that sync deltas.
+
+Every change the write listeners report gets the next sequence number and is
+kept with the row's image before and after it (``None`` for an insert or a
+delete). A client remembers the watermark (``epoch:sequence``) of its last
+fetch and later asks only for what changed after it.
+
+The log lives in process memory. A restart, a bulk operation without row
+images (``reset``) or changes older than ``capacity`` mean a watermark can no
+longer be served; ``changes_since`` then returns None and the client
+refetches in full. The epoch makes watermarks from another process or an
+earlier run unusable instead of silently wrong.
+
+Writes that bypass this process (other API workers, the bulk loader CLI,
+direct database writes) never reach the log, so it is only complete when
+this process is the table's single writer; main.py does not keep one
+otherwise.
+"""
+import threading
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+
+class Change(NamedTuple):
+    sequence: int
+    id: str
+    before: Optional[Dict[str, Any]]
+    after: Optional[Dict[str, Any]]
+
+
+class ChangeLog:
+    def __init__(self, capacity: int = 100_000):
+        self.lock = threading.Lock()
+        self.entries: "deque[Change]" = deque(maxlen=capacity)
+        self.epoch = uuid.uuid4().hex[:12]
+        self.sequence = 0
+        # Oldest sequence a watermark may point at and still be complete
+        self.horizon = 0
+
+    def watermark(self) -> str:
+        with self.lock:
+            return f"{self.epoch}:{self.sequence}"
+
+    def _record(self, row_id, before, after) -> None:
+        if len(self.entries) == self.entries.maxlen:
+            self.horizon = self.entries[0].sequence
+        self.sequence += 1
+        self.entries.append(Change(self.sequence, row_id, before, after))
+
+    # Write listener interface
+    def rows_changed(self, removed, added) -> None:
+        before = {row["id"]: row for row in removed}
+        after = {row["id"]: row for row in added}
+        with self.lock:
+            for row_id in list(before) + [row_id for row_id in after if row_id not in before]:
+                self._record(row_id, before.get(row_id), after.get(row_id))
+
+    def reset(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.epoch = uuid.uuid4().hex[:12]
+            self.sequence = self.horizon = 0
+
+    def changes_since(self, watermark: str, matches: Callable[[Dict[str, Any]], bool]):
+        """``(upserts, deleted_ids, watermark)`` for rows accepted by ``matches``.
+
+        Several changes to one row collapse into its final state. A row that
+        no longer matches (deleted, or updated out of the filters) is
+        reported as deleted if any earlier image of it matched. Returns None
+        when the watermark cannot be served.
+        """
+        epoch, _, sequence = watermark.partition(":")
+        try:
+            sequence = int(sequence)
+        except ValueError:
+            return None
+        with self.lock:
+            if epoch != self.epoch or not self.horizon <= sequence <= self.sequence:
+                return None
+            current = f"{self.epoch}:{self.sequence}"
+            changes = [change for change in self.entries if change.sequence > sequence]
+
+        final: Dict[str, Optional[Dict[str, Any]]] = {}
+        seen: Dict[str, bool] = {}
+        for change in changes:
+            final[change.id] = change.after
+            seen[change.id] = seen.get(change.id, False) or (change.before is not None and matches(change.before))
+
+        upserts: List[Dict[str, Any]] = []
+        deleted: List[str] = []
+        for row_id, row in final.items():
+            if row is not None and matches(row):
+                upserts.append(row)
+            elif seen[row_id]:
+                deleted.append(row_id)
+        return upserts, deleted, current
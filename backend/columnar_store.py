@@ -0,0 +1,592 @@
+"""In-process columnar engine for the prices table.
+
+Rows live in one NumPy array per column. Region and commodity ids are stored
+as small integer codes, dates as day numbers, and the arrays are kept sorted
+by (region, commodity, date) so region/commodity/date filters resolve to a
+handful of binary searches instead of a scan.
+"""
+import csv
+import threading
+import uuid
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from postgrest.exceptions import APIError
+
+from id_mapping import region_map, commodity_map
+from storage import Condition, QuerySpec, StorageEngine
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# PostgreSQL's unique_violation, raised as the database would for a repeated key
+UNIQUE_VIOLATION = "23505"
+MISSING_DAY = np.iinfo(np.int32).min
+DAY_BIAS = 1 << 23
+
+
+def to_day(value) -> int:
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.toordinal() - EPOCH_ORDINAL
+    return date.fromisoformat(str(value)[:10]).toordinal() - EPOCH_ORDINAL
+
+
+def from_day(day: int) -> str:
+    return date.fromordinal(int(day) + EPOCH_ORDINAL).isoformat()
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ColumnKind:
+    """How a column is encoded into, compared in, and decoded from NumPy."""
+
+    dtype: Any = object
+
+    def empty(self) -> np.ndarray:
+        return np.empty(0, dtype=self.dtype)
+
+    def encode(self, value):
+        return value
+
+    def encode_many(self, values: Sequence) -> np.ndarray:
+        return np.array([self.encode(v) for v in values], dtype=self.dtype)
+
+    def decode_many(self, encoded: np.ndarray) -> List[Any]:
+        return encoded.tolist()
+
+    def compare(self, encoded: np.ndarray, op: str, value) -> np.ndarray:
+        if op == "in":
+            return np.isin(encoded, self.encode_many(value))
+        target = self.encode(value)
+        if op == "eq":
+            return encoded == target
+        if op == "neq":
+            return encoded != target
+        if op == "gt":
+            return encoded > target
+        if op == "gte":
+            return encoded >= target
+        if op == "lt":
+            return encoded < target
+        if op == "lte":
+            return encoded <= target
+        raise ValueError(f"Unsupported filter operator '{op}'")
+
+    def sort_rank(self, encoded: np.ndarray) -> np.ndarray:
+        return encoded
+
+
+class TextColumn(ColumnKind):
+    dtype = object
+
+    def encode(self, value):
+        return None if value is None else str(value)
+
+    def sort_rank(self, encoded):
+        keys = np.array(["" if v is None else v for v in encoded], dtype=object)
+        return np.unique(keys, return_inverse=True)[1]
+
+
+class FloatColumn(ColumnKind):
+    dtype = np.float64
+
+    def encode(self, value):
+        return np.nan if value is None else float(value)
+
+    def decode_many(self, encoded):
+        values = encoded.tolist()
+        if np.isnan(encoded).any():
+            values = [None if v != v else v for v in values]
+        return values
+
+
+class IntColumn(ColumnKind):
+    dtype = np.int64
+
+    def encode(self, value):
+        return int(value)
+
+
+class DateColumn(ColumnKind):
+    dtype = np.int32
+
+    def encode(self, value):
+        return MISSING_DAY if value is None else to_day(value)
+
+    def decode_many(self, encoded):
+        text = encoded.astype("datetime64[D]").astype(str).tolist()
+        if (encoded == MISSING_DAY).any():
+            text = [None if d == MISSING_DAY else t for d, t in zip(encoded.tolist(), text)]
+        return text
+
+
+class CategoryColumn(ColumnKind):
+    """Dictionary-encoded text; codes are stable for the lifetime of the engine."""
+
+    dtype = np.int16
+
+    def __init__(self, labels: Sequence[str] = ()):
+        self.labels: List[str] = []
+        self.codes: Dict[str, int] = {}
+        for label in labels:
+            self.code_for(label)
+
+    def code_for(self, label: str) -> int:
+        code = self.codes.get(label)
+        if code is None:
+            code = len(self.labels)
+            self.labels.append(label)
+            self.codes[label] = code
+        return code
+
+    def encode(self, value):
+        # Lookups never grow the dictionary; unknown labels simply match nothing
+        if value is None:
+            return -1
+        return self.codes.get(str(value), -2)
+
+    def encode_for_write(self, values: Sequence) -> np.ndarray:
+        return np.array([-1 if v is None else self.code_for(str(v)) for v in values], dtype=self.dtype)
+
+    def decode_many(self, encoded):
+        labels = self.labels
+        return [labels[c] if c >= 0 else None for c in encoded.tolist()]
+
+    def compare(self, encoded, op, value):
+        if op in ("eq", "neq", "in"):
+            return super().compare(encoded, op, value)
+        label_array = np.array(self.labels + [""], dtype=object)
+        return ColumnKind.compare(TextColumn(), label_array[encoded], op, value)
+
+    def sort_rank(self, encoded):
+        order = np.argsort(np.array(self.labels, dtype=object), kind="stable")
+        rank = np.empty(len(order) + 1, dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        rank[-1] = -1
+        return rank[encoded]
+
+
+class ColumnarEngine(StorageEngine):
+    """Columnar table with an optional clustered (category, category, date) key.
+
+    With ``unique_index`` (the name of the database's unique index on the
+    key) an insert that repeats a key is rejected like the database does.
+    """
+
+    def __init__(self, schema: Dict[str, ColumnKind], cluster_by: Optional[Tuple[str, str, str]] = None,
+                 defaults: Optional[Dict[str, Any]] = None, unique_index: Optional[str] = None):
+        self.schema = schema
+        self.cluster_by = cluster_by
+        self.defaults = defaults or {}
+        self.unique_index = unique_index if cluster_by else None
+        self.columns: Dict[str, np.ndarray] = {name: kind.empty() for name, kind in schema.items()}
+        self.keys = np.empty(0, dtype=np.int64)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.keys) if self.cluster_by else len(next(iter(self.columns.values())))
+
+    # Encoding helpers
+    def _make_keys(self, first, second, days) -> np.ndarray:
+        return (
+            (np.asarray(first, dtype=np.int64) << 40)
+            | (np.asarray(second, dtype=np.int64) << 24)
+            | (np.asarray(days, dtype=np.int64) + DAY_BIAS)
+        )
+
+    def _encode_rows(self, rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        encoded = {}
+        for name, kind in self.schema.items():
+            values = []
+            for row in rows:
+                value = row.get(name)
+                if value is None and name in self.defaults:
+                    value = self.defaults[name]()
+                    row[name] = value
+                values.append(value)
+            if isinstance(kind, CategoryColumn):
+                encoded[name] = kind.encode_for_write(values)
+            else:
+                encoded[name] = kind.encode_many(values)
+        self._check_required(encoded)
+        return encoded
+
+    def _encode_columns(self, columns: Dict[str, Sequence]) -> Dict[str, np.ndarray]:
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError("Columns must all have the same length")
+        count = lengths.pop()
+        encoded = {}
+        for name, kind in self.schema.items():
+            values = columns.get(name)
+            if values is None:
+                encoded[name] = kind.encode_many([None] * count)
+            elif isinstance(kind, CategoryColumn):
+                encoded[name] = kind.encode_for_write(values)
+            elif isinstance(kind, DateColumn) and np.issubdtype(np.asarray(values).dtype, np.datetime64):
+                days = np.asarray(values).astype("datetime64[D]")
+                encoded[name] = np.where(np.isnat(days), MISSING_DAY, days.astype(np.int64)).astype(kind.dtype)
+            elif isinstance(kind, (FloatColumn, IntColumn)) and isinstance(values, np.ndarray):
+                encoded[name] = values.astype(kind.dtype)
+            else:
+                encoded[name] = kind.encode_many(values)
+        self._check_required(encoded)
+        return encoded
+
+    def _check_required(self, encoded: Dict[str, np.ndarray]) -> None:
+        if self.cluster_by:
+            for name in self.cluster_by:
+                missing = MISSING_DAY if isinstance(self.schema[name], DateColumn) else -1
+                if (encoded[name] == missing).any():
+                    raise ValueError(f"Column '{name}' is required")
+
+    def _check_unique(self, encoded: Dict[str, np.ndarray], taken: Optional[np.ndarray] = None) -> None:
+        """Raise the database's unique violation if a new row repeats the key of
+        a stored row or of an earlier new row, or is flagged in ``taken``"""
+        keys = self._make_keys(*(encoded[name] for name in self.cluster_by))
+        clash = np.isin(keys, self.keys)
+        order = np.argsort(keys, kind="stable")
+        clash[order[1:]] |= keys[order[1:]] == keys[order[:-1]]
+        if taken is not None:
+            clash |= taken
+        if clash.any():
+            first = int(np.flatnonzero(clash)[0])
+            values = [self.schema[name].decode_many(encoded[name][first:first + 1])[0] for name in self.cluster_by]
+            raise APIError({
+                "code": UNIQUE_VIOLATION,
+                "message": f'duplicate key value violates unique constraint "{self.unique_index}"',
+                "details": f"Key ({', '.join(self.cluster_by)})=({', '.join(map(str, values))}) already exists.",
+                "hint": None,
+            })
+
+    def _decode(self, positions: np.ndarray, names: Sequence[str]) -> List[Dict[str, Any]]:
+        decoded = [self.schema[name].decode_many(self.columns[name][positions]) for name in names]
+        return [dict(zip(names, values)) for values in zip(*decoded)]
+
+    def _column_names(self, columns: str) -> List[str]:
+        if not columns or columns.strip() == "*":
+            return list(self.schema)
+        names = [name.strip() for name in columns.split(",") if name.strip()]
+        for name in names:
+            if name not in self.schema:
+                raise ValueError(f"Unknown column '{name}'")
+        return names
+
+    # Query planning
+    def _cluster_ranges(self, where: List[Condition]):
+        """Turn top-level cluster-key filters into key ranges.
+
+        Returns ``(positions, residual_conditions)``; ``positions`` is None when
+        the filters do not narrow the scan.
+        """
+        if not self.cluster_by:
+            return None, list(where)
+
+        first, second, day_column = self.cluster_by
+        code_sets: Dict[str, Optional[np.ndarray]] = {first: None, second: None}
+        low, high = -DAY_BIAS, DAY_BIAS - 1
+        residual = []
+        narrowed = False
+        for condition in where:
+            column, op, value = condition
+            if column in code_sets and op in ("eq", "in"):
+                kind = self.schema[column]
+                values = value if op == "in" else [value]
+                codes = np.unique(np.array([kind.encode(v) for v in values], dtype=np.int64))
+                codes = codes[codes >= 0]
+                current = code_sets[column]
+                code_sets[column] = codes if current is None else np.intersect1d(current, codes)
+                narrowed = True
+            elif column == day_column and op in ("eq", "gt", "gte", "lt", "lte") and value is not None:
+                day = to_day(value)
+                if op in ("eq", "gte"):
+                    low = max(low, day)
+                if op == "gt":
+                    low = max(low, day + 1)
+                if op in ("eq", "lte"):
+                    high = min(high, day)
+                if op == "lt":
+                    high = min(high, day - 1)
+                narrowed = True
+            else:
+                residual.append(condition)
+
+        if not narrowed:
+            return None, residual
+        if low > high:
+            return np.empty(0, dtype=np.int64), residual
+
+        firsts = code_sets[first]
+        seconds = code_sets[second]
+        if firsts is None:
+            firsts = np.arange(len(self.schema[first].labels), dtype=np.int64)
+        if seconds is None:
+            seconds = np.arange(len(self.schema[second].labels), dtype=np.int64)
+        if not len(firsts) or not len(seconds):
+            return np.empty(0, dtype=np.int64), residual
+
+        pair_first = np.repeat(firsts, len(seconds))
+        pair_second = np.tile(seconds, len(firsts))
+        starts = np.searchsorted(self.keys, self._make_keys(pair_first, pair_second, low), "left")
+        ends = np.searchsorted(self.keys, self._make_keys(pair_first, pair_second, high), "right")
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.empty(0, dtype=np.int64), residual
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return offsets + np.arange(total, dtype=np.int64), residual
+
+    def _filter(self, positions: np.ndarray, condition: Condition) -> np.ndarray:
+        column, op, value = condition
+        if column is None and op == "and":
+            for child in value:
+                positions = self._filter(positions, child)
+            return positions
+        if column is None and op == "or":
+            selected = np.zeros(len(self), dtype=bool)
+            for child in value:
+                selected[self._filter(positions, child)] = True
+            return positions[selected[positions]]
+        if column not in self.schema:
+            raise ValueError(f"Unknown column '{column}'")
+        return positions[self.schema[column].compare(self.columns[column][positions], op, value)]
+
+    def _match(self, where: List[Condition]) -> np.ndarray:
+        positions, residual = self._cluster_ranges(where)
+        if positions is None:
+            positions = np.arange(len(self), dtype=np.int64)
+        for condition in residual:
+            positions = self._filter(positions, condition)
+        return positions
+
+    def _sorted(self, positions: np.ndarray, order: List[Tuple[str, bool]], limit: Optional[int] = None) -> np.ndarray:
+        if not order or not len(positions):
+            return positions
+        if limit is not None and len(positions) > 4 * limit:
+            # Top-k: keep rows up to the k-th value of the leading sort key
+            # (ties included) before running the full multi-key sort
+            column, desc = order[0]
+            lead = self.schema[column].sort_rank(self.columns[column][positions])
+            lead = -lead if desc else lead
+            threshold = np.partition(lead, limit - 1)[limit - 1] if limit else lead.min()
+            positions = positions[lead <= threshold]
+        keys = []
+        for column, desc in reversed(order):
+            rank = self.schema[column].sort_rank(self.columns[column][positions])
+            keys.append(-rank if desc else rank)
+        return positions[np.lexsort(keys)]
+
+    # StorageEngine interface
+    def select(self, spec: QuerySpec):
+        with self.lock:
+            names = self._column_names(spec.columns)
+            positions = self._match(spec.where)
+            count = len(positions) if spec.count else None
+            if spec.head:
+                return [], count
+            stop = None if spec.limit is None else spec.offset + spec.limit
+            positions = self._sorted(positions, spec.order, stop)
+            positions = positions[spec.offset:stop]
+            return self._decode(positions, names), count
+
+    def insert(self, rows: List[Dict[str, Any]]):
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return []
+        with self.lock:
+            for row in rows:
+                for name in row:
+                    if name not in self.schema:
+                        raise ValueError(f"Unknown column '{name}'")
+            encoded = self._encode_rows(rows)
+            if self.unique_index:
+                self._check_unique(encoded)
+            inserted = [
+                dict(zip(self.schema, values))
+                for values in zip(*(self.schema[name].decode_many(encoded[name]) for name in self.schema))
+            ]
+            self._append(encoded)
+            return inserted
+
+    def _append(self, encoded: Dict[str, np.ndarray]):
+        if not self.cluster_by:
+            for name in self.schema:
+                self.columns[name] = np.concatenate([self.columns[name], encoded[name]])
+            return
+        new_keys = self._make_keys(*(encoded[name] for name in self.cluster_by))
+        order = np.argsort(new_keys, kind="stable")
+        new_keys = new_keys[order]
+        at = np.searchsorted(self.keys, new_keys, "right")
+        self.keys = np.insert(self.keys, at, new_keys)
+        for name in self.schema:
+            self.columns[name] = np.insert(self.columns[name], at, encoded[name][order])
+
+    def update(self, spec: QuerySpec, values: Dict[str, Any]):
+        with self.lock:
+            positions = self._match(spec.where)
+            if not len(positions):
+                return []
+            for name, value in values.items():
+                if name not in self.schema:
+                    raise ValueError(f"Unknown column '{name}'")
+                kind = self.schema[name]
+                if isinstance(kind, CategoryColumn):
+                    code = kind.encode_for_write([value])[0]
+                else:
+                    code = kind.encode(value)
+                self.columns[name][positions] = code
+            if self.cluster_by and any(name in values for name in self.cluster_by):
+                ids = self.columns["id"][positions] if "id" in self.schema else None
+                self._recluster()
+                if ids is not None:
+                    positions = np.flatnonzero(np.isin(self.columns["id"], ids))
+            return self._decode(positions, list(self.schema))
+
+    def _recluster(self):
+        self.keys = self._make_keys(*(self.columns[name] for name in self.cluster_by))
+        order = np.argsort(self.keys, kind="stable")
+        self.keys = self.keys[order]
+        for name in self.schema:
+            self.columns[name] = self.columns[name][order]
+
+    def delete(self, spec: QuerySpec):
+        with self.lock:
+            positions = self._match(spec.where)
+            if not len(positions):
+                return []
+            deleted = self._decode(positions, list(self.schema))
+            keep = np.ones(len(self), dtype=bool)
+            keep[positions] = False
+            for name in self.schema:
+                self.columns[name] = self.columns[name][keep]
+            if self.cluster_by:
+                self.keys = self.keys[keep]
+            return deleted
+
+    @staticmethod
+    def _latest_per_key(rows: List[Dict[str, Any]], on_conflict: Sequence[str]) -> List[Dict[str, Any]]:
+        # PostgreSQL rejects an upsert that hits one row twice; here the later row wins
+        latest = {}
+        for row in rows:
+            latest[tuple(str(row.get(name)) for name in on_conflict)] = row
+        return list(latest.values())
+
+    def _key_matches(self, rows: List[Dict[str, Any]], on_conflict: Sequence[str]) -> List[np.ndarray]:
+        """Positions of the stored rows sharing each row's ``on_conflict`` values"""
+        if not (self.cluster_by and set(on_conflict) == set(self.cluster_by)):
+            return [self._match([Condition(name, "eq", row.get(name)) for name in on_conflict]) for row in rows]
+        codes = []
+        valid = np.ones(len(rows), dtype=bool)
+        for name in self.cluster_by:
+            kind = self.schema[name]
+            values = kind.encode_many([row.get(name) for row in rows]).astype(np.int64)
+            valid &= (values != MISSING_DAY) if isinstance(kind, DateColumn) else (values >= 0)
+            codes.append(np.where(valid, values, 0))
+        keys = self._make_keys(*codes)
+        starts = np.searchsorted(self.keys, keys, "left")
+        ends = np.where(valid, np.searchsorted(self.keys, keys, "right"), starts)
+        return [np.arange(start, end) for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def upsert(self, rows: List[Dict[str, Any]], on_conflict: Sequence[str]):
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return []
+        with self.lock:
+            for row in rows:
+                for name in list(row) + list(on_conflict):
+                    if name not in self.schema:
+                        raise ValueError(f"Unknown column '{name}'")
+            rows = self._latest_per_key(rows, on_conflict)
+            matches = self._key_matches(rows, on_conflict)
+            updated = []
+            for row, positions in zip(rows, matches):
+                if not len(positions):
+                    continue
+                for name, value in row.items():
+                    if name in on_conflict:
+                        continue
+                    kind = self.schema[name]
+                    if isinstance(kind, CategoryColumn):
+                        code = kind.encode_for_write([value])[0]
+                    else:
+                        code = kind.encode(value)
+                    self.columns[name][positions] = code
+                updated.append(positions)
+            positions = np.concatenate(updated) if updated else np.empty(0, dtype=np.int64)
+            moved = self.cluster_by and any(
+                name in row and name not in on_conflict for row in rows for name in self.cluster_by
+            )
+            if moved and len(positions):
+                ids = self.columns["id"][positions]
+                self._recluster()
+                positions = np.flatnonzero(np.isin(self.columns["id"], ids))
+            result = self._decode(positions, list(self.schema))
+            return result + self.insert([row for row, found in zip(rows, matches) if not len(found)])
+
+    def replace_all(self, rows: List[Dict[str, Any]]):
+        with self.lock:
+            self.columns = {name: kind.empty() for name, kind in self.schema.items()}
+            self.keys = np.empty(0, dtype=np.int64)
+            if rows:
+                self.insert(rows)
+
+    def load_csv(self, path: str) -> int:
+        """Load rows from a CSV with the prices table's columns."""
+        with open(path, newline="", encoding="utf-8") as handle:
+            rows = [{k: v for k, v in row.items() if v != ""} for row in csv.DictReader(handle)]
+        self.insert(rows)
+        return len(rows)
+
+    def load_columns(self, columns: Dict[str, Sequence]) -> int:
+        """Append rows given column by column, without building row dicts.
+
+        Category columns take labels and dates may be ``datetime64`` arrays.
+        Defaults are not applied, so pass ``id`` and timestamps explicitly.
+        """
+        for name in columns:
+            if name not in self.schema:
+                raise ValueError(f"Unknown column '{name}'")
+        encoded = self._encode_columns(columns)
+        with self.lock:
+            self._append(encoded)
+        return len(encoded[next(iter(self.schema))])
+
+
+PRICE_CLUSTER = ("region_id", "commodity_id", "date")
+# Unique index on PRICE_CLUSTER in the database (see README)
+PRICE_KEY_INDEX = "prices_region_commodity_date_key"
+PRICE_DEFAULTS = {
+    "id": lambda: str(uuid.uuid4()),
+    "created_at": utc_now,
+    "updated_at": utc_now,
+}
+
+
+def price_schema(regions: Sequence[str] = (), commodities: Sequence[str] = ()) -> Dict[str, ColumnKind]:
+    """Columns of ``public.prices``; region and commodity codes start with the
+    given ids (default: the order of ``id_mapping``)"""
+    return {
+        "id": TextColumn(),
+        "region_id": CategoryColumn(regions or region_map.values()),
+        "commodity_id": CategoryColumn(commodities or commodity_map.values()),
+        "date": DateColumn(),
+        "price": FloatColumn(),
+        "created_by": TextColumn(),
+        "created_at": TextColumn(),
+        "updated_at": TextColumn(),
+    }
+
+
+def create_price_engine(unique: bool = False) -> ColumnarEngine:
+    """Columnar engine with the schema of ``public.prices``.
+
+    Region and commodity codes follow the order of ``id_mapping`` so they are
+    the same in every process. With ``unique`` a repeated (region, commodity,
+    date) is rejected as by the table's unique index; leave it off where the
+    rows come from a source that enforces the key itself.
+    """
+    return ColumnarEngine(price_schema(), cluster_by=PRICE_CLUSTER, defaults=PRICE_DEFAULTS,
+                          unique_index=PRICE_KEY_INDEX if unique else None)
@@ -0,0 +1,149 @@
+"""Precomputed row counts per (region, commodity, month).
+
+Whole months inside a date range are answered by summing buckets; only the
+partial months at either end of the range fall back to an exact database
+count, so a count over years of history costs at most two small queries.
+"""
+import threading
+from datetime import date, timedelta
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from id_mapping import region_map, commodity_map
+
+ExactCount = Callable[[Optional[List[str]], Optional[List[str]], Optional[date], Optional[date]], int]
+
+
+def month_number(value: date) -> int:
+    return value.year * 12 + value.month - 1
+
+
+def month_start(number: int) -> date:
+    return date(number // 12, number % 12 + 1, 1)
+
+
+class CountIndex:
+    def __init__(self, client, exact_count: ExactCount, page_size: int = 1000):
+        self.client = client
+        self.exact_count = exact_count
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.region_codes = {rid: i for i, rid in enumerate(region_map.values())}
+        self.commodity_codes = {cid: i for i, cid in enumerate(commodity_map.values())}
+        self.counts: Optional[np.ndarray] = None
+        self.first_month = 0
+
+    # Building
+    def _code(self, codes: dict, value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def _bucket_codes(self, rows):
+        regions = np.fromiter((self._code(self.region_codes, r["region_id"]) for r in rows), dtype=np.int64, count=len(rows))
+        commodities = np.fromiter((self._code(self.commodity_codes, r["commodity_id"]) for r in rows), dtype=np.int64, count=len(rows))
+        months = np.fromiter((month_number(date.fromisoformat(str(r["date"])[:10])) for r in rows), dtype=np.int64, count=len(rows))
+        return regions, commodities, months
+
+    def _ensure_shape(self, n_months_from: int, n_months_to: int) -> None:
+        regions, commodities = len(self.region_codes), len(self.commodity_codes)
+        if self.counts is None or not self.counts.shape[2]:
+            self.first_month = n_months_from
+            self.counts = np.zeros((regions, commodities, n_months_to - n_months_from + 1), dtype=np.int64)
+            return
+        lead = max(0, self.first_month - n_months_from)
+        trail = max(0, n_months_to - (self.first_month + self.counts.shape[2] - 1))
+        pad_regions = regions - self.counts.shape[0]
+        pad_commodities = commodities - self.counts.shape[1]
+        if lead or trail or pad_regions or pad_commodities:
+            self.counts = np.pad(self.counts, ((0, pad_regions), (0, pad_commodities), (lead, trail)))
+            self.first_month -= lead
+
+    def _apply(self, rows, sign: int) -> None:
+        if not rows:
+            return
+        regions, commodities, months = self._bucket_codes(rows)
+        self._ensure_shape(int(months.min()), int(months.max()))
+        np.add.at(self.counts, (regions, commodities, months - self.first_month), sign)
+
+    def build(self) -> None:
+        rows = []
+        start = 0
+        while True:
+            page = (
+                self.client.table("prices")
+                .select("region_id,commodity_id,date")
+                .order("id")
+                .range(start, start + self.page_size - 1)
+                .execute()
+                .data
+            )
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+            start += self.page_size
+        with self.lock:
+            self.counts = np.zeros((len(self.region_codes), len(self.commodity_codes), 0), dtype=np.int64)
+            self._apply(rows, 1)
+
+    def _ready(self) -> None:
+        if self.counts is None:
+            self.build()
+
+    # Write listener interface
+    def rows_changed(self, removed, added) -> None:
+        with self.lock:
+            if self.counts is None:
+                return
+            self._apply(removed, -1)
+            self._apply(added, 1)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counts = None
+
+    # Queries
+    def _full_months(self, region_ids, commodity_ids, first: int, last: int) -> int:
+        counts = self.counts
+        if region_ids is not None:
+            counts = counts[sorted({self.region_codes[r] for r in region_ids if r in self.region_codes})]
+        if commodity_ids is not None:
+            counts = counts[:, sorted({self.commodity_codes[c] for c in commodity_ids if c in self.commodity_codes})]
+        lo = max(first - self.first_month, 0)
+        hi = min(last - self.first_month, counts.shape[2] - 1)
+        if lo > hi:
+            return 0
+        return int(counts[:, :, lo:hi + 1].sum())
+
+    def count(self, region_ids: Optional[List[str]], commodity_ids: Optional[List[str]],
+              start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+        self._ready()
+        if start_date and end_date and start_date > end_date:
+            return 0
+
+        with self.lock:
+            if start_date is None and end_date is None:
+                return self._full_months(region_ids, commodity_ids, self.first_month, self.first_month + self.counts.shape[2] - 1)
+
+            first = month_number(start_date) if start_date else self.first_month
+            last = month_number(end_date) if end_date else self.first_month + self.counts.shape[2] - 1
+            head_partial = start_date is not None and start_date.day != 1
+            tail_partial = end_date is not None and (end_date + timedelta(days=1)).day != 1
+
+            if first == last and (head_partial or tail_partial):
+                partial_ranges = [(start_date, end_date)]
+                full = 0
+            else:
+                partial_ranges = []
+                if head_partial:
+                    partial_ranges.append((start_date, month_start(first + 1) - timedelta(days=1)))
+                    first += 1
+                if tail_partial:
+                    partial_ranges.append((month_start(last), end_date))
+                    last -= 1
+                full = self._full_months(region_ids, commodity_ids, first, last)
+
+        # Exact counts run outside the lock; they are separate database queries
+        return full + sum(self.exact_count(region_ids, commodity_ids, lo, hi) for lo, hi in partial_ranges)
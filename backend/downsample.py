@@ -0,0 +1,89 @@
+"""Largest-Triangle-Three-Buckets downsampling for many series at once.
+
+LTTB keeps the first and last point of a series and, for each of the
+``max_points - 2`` buckets in between, the point forming the largest triangle
+with the previously kept point and the average of the next bucket. That
+keeps visual peaks and troughs, unlike averaging.
+
+The selection is sequential within a series, so the loop runs over bucket
+positions; each step handles that bucket of *every* series with NumPy. The
+number of Python iterations is ``max_points`` whatever the number or length
+of the series.
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def series_bounds(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start offsets and lengths of runs of equal keys (rows grouped by series)"""
+    if not len(keys):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    lengths = np.diff(np.concatenate((starts, [len(keys)])))
+    return starts, lengths
+
+
+def lttb(x: np.ndarray, y: np.ndarray, starts: np.ndarray, lengths: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of the points to keep, in input order.
+
+    ``x``/``y`` hold all series back to back, each sorted by ``x``;
+    ``starts``/``lengths`` locate the series. Series with at most
+    ``max_points`` points are kept whole.
+    """
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+
+    short = lengths <= max_points
+    keep = [np.repeat(starts[short], lengths[short]) + _ranges(lengths[short])]
+
+    starts, lengths = starts[~short], lengths[~short]
+    if len(starts):
+        # Prefix sums give every bucket average in one subtraction
+        cx = np.concatenate(([0.0], np.cumsum(x)))
+        cy = np.concatenate(([0.0], np.cumsum(y)))
+        every = (lengths - 2) / (max_points - 2)
+        last = starts + lengths - 1
+        selected = starts.copy()
+        keep.extend([starts, last])
+
+        for i in range(max_points - 2):
+            lo = starts + np.floor(i * every).astype(np.int64) + 1
+            hi = starts + np.floor((i + 1) * every).astype(np.int64) + 1
+            if i == max_points - 3:
+                next_lo, next_hi = last, last + 1
+            else:
+                next_lo = hi
+                next_hi = np.minimum(starts + np.floor((i + 2) * every).astype(np.int64) + 1, last + 1)
+            count = next_hi - next_lo
+            avg_x = (cx[next_hi] - cx[next_lo]) / count
+            avg_y = (cy[next_hi] - cy[next_lo]) / count
+
+            size = hi - lo
+            segment = np.repeat(np.arange(len(lo)), size)
+            points = np.repeat(lo, size) + _ranges(size)
+            ax, ay = x[selected][segment], y[selected][segment]
+            area = np.abs((ax - avg_x[segment]) * (y[points] - ay) - (ax - x[points]) * (avg_y[segment] - ay))
+
+            # First point with the largest area in each bucket
+            offsets = np.concatenate(([0], np.cumsum(size)[:-1]))
+            best = np.maximum.reduceat(area, offsets)
+            candidates = np.flatnonzero(area == best[segment])
+            first = np.unique(segment[candidates], return_index=True)[1]
+            selected = points[candidates[first]]
+            keep.append(selected)
+
+    return np.sort(np.concatenate(keep))
+
+
+def _ranges(lengths: np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(n)`` for each n in ``lengths``"""
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(total, dtype=np.int64) - offsets
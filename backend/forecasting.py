@@ -0,0 +1,317 @@
+"""Price forecasts for every (region, commodity) series.
+
+Each series gets an additive damped-trend Holt model on log prices. Its
+smoothing parameters are picked from a small grid by one-step squared error.
+Every series and every grid point of a chunk runs through one numpy
+recursion over time, so fitting a chunk costs a few hundred vectorized steps.
+Chunks are fanned out over a process pool when a full refresh has more than
+one.
+
+Fitted models are cached per series. The service is a write listener: a
+changed price marks the model of its series stale. Requests never fit: series
+without a current model are queued for a background refit (one at a time, on
+a process pool kept for the service's lifetime) and the request is answered
+from the models at hand, stale ones included. A forecast for any horizon is a
+closed-form extrapolation of the cached model.
+
+CLI (writes the ``outputfinal.csv`` layout)::
+
+    python forecasting.py --horizon 92 --out forecasts.csv [paths ...]
+
+Without paths the series are read from the database.
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from id_mapping import region_map, commodity_map
+
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "730"))
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", str(os.cpu_count() or 1)))
+FORECAST_CHUNK_SIZE = int(os.getenv("FORECAST_CHUNK_SIZE", "64"))
+MAX_HORIZON = 365
+
+# Observed days a series needs inside the history window to get a model
+MIN_HISTORY = 14
+# One-step errors of the first days are dominated by the initial state
+WARMUP = 7
+
+ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9)
+BETAS = (0.0, 0.01, 0.05, 0.1, 0.2)
+PHIS = (0.8, 0.9, 0.95, 0.98)
+GRID = np.array(list(itertools.product(ALPHAS, BETAS, PHIS)))
+
+Series = Tuple[str, str]
+FetchRows = Callable[[Optional[List[str]], Optional[List[str]], Optional[date], Optional[date]], List[Dict[str, Any]]]
+LatestDay = Callable[[Optional[List[str]], Optional[List[str]]], Optional[date]]
+
+logger = logging.getLogger(__name__)
+
+
+class Model(NamedTuple):
+    level: float
+    trend: float
+    phi: float
+    # Day of the final state; forecasts start the day after
+    last_date: date
+    # Root mean squared one-step error, in log price
+    rmse: float
+
+    def predict(self, horizon: int) -> np.ndarray:
+        steps = np.cumsum(self.phi ** np.arange(1, horizon + 1))
+        return np.exp(self.level + self.trend * steps)
+
+
+def series_matrix(frame: pd.DataFrame, history_days: int = FORECAST_HISTORY_DAYS):
+    """Tidy ``region_id, commodity_id, date, price`` rows -> ``(series keys,
+    days, values, observed counts)`` with one daily column per series over the
+    last ``history_days``; gaps are carried forward, leading gaps backward."""
+    frame = frame.dropna(subset=["price"])
+    frame = frame.assign(date=pd.to_datetime(frame["date"].astype(str).str[:10]), price=frame["price"].astype(float))
+    wide = frame.pivot_table(index="date", columns=["region_id", "commodity_id"], values="price", aggfunc="mean")
+    end = wide.index.max()
+    start = max(wide.index.min(), end - pd.Timedelta(days=history_days - 1))
+    days = pd.date_range(start, end, freq="D")
+    wide = wide.loc[start:].reindex(days)
+    counts = wide.notna().sum().to_numpy()
+    values = wide.ffill().bfill().to_numpy(dtype=float)
+    return list(wide.columns), days, values, counts
+
+
+def fit_matrix(values: np.ndarray):
+    """Fit every column of a ``(days, series)`` price matrix.
+
+    Returns per-series ``(level, trend, phi, rmse)`` arrays for the grid
+    point with the smallest one-step squared error.
+    """
+    y = np.log(values)
+    steps, width = y.shape
+    alpha, beta, phi = (GRID[:, i, None] for i in range(3))
+    level = np.repeat(y[:1], len(GRID), axis=0)
+    trend = np.zeros_like(level)
+    sse = np.zeros_like(level)
+    for t in range(1, steps):
+        forecast = level + phi * trend
+        error = y[t] - forecast
+        if t >= WARMUP:
+            sse += error * error
+        level = forecast + alpha * error
+        trend = phi * trend + alpha * beta * error
+    best = np.where(np.isnan(sse), np.inf, sse).argmin(axis=0)
+    columns = np.arange(width)
+    rmse = np.sqrt(sse[best, columns] / max(steps - WARMUP, 1))
+    return level[best, columns], trend[best, columns], GRID[best, 2], rmse
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: the API process runs threads, which fork does not carry over safely
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def fit_frame(frame: pd.DataFrame, history_days: int = FORECAST_HISTORY_DAYS, workers: int = 1,
+              chunk_size: int = FORECAST_CHUNK_SIZE, pool: Optional[Executor] = None) -> Dict[Series, Optional[Model]]:
+    """Models for every series in ``frame``; None for series with too little history.
+
+    Several chunks run on ``pool`` if given, else on a pool of ``workers``
+    processes started for this call.
+    """
+    if frame.empty:
+        return {}
+    keys, days, values, counts = series_matrix(frame, history_days)
+    chunks = [values[:, start:start + chunk_size] for start in range(0, len(keys), chunk_size)]
+    if pool is not None and len(chunks) > 1:
+        results = list(pool.map(fit_matrix, chunks))
+    elif workers > 1 and len(chunks) > 1:
+        with process_pool(min(workers, len(chunks))) as pool:
+            results = list(pool.map(fit_matrix, chunks))
+    else:
+        results = [fit_matrix(chunk) for chunk in chunks]
+    level, trend, phi, rmse = (np.concatenate(parts).tolist() for parts in zip(*results))
+    last_date = days[-1].date()
+    return {
+        key: Model(level[i], trend[i], phi[i], last_date, rmse[i]) if counts[i] >= MIN_HISTORY else None
+        for i, key in enumerate(keys)
+    }
+
+
+def forecast_rows(models: Dict[Series, Optional[Model]], horizon: int) -> List[Dict[str, Any]]:
+    """``{region_id, commodity_id, date, price}`` per series and future day"""
+    rows = []
+    for (region_id, commodity_id), model in sorted(models.items()):
+        if model is None:
+            continue
+        for step, price in enumerate(model.predict(horizon).tolist(), start=1):
+            rows.append({
+                "region_id": region_id,
+                "commodity_id": commodity_id,
+                "date": (model.last_date + timedelta(days=step)).isoformat(),
+                "price": price,
+            })
+    return rows
+
+
+class ForecastService:
+    def __init__(self, fetch_rows: FetchRows, latest_day: LatestDay, workers: int = FORECAST_WORKERS,
+                 chunk_size: int = FORECAST_CHUNK_SIZE, history_days: int = FORECAST_HISTORY_DAYS):
+        self.fetch_rows = fetch_rows
+        self.latest_day = latest_day
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.history_days = history_days
+        self.lock = threading.Lock()
+        self.models: Dict[Series, Optional[Model]] = {}
+        # Series whose model predates a write to them
+        self.stale: set = set()
+        # Series waiting for or in a background refit
+        self.queued: set = set()
+        # Bumped per series on every write, and for all on reset; models fitted
+        # across a bump are not stored
+        self.versions: Dict[Series, int] = {}
+        self.generation = 0
+        # Background refits run one at a time; their chunks share one process pool
+        self.refits = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast")
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 1:
+            return None
+        with self.lock:
+            if self.pool is None:
+                self.pool = process_pool(self.workers)
+            return self.pool
+
+    def fit(self, region_ids: Optional[List[str]] = None, commodity_ids: Optional[List[str]] = None) -> int:
+        """(Re)fit every series matching the filters; returns the number fitted"""
+        with self.lock:
+            generation, versions = self.generation, dict(self.versions)
+        # Only the window the models are fitted on, which ends at the last observed day
+        last_day = self.latest_day(region_ids, commodity_ids)
+        start_date = last_day - timedelta(days=self.history_days - 1) if last_day else None
+        rows = self.fetch_rows(region_ids, commodity_ids, start_date, None) if last_day else []
+        frame = pd.DataFrame(rows, columns=["region_id", "commodity_id", "date", "price"])
+        models = fit_frame(frame, self.history_days, self.workers, self.chunk_size, self._pool())
+        wanted = {
+            (region_id, commodity_id)
+            for region_id in (region_ids or region_map.values())
+            for commodity_id in (commodity_ids or commodity_map.values())
+        }
+        with self.lock:
+            if self.generation != generation:
+                return 0
+            for series in wanted:
+                if self.versions.get(series) == versions.get(series):
+                    self.models[series] = models.get(series)
+                    self.stale.discard(series)
+        return sum(model is not None for model in models.values())
+
+    def _refit(self, series: List[Series]) -> None:
+        try:
+            self.fit(sorted({region_id for region_id, _ in series}), sorted({commodity_id for _, commodity_id in series}))
+        except Exception:
+            logger.exception("Refitting %d forecast series failed; the next request retries", len(series))
+        finally:
+            with self.lock:
+                self.queued.difference_update(series)
+
+    def forecast(self, region_ids: Optional[List[str]], commodity_ids: Optional[List[str]],
+                 horizon: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """Forecast rows for the matching series from the models at hand, and
+        whether some of them are being (re)fitted in the background"""
+        wanted = [
+            (region_id, commodity_id)
+            for region_id in (region_ids or region_map.values())
+            for commodity_id in (commodity_ids or commodity_map.values())
+        ]
+        with self.lock:
+            outdated = [series for series in wanted if series not in self.models or series in self.stale]
+            unqueued = [series for series in outdated if series not in self.queued]
+            self.queued.update(unqueued)
+            models = {series: self.models.get(series) for series in wanted}
+        if unqueued:
+            self.refits.submit(self._refit, unqueued)
+        return forecast_rows(models, horizon), bool(outdated)
+
+    def close(self) -> None:
+        self.refits.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    # Write listener interface
+    def rows_changed(self, removed, added) -> None:
+        with self.lock:
+            for row in list(removed) + list(added):
+                series = (row["region_id"], row["commodity_id"])
+                self.stale.add(series)
+                self.versions[series] = self.versions.get(series, 0) + 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stale.update(self.models)
+            self.generation += 1
+
+
+def keyed_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Forecast rows in the ``outputfinal.csv`` layout (``Commodity/Region/Date``, price)"""
+    region_names = {region_id: name for name, region_id in region_map.items()}
+    commodity_names = {commodity_id: name for name, commodity_id in commodity_map.items()}
+    return pd.DataFrame({
+        "id": [f"{commodity_names[r['commodity_id']]}/{region_names[r['region_id']]}/{r['date']}" for r in rows],
+        "price": [r["price"] for r in rows],
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forecast every region x commodity price series")
+    parser.add_argument("paths", nargs="*", help="CSV/Parquet price files to fit on (default: the database)")
+    parser.add_argument("--horizon", type=int, default=92, help="Days to forecast")
+    parser.add_argument("--out", default="forecasts.csv")
+    parser.add_argument("--workers", type=int, default=FORECAST_WORKERS)
+    parser.add_argument("--history-days", type=int, default=FORECAST_HISTORY_DAYS)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.paths:
+        import bulk_ingest
+
+        rows, _ = bulk_ingest.prepare_rows(bulk_ingest.load_paths(args.paths), created_by="", skip_missing=True)
+        frame = pd.DataFrame(rows, columns=["region_id", "commodity_id", "date", "price"])
+    else:
+        from supabase_client import supabase
+
+        frame = pd.DataFrame(columns=["region_id", "commodity_id", "date", "price"])
+        pages, start, page_size = [], 0, 1000
+        while True:
+            page = (
+                supabase.table("prices").select("region_id,commodity_id,date,price")
+                .order("id").range(start, start + page_size - 1).execute().data
+            )
+            pages.append(pd.DataFrame(page, columns=frame.columns))
+            if len(page) < page_size:
+                break
+            start += page_size
+        frame = pd.concat(pages, ignore_index=True)
+    print(f"Loaded {len(frame)} rows in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    models = fit_frame(frame, args.history_days, args.workers)
+    fitted = sum(model is not None for model in models.values())
+    print(f"Fitted {fitted} of {len(models)} series in {time.perf_counter() - started:.1f}s")
+
+    keyed_frame(forecast_rows(models, args.horizon)).to_csv(args.out, index=False)
+    print(f"Wrote {fitted * args.horizon} forecasts to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
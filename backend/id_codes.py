@@ -0,0 +1,46 @@
+"""Compact integer codes for region and commodity ids.
+
+A code is the position of the id in ``id_mapping`` (the order the columnar
+store and the Arrow dictionaries already use), so codes stay stable as long
+as new regions and commodities are appended. Responses requested with
+``ids=code`` carry these codes instead of 36-character UUIDs, plus one
+``X-Id-Dictionary`` header mapping every code back to its id and name.
+"""
+import json
+from typing import Any, AsyncIterator, Dict, List
+
+from id_mapping import region_map, commodity_map
+
+DICTIONARY_HEADER = "X-Id-Dictionary"
+
+DICTIONARY = {
+    "region_id": {"ids": list(region_map.values()), "names": list(region_map)},
+    "commodity_id": {"ids": list(commodity_map.values()), "names": list(commodity_map)},
+}
+DICTIONARY_JSON = json.dumps(DICTIONARY, separators=(",", ":"))
+
+CODES = {
+    column: {id_: code for code, id_ in enumerate(entry["ids"])}
+    for column, entry in DICTIONARY.items()
+}
+
+
+def encode_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copies of ``rows`` with region/commodity ids replaced by their codes
+    (unknown ids become None); the input rows may be shared cache entries,
+    so they are left untouched."""
+    if not rows:
+        return rows
+    columns = [column for column in CODES if column in rows[0]]
+    encoded = []
+    for row in rows:
+        row = dict(row)
+        for column in columns:
+            row[column] = CODES[column].get(row[column])
+        encoded.append(row)
+    return encoded
+
+
+async def encode_pages(pages: AsyncIterator[List[Dict[str, Any]]]):
+    async for page in pages:
+        yield encode_rows(page)
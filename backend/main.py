@@ -1,111 +1,676 @@
-from fastapi import FastAPI, Query, HTTPException
-from datetime import date
+import os
+import io
+import csv
+import json
+import time
+import uuid
+import base64
+import asyncio
+import logging
+import pandas as pd
+from contextlib import asynccontextmanager, aclosing
+from fastapi import FastAPI, Query, HTTPException, Request, Response, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from postgrest.exceptions import APIError
+from datetime import date, timedelta
 from typing import List, Optional
 
-from models import PriceData, PriceUpdate
-from supabase_client import supabase
+from models import PriceData, PriceUpdate, PriceSelection, BulkPriceUpdate, BatchRequest
+from supabase_client import supabase, async_supabase, PRICE_STORE
 from id_mapping import region_map, commodity_map
+from count_index import CountIndex
+from query_cache import QueryCache, CacheFilter
+from change_log import ChangeLog
+from rollups import Rollups
+from snapshot_index import SnapshotIndex
+from anomalies import AnomalyDetector
+from forecasting import ForecastService, MAX_HORIZON
+import write_hooks
+import bulk_ingest
+import aggregation
+import arrow_format
+import metrics
+import id_codes
+import batch_queries
+import rolling
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+def log_warmup_failure(future):
+    if not future.cancelled() and future.exception():
+        logger.error("Building the anomaly detector state failed; the first write retries it",
+                     exc_info=future.exception())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if anomaly_detector:
+        # Built in the background; a write arriving first waits for it
+        app.state.anomaly_warmup = asyncio.get_running_loop().run_in_executor(None, anomaly_detector.ready)
+        app.state.anomaly_warmup.add_done_callback(log_warmup_failure)
+    yield
+    forecasts.close()
+    await async_supabase.aclose()
+
+app = FastAPI(lifespan=lifespan)
+# Per-stage timings: Server-Timing header on every response, histograms on /metrics
+app.router.route_class = metrics.TimedRoute
+app.add_middleware(metrics.MetricsMiddleware)
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "Food Price API is running 🚀"}
 
-@app.get("/data")
-def get_data(
-    start_date: Optional[date] = Query(None),
-    end_date: Optional[date] = Query(None),
-    regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
-    commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by"),
-    limit: int = Query(10000, description="Maximum number of records to return")
-):
-    query = supabase.table("prices").select("*")
-
-    # Handle multiple regions
-    if regions:
+def resolve_region_ids(regions: Optional[List[str]]) -> Optional[List[str]]:
+    if not regions:
+        return None
+    with metrics.stage("resolve"):
         region_ids = []
         for region in regions:
             region_id = region_map.get(region.strip())
             if not region_id:
                 raise HTTPException(status_code=404, detail=f"Region '{region}' not found")
             region_ids.append(region_id)
-        
-        if len(region_ids) == 1:
-            query = query.eq("region_id", region_ids[0])
-        else:
-            query = query.in_("region_id", region_ids)
-
-    # Handle multiple commodities
-    if commodities:
+        return region_ids
+
+def resolve_commodity_ids(commodities: Optional[List[str]]) -> Optional[List[str]]:
+    if not commodities:
+        return None
+    with metrics.stage("resolve"):
         commodity_ids = []
         for commodity in commodities:
             commodity_id = commodity_map.get(commodity.strip())
             if not commodity_id:
                 raise HTTPException(status_code=404, detail=f"Commodity '{commodity}' not found")
             commodity_ids.append(commodity_id)
-        
-        if len(commodity_ids) == 1:
-            query = query.eq("commodity_id", commodity_ids[0])
-        else:
-            query = query.in_("commodity_id", commodity_ids)
+        return commodity_ids
+
+def apply_filters(query, region_ids=None, commodity_ids=None, start_date=None, end_date=None):
+    """Add the region/commodity/date filters shared by every read endpoint"""
+    with metrics.stage("filter"):
+        if region_ids:
+            if len(region_ids) == 1:
+                query = query.eq("region_id", region_ids[0])
+            else:
+                query = query.in_("region_id", region_ids)
+
+        if commodity_ids:
+            if len(commodity_ids) == 1:
+                query = query.eq("commodity_id", commodity_ids[0])
+            else:
+                query = query.in_("commodity_id", commodity_ids)
+
+        if start_date:
+            query = query.gte("date", start_date.isoformat())
+        if end_date:
+            query = query.lte("date", end_date.isoformat())
+        return query
+
+async def execute(query):
+    """Run an async query chain; the wait counts as the request's "db" stage"""
+    with metrics.stage("db"):
+        return await query.execute()
+
+def exact_count(region_ids=None, commodity_ids=None, start_date=None, end_date=None) -> int:
+    """Let the database count matching rows; no rows are transferred"""
+    query = supabase.table("prices").select("id", count="exact", head=True)
+    query = apply_filters(query, region_ids, commodity_ids, start_date, end_date)
+    with metrics.stage("db"):
+        return query.execute().count or 0
+
+async def exact_count_async(region_ids=None, commodity_ids=None, start_date=None, end_date=None) -> int:
+    query = async_supabase.table("prices").select("id", count="exact", head=True)
+    query = apply_filters(query, region_ids, commodity_ids, start_date, end_date)
+    return (await execute(query)).count or 0
+
+# Month-bucketed counts, maintained on every write (COUNT_INDEX=1 to enable)
+count_index = CountIndex(supabase, exact_count) if os.getenv("COUNT_INDEX", "0") == "1" else None
+if count_index:
+    write_hooks.register(count_index)
+
+def fetch_rows(region_ids=None, commodity_ids=None, start_date=None, end_date=None):
+    """Every matching row (aggregation columns), paged synchronously by (date, id)"""
+    rows = []
+    while True:
+        query = supabase.table("prices").select(aggregation.SOURCE_COLUMNS)
+        query = apply_filters(query, region_ids, commodity_ids, start_date, end_date)
+        query = query.order("date").order("id").range(len(rows), len(rows) + STREAM_PAGE_SIZE - 1)
+        with metrics.stage("db"):
+            page = query.execute().data
+        rows.extend(page)
+        if len(page) < STREAM_PAGE_SIZE:
+            return rows
+
+def latest_price_day(region_ids=None, commodity_ids=None) -> Optional[date]:
+    query = apply_filters(supabase.table("prices").select("date"), region_ids, commodity_ids)
+    with metrics.stage("db"):
+        rows = query.order("date", desc=True).limit(1).execute().data
+    return date.fromisoformat(str(rows[0]["date"])[:10]) if rows else None
+
+# Week/month/year rollups per series, maintained on every write (ROLLUPS=1 to enable)
+rollups = Rollups(supabase, fetch_rows) if os.getenv("ROLLUPS", "0") == "1" else None
+if rollups:
+    write_hooks.register(rollups)
+
+# Per-series sorted date index for as-of snapshots, maintained on every write (SNAPSHOT_INDEX=0 to disable)
+snapshot_index = SnapshotIndex(supabase) if os.getenv("SNAPSHOT_INDEX", "1") == "1" else None
+if snapshot_index:
+    write_hooks.register(snapshot_index)
+# How old a price may be and still stand in for a day without one
+SNAPSHOT_MAX_AGE_DAYS = int(os.getenv("SNAPSHOT_MAX_AGE_DAYS", "30"))
 
-    if start_date:
-        query = query.gte("date", start_date.isoformat())
-    if end_date:
-        query = query.lte("date", end_date.isoformat())
+# Running per-series price state for scoring writes (ANOMALY_DETECTION=0 to disable)
+anomaly_detector = AnomalyDetector(
+    supabase,
+    alpha=float(os.getenv("ANOMALY_ALPHA", "0.1")),
+    threshold=float(os.getenv("ANOMALY_THRESHOLD", "5")),
+    cross_region=os.getenv("ANOMALY_CROSS_REGION", "1") == "1",
+    capacity=int(os.getenv("ANOMALY_LOG_SIZE", "1000")),
+) if os.getenv("ANOMALY_DETECTION", "1") == "1" else None
+if anomaly_detector:
+    write_hooks.register(anomaly_detector)
 
-    response = query.limit(limit).execute()
-    return response.data
+# Fitted forecast models per series, refitted in the background when a price of the series changes
+forecasts = ForecastService(fetch_rows, latest_price_day)
+write_hooks.register(forecasts)
+
+# Read results cached on their filters, invalidated by writes (QUERY_CACHE=1 to enable)
+query_cache = QueryCache(
+    max_payload_bytes=int(os.getenv("QUERY_CACHE_MAX_PAYLOAD_BYTES", str(64 << 20))),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "60")),
+) if os.getenv("QUERY_CACHE", "0") == "1" else None
+if query_cache:
+    write_hooks.register(query_cache)
+
+# Recent row changes, so clients can sync deltas with `since` (CHANGE_LOG_SIZE=0 to disable).
+# The log only sees the writes made through this process, so it is kept only
+# where those are all of them: an in-process store, or a database whose only
+# writer is declared to be this one API worker (CHANGE_LOG_SINGLE_WRITER=1,
+# ignored when WEB_CONCURRENCY asks for several). Otherwise no watermark is
+# issued and `since` answers 410, so clients always fetch in full.
+CHANGE_LOG_SIZE = int(os.getenv("CHANGE_LOG_SIZE", "100000"))
+CHANGE_LOG_SINGLE_WRITER = os.getenv("CHANGE_LOG_SINGLE_WRITER", "0") == "1"
+API_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+change_log_complete = PRICE_STORE in ("local", "cube") or (CHANGE_LOG_SINGLE_WRITER and API_WORKERS <= 1)
+change_log = ChangeLog(CHANGE_LOG_SIZE) if CHANGE_LOG_SIZE > 0 and change_log_complete else None
+if change_log:
+    write_hooks.register(change_log)
+
+WATERMARK_HEADER = "X-Watermark"
+
+async def cached(kind, filters: CacheFilter, extra: tuple, compute):
+    if not query_cache:
+        return await compute()
+    return await query_cache.aget_or_compute(kind, filters, extra, compute)
+
+async def fetch_price_row(price_id: str):
+    """Current image of a row, used to tell write listeners what changed"""
+    rows = (await execute(async_supabase.table("prices").select("*").eq("id", price_id))).data
+    return rows[0] if rows else None
+
+# Rows fetched per round trip when paging through results internally
+STREAM_PAGE_SIZE = int(os.getenv("STREAM_PAGE_SIZE", "5000"))
+
+def encode_cursor(row, column="date") -> str:
+    return base64.urlsafe_b64encode(f"{row[column]}|{row['id']}".encode()).decode()
+
+def decode_cursor(cursor: str, column="date"):
+    """Cursor -> (sort value, id) of the last row already returned"""
+    try:
+        last_value, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        last_value = date.fromisoformat(last_value).isoformat() if column == "date" else float(last_value)
+        return last_value, str(uuid.UUID(last_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_key(query, column, after, desc=False):
+    """Keyset condition: rows past the (column value, id) pair ``after`` in (column, id) order"""
+    last_value, last_id = after
+    op = "lt" if desc else "gt"
+    query = query.lte(column, last_value) if desc else query.gte(column, last_value)
+    return query.or_(f"{column}.{op}.{last_value},and({column}.eq.{last_value},id.{op}.{last_id})")
+
+async def fetch_page(region_ids, commodity_ids, start_date, end_date, page_size, after=None, columns="*"):
+    """One keyset page ordered by (date, id), starting after the (date, id) pair `after`"""
+    query = async_supabase.table("prices").select(columns)
+    query = apply_filters(query, region_ids, commodity_ids, start_date, end_date)
+    if after:
+        query = after_key(query, "date", after)
+    return (await execute(query.order("date").order("id").limit(page_size))).data
+
+async def iter_pages(region_ids, commodity_ids, start_date, end_date, max_rows=None, after=None, columns="*"):
+    """Walk all matching rows page by page; memory stays bounded by one page"""
+    remaining = max_rows
+    while remaining is None or remaining > 0:
+        page_size = STREAM_PAGE_SIZE if remaining is None else min(STREAM_PAGE_SIZE, remaining)
+        page = await fetch_page(region_ids, commodity_ids, start_date, end_date, page_size, after, columns)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after = (page[-1]["date"], page[-1]["id"])
+        if remaining is not None:
+            remaining -= len(page)
+
+IDS_DESCRIPTION = "uuid, or code for small integer region/commodity codes (dictionary in the X-Id-Dictionary header)"
+
+def coded(rows, ids, response: Response):
+    """Rows as requested by the ``ids`` parameter; codes come with the dictionary header"""
+    if ids != "code":
+        return rows
+    response.headers[id_codes.DICTIONARY_HEADER] = id_codes.DICTIONARY_JSON
+    with metrics.stage("serialize"):
+        return id_codes.encode_rows(rows)
+
+async def stream_ndjson(pages):
+    async for page in pages:
+        with metrics.stage("serialize"):
+            chunk = "".join(json.dumps(row) + "\n" for row in page)
+        yield chunk
+
+async def stream_csv(pages):
+    header_written = False
+    async for page in pages:
+        with metrics.stage("serialize"):
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=list(page[0].keys()))
+            if not header_written:
+                writer.writeheader()
+                header_written = True
+            writer.writerows(page)
+        yield buffer.getvalue()
+
+def changes_since(since: str, filters: CacheFilter, ids, response: Response):
+    """Rows inserted or updated and ids deleted after a watermark"""
+    if not change_log:
+        raise HTTPException(status_code=410, detail="This server does not track changes; fetch the data again")
+    result = change_log.changes_since(since, filters.matches)
+    if result is None:
+        raise HTTPException(status_code=410, detail="Watermark can no longer be served; fetch the data again")
+    upserts, deleted, watermark = result
+    response.headers[WATERMARK_HEADER] = watermark
+    return {"watermark": watermark, "upserts": coded(upserts, ids, response), "deleted": deleted}
+
+@app.get("/data")
+async def get_data(
+    request: Request,
+    response: Response,
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by"),
+    limit: Optional[int] = Query(None, description="Maximum number of records to return (default 10000 for json, unlimited when streaming)"),
+    page_size: Optional[int] = Query(None, ge=1, description="Return one keyset page ordered by (date, id); the next cursor is sent in X-Next-Cursor"),
+    cursor: Optional[str] = Query(None, description="Cursor from a previous page's X-Next-Cursor header"),
+    format: str = Query("json", pattern="^(json|ndjson|csv|arrow|parquet)$", description="json, or ndjson/csv/arrow/parquet to stream every matching row"),
+    ids: str = Query("uuid", pattern="^(uuid|code)$", description=IDS_DESCRIPTION + "; Arrow and Parquet are always dictionary-encoded"),
+    since: Optional[str] = Query(None, description="Watermark from a previous X-Watermark header: return only the changes after it")
+):
+    region_ids = resolve_region_ids(regions)
+    commodity_ids = resolve_commodity_ids(commodities)
+    if since is not None:
+        return changes_since(since, CacheFilter.of(region_ids, commodity_ids, start_date, end_date), ids, response)
+    after = decode_cursor(cursor) if cursor else None
+
+    # Taken before reading, so a change racing the read is sent again rather than missed
+    headers = {WATERMARK_HEADER: change_log.watermark()} if change_log else {}
+    response.headers.update(headers)
+
+    accept = request.headers.get("accept", "")
+    if format == "json" and arrow_format.ARROW_MEDIA_TYPE in accept:
+        format = "arrow"
+    elif format == "json" and arrow_format.PARQUET_MEDIA_TYPE in accept:
+        format = "parquet"
+
+    if format != "json":
+        pages = metrics.count_rows(iter_pages(region_ids, commodity_ids, start_date, end_date, limit, after))
+        if format == "arrow":
+            return StreamingResponse(arrow_format.stream_arrow(pages), media_type=arrow_format.ARROW_MEDIA_TYPE,
+                                     headers=headers)
+        if format == "parquet":
+            return StreamingResponse(arrow_format.stream_parquet(pages), media_type=arrow_format.PARQUET_MEDIA_TYPE,
+                                     headers=headers)
+        if ids == "code":
+            pages = id_codes.encode_pages(pages)
+            headers[id_codes.DICTIONARY_HEADER] = id_codes.DICTIONARY_JSON
+        if format == "ndjson":
+            return StreamingResponse(stream_ndjson(pages), media_type="application/x-ndjson", headers=headers)
+        return StreamingResponse(stream_csv(pages), media_type="text/csv", headers=headers)
+
+    filters = CacheFilter.of(region_ids, commodity_ids, start_date, end_date)
+    if page_size or after:
+        page_size = page_size or STREAM_PAGE_SIZE
+        page = await cached("page", filters, (page_size, after), lambda: fetch_page(
+            region_ids, commodity_ids, start_date, end_date, page_size, after
+        ))
+        if len(page) == page_size:
+            response.headers["X-Next-Cursor"] = encode_cursor(page[-1])
+        return coded(page, ids, response)
+
+    async def fetch():
+        query = async_supabase.table("prices").select("*")
+        query = apply_filters(query, region_ids, commodity_ids, start_date, end_date)
+        return (await execute(query.limit(limit or 10000))).data
+
+    return coded(await cached("data", filters, (limit or 10000,), fetch), ids, response)
+
+# Picker rows: ids plus what a person needs to recognise the entry
+SEARCH_COLUMNS = "id,region_id,commodity_id,date,price"
+region_names = {region_id: name for name, region_id in region_map.items()}
+commodity_names = {commodity_id: name for name, commodity_id in commodity_map.items()}
+
+def search_item(row):
+    region = region_names.get(row["region_id"], row["region_id"])
+    commodity = commodity_names.get(row["commodity_id"], row["commodity_id"])
+    return {
+        "id": row["id"],
+        "label": f"{row['date']} | {region} | {commodity} | Rp {row['price']:,.2f}",
+        "region": region,
+        "commodity": commodity,
+        "date": row["date"],
+        "price": row["price"],
+    }
+
+@app.get("/data/search")
+async def search_data(
+    response: Response,
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by"),
+    sort: str = Query("-date", pattern="^-?(date|price)$", description="date or price, with a leading - for descending; ties are ordered by id"),
+    page_size: int = Query(20, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (same filters and sort)")
+):
+    """One keyset page of labelled rows for the entry pickers"""
+    region_ids = resolve_region_ids(regions)
+    commodity_ids = resolve_commodity_ids(commodities)
+    column, desc = sort.lstrip("-"), sort.startswith("-")
+    after = decode_cursor(cursor, column) if cursor else None
+
+    async def fetch():
+        query = async_supabase.table("prices").select(SEARCH_COLUMNS)
+        query = apply_filters(query, region_ids, commodity_ids, start_date, end_date)
+        if after:
+            query = after_key(query, column, after, desc)
+        return (await execute(query.order(column, desc=desc).order("id", desc=desc).limit(page_size))).data
+
+    filters = CacheFilter.of(region_ids, commodity_ids, start_date, end_date)
+    rows = await cached("search", filters, (sort, page_size, after), fetch)
+    next_cursor = encode_cursor(rows[-1], column) if len(rows) == page_size else None
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    with metrics.stage("serialize"):
+        return {"items": [search_item(row) for row in rows], "next_cursor": next_cursor}
+
+# Filter sets accepted by one /data/batch request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "20"))
+
+async def run_scan(scan, filters, limits):
+    """Rows of every member of one shared scan, read once in (date, id) order"""
+    results = {i: [] for i in scan.members}
+    # A scan serving one filter set can stop at its limit; shared scans stop in take()
+    max_rows = limits[scan.members[0]] if len(scan.members) == 1 else None
+    async with aclosing(iter_pages(*scan.filter.query_args(), max_rows=max_rows)) as pages:
+        async for page in pages:
+            with metrics.stage("filter"):
+                done = batch_queries.take(page, scan, filters, limits, results)
+            if done:
+                break
+    return [results[i] for i in scan.members]
+
+@app.post("/data/batch")
+async def get_data_batch(batch: BatchRequest, response: Response):
+    """Several named /data filter sets in one request; overlapping ones share a scan"""
+    names = [query.name for query in batch.queries]
+    if not names:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(names) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="Query names must be unique")
+
+    filters = [
+        batch_queries.Filter.of(resolve_region_ids(query.regions), resolve_commodity_ids(query.commodities),
+                                query.start_date, query.end_date)
+        for query in batch.queries
+    ]
+    limits = [query.limit or 10000 for query in batch.queries]
+    scans = batch_queries.plan(filters)
+
+    if change_log:
+        response.headers[WATERMARK_HEADER] = change_log.watermark()
+
+    def scan_rows(scan):
+        members = tuple((filters[i], limits[i]) for i in scan.members)
+        return cached("batch", CacheFilter.of(*scan.filter.query_args()), members,
+                      lambda: run_scan(scan, filters, limits))
+
+    scanned = await asyncio.gather(*(scan_rows(scan) for scan in scans))
+    results = {}
+    for scan, rows in zip(scans, scanned):
+        for i, member_rows in zip(scan.members, rows):
+            results[i] = member_rows
+    return {
+        "results": {name: coded(results[i], batch.ids, response) for i, name in enumerate(names)},
+        "scans": len(scans),
+    }
 
 @app.get("/data/count")
-def get_data_count(
+async def get_data_count(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
     regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
     commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by")
 ):
     """Get the total count of records matching the filters"""
-    query = supabase.table("prices").select("id")
+    region_ids = resolve_region_ids(regions)
+    commodity_ids = resolve_commodity_ids(commodities)
 
-    # Handle multiple regions
-    if regions:
-        region_ids = []
-        for region in regions:
-            region_id = region_map.get(region.strip())
-            if not region_id:
-                raise HTTPException(status_code=404, detail=f"Region '{region}' not found")
-            region_ids.append(region_id)
-        
-        if len(region_ids) == 1:
-            query = query.eq("region_id", region_ids[0])
-        else:
-            query = query.in_("region_id", region_ids)
-
-    # Handle multiple commodities
-    if commodities:
-        commodity_ids = []
-        for commodity in commodities:
-            commodity_id = commodity_map.get(commodity.strip())
-            if not commodity_id:
-                raise HTTPException(status_code=404, detail=f"Commodity '{commodity}' not found")
-            commodity_ids.append(commodity_id)
-        
-        if len(commodity_ids) == 1:
-            query = query.eq("commodity_id", commodity_ids[0])
-        else:
-            query = query.in_("commodity_id", commodity_ids)
+    async def count():
+        if count_index:
+            # The index is synchronous (it may build itself or count edge months)
+            return await run_in_threadpool(count_index.count, region_ids, commodity_ids, start_date, end_date)
+        return await exact_count_async(region_ids, commodity_ids, start_date, end_date)
+
+    total = await cached("count", CacheFilter.of(region_ids, commodity_ids, start_date, end_date), (), count)
+    return {"total_count": total}
+
+@app.get("/data/aggregate")
+async def get_data_aggregate(
+    response: Response,
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by"),
+    group_by: str = Query("both", pattern="^(none|region|commodity|both)$", description="none, region, commodity or both"),
+    bucket: Optional[str] = Query(None, pattern="^(day|week|month|quarter|year)$", description="Time bucket; omit for one row per group"),
+    stats: List[str] = Query(["mean", "min", "max", "count"], description="Any of mean, min, max, median, last, count"),
+    ids: str = Query("uuid", pattern="^(uuid|code)$", description=IDS_DESCRIPTION)
+):
+    """Statistics per group and time bucket, computed on the server"""
+    unknown = [stat for stat in stats if stat not in aggregation.STATISTICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown statistics: {', '.join(unknown)}")
+    region_ids = resolve_region_ids(regions)
+    commodity_ids = resolve_commodity_ids(commodities)
+
+    async def compute():
+        if rollups and rollups.supports(bucket, stats):
+            # Synchronous like the count index: it may build itself or read edge rows
+            return await run_in_threadpool(
+                rollups.aggregate, region_ids, commodity_ids, start_date, end_date, group_by, bucket, stats
+            )
+        pages = [
+            page async for page in
+            iter_pages(region_ids, commodity_ids, start_date, end_date, columns=aggregation.SOURCE_COLUMNS)
+        ]
+        with metrics.stage("compute"):
+            return await run_in_threadpool(aggregation.aggregate, pages, group_by, bucket, stats)
+
+    filters = CacheFilter.of(region_ids, commodity_ids, start_date, end_date)
+    return coded(await cached("aggregate", filters, (group_by, bucket, tuple(stats)), compute), ids, response)
+
+@app.get("/data/series")
+async def get_data_series(
+    response: Response,
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by"),
+    max_points: int = Query(500, ge=3, le=10000, description="Maximum points per (region, commodity) series"),
+    ids: str = Query("uuid", pattern="^(uuid|code)$", description=IDS_DESCRIPTION)
+):
+    """Price series per region and commodity, downsampled with LTTB for charting"""
+    region_ids = resolve_region_ids(regions)
+    commodity_ids = resolve_commodity_ids(commodities)
+
+    async def compute():
+        pages = [
+            page async for page in
+            iter_pages(region_ids, commodity_ids, start_date, end_date, columns=aggregation.SOURCE_COLUMNS)
+        ]
+        with metrics.stage("compute"):
+            return await run_in_threadpool(aggregation.downsampled_series, pages, max_points)
+
+    filters = CacheFilter.of(region_ids, commodity_ids, start_date, end_date)
+    return coded(await cached("series", filters, (max_points,), compute), ids, response)
+
+@app.get("/data/snapshot")
+async def get_data_snapshot(
+    as_of: Optional[date] = Query(None, description="Day to report prices for (default: the last day with any price)"),
+    regions: Optional[List[str]] = Query(None, description="Regions (rows), default all"),
+    commodities: Optional[List[str]] = Query(None, description="Commodities (columns), default all"),
+    max_age_days: int = Query(SNAPSHOT_MAX_AGE_DAYS, ge=0, le=3650, description="Use the last known price if it is at most this many days older than as_of")
+):
+    """Price of every selected commodity in every selected region as of one day"""
+    region_filter = resolve_region_ids(regions)
+    commodity_filter = resolve_commodity_ids(commodities)
+    region_ids = region_filter or list(region_map.values())
+    commodity_ids = commodity_filter or list(commodity_map.values())
+
+    def compute():
+        if snapshot_index:
+            return snapshot_index.snapshot(region_ids, commodity_ids, as_of, max_age_days)
+        # Without the index: load just the staleness window before the day
+        day = as_of or latest_price_day()
+        rows = fetch_rows(region_filter, commodity_filter, day - timedelta(days=max_age_days), day) if day else []
+        index = SnapshotIndex(supabase)
+        index.load(pd.DataFrame(rows, columns=aggregation.SOURCE_COLUMNS.split(",")))
+        return index.snapshot(region_ids, commodity_ids, day, max_age_days)
+
+    # Synchronous like the other indexes: the first request builds it
+    snapshot = await run_in_threadpool(compute)
+    with metrics.stage("serialize"):
+        return {
+            "as_of": snapshot["as_of"],
+            "max_age_days": max_age_days,
+            "regions": [region_names.get(region_id, region_id) for region_id in region_ids],
+            "commodities": [commodity_names.get(commodity_id, commodity_id) for commodity_id in commodity_ids],
+            "prices": snapshot["prices"],
+            "age_days": snapshot["age_days"],
+        }
+
+@app.get("/analytics/rolling")
+async def get_rolling_analytics(
+    response: Response,
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by"),
+    indicators: List[str] = Query(list(rolling.DEFAULT_INDICATORS), description=f"Any of ma_<days>, volatility_<days> (2 to {rolling.MAX_WINDOW} days), wow, mom, yoy"),
+    ids: str = Query("uuid", pattern="^(uuid|code)$", description=IDS_DESCRIPTION)
+):
+    """Moving averages, volatility and period-over-period changes per region and commodity"""
+    try:
+        parsed = rolling.parse(indicators)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    region_ids = resolve_region_ids(regions)
+    commodity_ids = resolve_commodity_ids(commodities)
+    # Windows and lags at the start of the range reach back before it
+    history_start = rolling.history_start(start_date, parsed)
+
+    async def compute():
+        pages = [
+            page async for page in
+            iter_pages(region_ids, commodity_ids, history_start, end_date, columns=aggregation.SOURCE_COLUMNS)
+        ]
+        with metrics.stage("compute"):
+            return await run_in_threadpool(rolling.indicators, pages, parsed, start_date)
+
+    filters = CacheFilter.of(region_ids, commodity_ids, history_start, end_date)
+    extra = (start_date, tuple(name for name, _, _ in parsed))
+    return coded(await cached("rolling", filters, extra, compute), ids, response)
+
+@app.get("/forecast")
+async def get_forecast(
+    response: Response,
+    regions: Optional[List[str]] = Query(None, description="List of regions to forecast (default: all)"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to forecast (default: all)"),
+    horizon: int = Query(30, ge=1, le=MAX_HORIZON, description="Days to forecast after the last observed day"),
+    ids: str = Query("uuid", pattern="^(uuid|code)$", description=IDS_DESCRIPTION)
+):
+    """Daily price forecasts per region and commodity, from cached models"""
+    region_ids = resolve_region_ids(regions)
+    commodity_ids = resolve_commodity_ids(commodities)
+    with metrics.stage("compute"):
+        rows, refitting = forecasts.forecast(region_ids, commodity_ids, horizon)
+    if refitting:
+        # Some series have no current model yet; they are being fitted in the background
+        response.status_code = 202
+    return coded(rows, ids, response)
+
+@app.post("/forecast/refresh")
+def refresh_forecasts(
+    regions: Optional[List[str]] = Query(None, description="List of regions to refit (default: all)"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to refit (default: all)")
+):
+    """Refit the forecast models of every matching series"""
+    started = time.perf_counter()
+    fitted = forecasts.fit(resolve_region_ids(regions), resolve_commodity_ids(commodities))
+    return {"status": "success", "series": fitted, "seconds": round(time.perf_counter() - started, 3)}
+
+@app.get("/anomalies")
+async def get_anomalies(limit: int = Query(100, ge=1, le=1000)):
+    """Flagged writes awaiting review, newest first"""
+    if not anomaly_detector:
+        raise HTTPException(status_code=404, detail="Anomaly detection is disabled")
+    return anomaly_detector.review(limit)
+
+@app.delete("/anomalies/{price_id}")
+async def dismiss_anomaly(price_id: str):
+    """Remove a reviewed row from the flagged list"""
+    if not anomaly_detector:
+        raise HTTPException(status_code=404, detail="Anomaly detection is disabled")
+    return {"status": "success", "dismissed": anomaly_detector.dismiss(price_id)}
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss/eviction counters of the query cache"""
+    if not query_cache:
+        return {"enabled": False}
+    return {"enabled": True, **query_cache.stats()}
 
-    if start_date:
-        query = query.gte("date", start_date.isoformat())
-    if end_date:
-        query = query.lte("date", end_date.isoformat())
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Request, stage, row-count and payload-size histograms in Prometheus format"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-    response = query.execute()
-    return {"total_count": len(response.data)}
+async def score_price(row):
+    """Anomaly scores of a price about to be written (None with detection off)"""
+    if not anomaly_detector:
+        return None
+    # Synchronous: the first call may build the state
+    with metrics.stage("compute"):
+        return await run_in_threadpool(anomaly_detector.score, row)
+
+def record_anomaly(rows, anomaly):
+    if anomaly_detector:
+        anomaly_detector.record(rows, anomaly)
 
 @app.post("/data")
-def add_data(item: PriceData):
+async def add_data(item: PriceData):
     try:
         region_id = region_map.get(item.region.strip())
         commodity_id = commodity_map.get(item.commodity.strip())
@@ -121,51 +686,274 @@ def add_data(item: PriceData):
             "created_by": item.created_by
         }
 
-        insert = supabase.table("prices").insert(data).execute()
-        return {"status": "success", "data": insert.data}
+        anomaly = await score_price(data)
+        insert = await execute(async_supabase.table("prices").insert(data))
+        write_hooks.rows_changed(added=insert.data)
+        record_anomaly(insert.data, anomaly)
+        return {"status": "success", "data": insert.data, "anomaly": anomaly}
 
+    except APIError as e:
+        if e.code == UNIQUE_VIOLATION:
+            raise HTTPException(status_code=409, detail=DUPLICATE_KEY_DETAIL)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.put("/data/{price_id}")
-def update_price(price_id: str, item: PriceUpdate):
+# Raised by PostgreSQL when a write would duplicate a (region, commodity, date)
+UNIQUE_VIOLATION = "23505"
+DUPLICATE_KEY_DETAIL = "A price for this region, commodity and date already exists; use PUT /data/by-key or mode=upsert"
+
+def natural_key(row):
+    return row["region_id"], row["commodity_id"], row["date"][:10]
+
+def fetch_by_keys(rows):
+    """Stored rows sharing a (region, commodity, date) with any of ``rows``"""
+    keys = {natural_key(row) for row in rows}
+    if not keys:
+        return []
+    dates = sorted(key[2] for key in keys)
+    region_ids = sorted({key[0] for key in keys})
+    commodity_ids = sorted({key[1] for key in keys})
+    start_date, end_date = date.fromisoformat(dates[0]), date.fromisoformat(dates[-1])
+    candidates = fetch_selected([lambda query: apply_filters(query, region_ids, commodity_ids, start_date, end_date)])
+    return [row for row in candidates if natural_key(row) in keys]
+
+# Bulk endpoints stay synchronous: validation is pandas work and the batches
+# are written by bulk_ingest's own thread pool
+def bulk_insert(frame, upsert=False):
+    """Validate a tidy frame and insert (or upsert) it in batches; all-or-nothing validation"""
+    with metrics.stage("compute"):
+        rows, rejected = bulk_ingest.prepare_rows(frame)
+    if len(rejected):
+        errors = [
+            {"row": int(index), "reason": reason}
+            for index, reason in rejected["reason"].head(20).items()
+        ]
+        raise HTTPException(status_code=400, detail={"rejected": len(rejected), "errors": errors})
+    previous = fetch_by_keys(rows) if upsert else []
     try:
-        update_data = {}
+        with metrics.stage("db"):
+            written = bulk_ingest.write_rows(supabase, rows, upsert=upsert)
+    except bulk_ingest.PartialWriteError as e:
+        if not e.committed:
+            if isinstance(e.error, APIError) and e.error.code == UNIQUE_VIOLATION:
+                raise HTTPException(status_code=409, detail=DUPLICATE_KEY_DETAIL)
+            raise e.error
+        # The batches before the failure stay written; derived structures must see them
+        committed_keys = {natural_key(row) for row in e.written}
+        write_hooks.rows_changed(removed=[row for row in previous if natural_key(row) in committed_keys], added=e.written)
+        duplicate = isinstance(e.error, APIError) and e.error.code == UNIQUE_VIOLATION
+        raise HTTPException(
+            status_code=409 if duplicate else 500,
+            detail={"message": DUPLICATE_KEY_DETAIL if duplicate else str(e.error), "committed": e.committed},
+        )
+    write_hooks.rows_changed(removed=previous, added=written)
+    if upsert:
+        updated = len({natural_key(row) for row in previous})
+        return {"status": "success", "inserted": len(rows) - updated, "updated": updated}
+    return {"status": "success", "inserted": len(written)}
 
-        if item.region:
-            region_id = region_map.get(item.region.strip())
-            if not region_id:
-                raise HTTPException(status_code=404, detail="Region not found")
-            update_data["region_id"] = region_id
+BULK_MODE_DESCRIPTION = "insert, or upsert to update the rows whose (region, commodity, date) exists"
 
-        if item.commodity:
-            commodity_id = commodity_map.get(item.commodity.strip())
-            if not commodity_id:
-                raise HTTPException(status_code=404, detail="Commodity not found")
-            update_data["commodity_id"] = commodity_id
+@app.post("/data/bulk")
+def add_data_bulk(items: List[PriceData], mode: str = Query("insert", pattern="^(insert|upsert)$", description=BULK_MODE_DESCRIPTION)):
+    frame = pd.DataFrame([item.model_dump() for item in items], columns=bulk_ingest.TIDY_COLUMNS + ["created_by"])
+    return bulk_insert(frame, upsert=mode == "upsert")
 
-        if item.date:
-            update_data["date"] = item.date.isoformat()
+@app.post("/data/bulk/upload")
+def add_data_bulk_upload(
+    file: UploadFile = File(..., description="CSV or Parquet: tidy, wide (Date + region columns) or keyed (id, price)"),
+    created_by: str = Form(..., description="Used for rows without a created_by column"),
+    commodity: Optional[str] = Form(None, description="Commodity of a wide file (default: file name)"),
+    mode: str = Form("insert", pattern="^(insert|upsert)$", description=BULK_MODE_DESCRIPTION)
+):
+    try:
+        frame = bulk_ingest.read_frame(io.BytesIO(file.file.read()), file.filename or "upload.csv", commodity)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read file: {e}")
+    if "created_by" in frame.columns:
+        frame = frame.assign(created_by=frame["created_by"].fillna(created_by))
+    else:
+        frame = frame.assign(created_by=created_by)
+    return bulk_insert(frame, upsert=mode == "upsert")
 
-        if item.price is not None:
-            update_data["price"] = item.price
+def update_values(item: PriceUpdate) -> dict:
+    """Column values of a PriceUpdate, with region/commodity names resolved"""
+    update_data = {}
 
-        if item.created_by:
-            update_data["created_by"] = item.created_by
+    if item.region:
+        region_id = region_map.get(item.region.strip())
+        if not region_id:
+            raise HTTPException(status_code=404, detail="Region not found")
+        update_data["region_id"] = region_id
+
+    if item.commodity:
+        commodity_id = commodity_map.get(item.commodity.strip())
+        if not commodity_id:
+            raise HTTPException(status_code=404, detail="Commodity not found")
+        update_data["commodity_id"] = commodity_id
+
+    if item.date:
+        try:
+            update_data["date"] = date.fromisoformat(item.date[:10]).isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid date '{item.date}'")
+
+    if item.price is not None:
+        update_data["price"] = item.price
+
+    if item.created_by:
+        update_data["created_by"] = item.created_by
+
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No valid fields to update")
+    return update_data
+
+# Ids per request when a bulk write targets ids, keeping PostgREST URLs short
+BULK_ID_BATCH_SIZE = 500
+
+def selection_filters(selection: PriceSelection):
+    """Filter functions for the rows a bulk write targets, one per batch of ids"""
+    if not (selection.ids or selection.regions or selection.commodities or selection.start_date or selection.end_date):
+        raise HTTPException(status_code=400, detail="Select rows by ids or by regions, commodities and dates")
+    region_ids = resolve_region_ids(selection.regions)
+    commodity_ids = resolve_commodity_ids(selection.commodities)
+    ids = list(dict.fromkeys(selection.ids or []))
+    batches = [ids[i:i + BULK_ID_BATCH_SIZE] for i in range(0, len(ids), BULK_ID_BATCH_SIZE)] or [None]
+
+    def filters_for(batch):
+        def filters(query):
+            query = apply_filters(query, region_ids, commodity_ids, selection.start_date, selection.end_date)
+            return query.in_("id", batch) if batch else query
+        return filters
+
+    return [filters_for(batch) for batch in batches]
 
-        if not update_data:
-            raise HTTPException(status_code=400, detail="No valid fields to update")
+def count_selected(filters) -> int:
+    with metrics.stage("db"):
+        return sum(
+            f(supabase.table("prices").select("id", count="exact", head=True)).execute().count or 0
+            for f in filters
+        )
 
-        updated = supabase.table("prices").update(update_data).eq("id", price_id).execute()
-        return {"status": "success", "data": updated.data}
+def fetch_selected(filters):
+    """Current images of the targeted rows, paged by id"""
+    rows = []
+    for f in filters:
+        start = 0
+        while True:
+            query = f(supabase.table("prices").select("*")).order("id").range(start, start + STREAM_PAGE_SIZE - 1)
+            with metrics.stage("db"):
+                page = query.execute().data
+            rows.extend(page)
+            start += len(page)
+            if len(page) < STREAM_PAGE_SIZE:
+                break
+    return rows
+
+@app.put("/data/by-key")
+async def upsert_price(item: PriceData):
+    """Insert the price of a (region, commodity, date), or update the row that holds it"""
+    try:
+        region_id = region_map.get(item.region.strip())
+        commodity_id = commodity_map.get(item.commodity.strip())
+
+        if not region_id or not commodity_id:
+            raise HTTPException(status_code=404, detail="Region or commodity not found")
+
+        data = {
+            "region_id": region_id,
+            "commodity_id": commodity_id,
+            "date": item.date.isoformat(),
+            "price": item.price,
+            "created_by": item.created_by
+        }
+
+        # Previous image for the write listeners; the write itself is one statement
+        previous = await execute(
+            async_supabase.table("prices").select("*")
+            .eq("region_id", region_id).eq("commodity_id", commodity_id).eq("date", data["date"])
+        )
+        anomaly = await score_price(data)
+        upserted = await execute(
+            async_supabase.table("prices").upsert(data, on_conflict=bulk_ingest.NATURAL_KEY, default_to_null=False)
+        )
+        write_hooks.rows_changed(removed=previous.data, added=upserted.data)
+        record_anomaly(upserted.data, anomaly)
+        return {
+            "status": "success", "action": "updated" if previous.data else "inserted",
+            "data": upserted.data, "anomaly": anomaly,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Bulk corrections are synchronous like the bulk inserts: a few set-based
+# statements, plus the row images the write listeners need
+@app.put("/data/bulk")
+def update_prices_bulk(item: BulkPriceUpdate):
+    """Apply one update to every row matching the ids and/or filters"""
+    values = update_values(item.update)
+    filters = selection_filters(item)
+    if item.dry_run:
+        return {"status": "dry_run", "matched": count_selected(filters)}
+
+    previous = {row["id"]: row for row in fetch_selected(filters)}
+    updated = []
+    for f in filters:
+        with metrics.stage("db"):
+            updated.extend(f(supabase.table("prices").update(values)).execute().data)
+    write_hooks.rows_changed(
+        removed=[previous[row["id"]] for row in updated if row["id"] in previous], added=updated
+    )
+    return {"status": "success", "updated": len(updated)}
+
+@app.delete("/data")
+def delete_prices_bulk(
+    ids: Optional[List[str]] = Query(None, description="Ids of the rows to delete"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    regions: Optional[List[str]] = Query(None, description="List of regions to filter by"),
+    commodities: Optional[List[str]] = Query(None, description="List of commodities to filter by"),
+    dry_run: bool = Query(False, description="Only count the rows that would be deleted")
+):
+    """Delete every row matching the ids and/or filters"""
+    selection = PriceSelection(ids=ids, regions=regions, commodities=commodities,
+                               start_date=start_date, end_date=end_date)
+    filters = selection_filters(selection)
+    if dry_run:
+        return {"status": "dry_run", "matched": count_selected(filters)}
+
+    deleted = []
+    for f in filters:
+        with metrics.stage("db"):
+            deleted.extend(f(supabase.table("prices").delete()).execute().data)
+    write_hooks.rows_changed(removed=deleted)
+    return {"status": "success", "deleted": len(deleted)}
+
+@app.put("/data/{price_id}")
+async def update_price(price_id: str, item: PriceUpdate):
+    try:
+        update_data = update_values(item)
+        previous = await fetch_price_row(price_id)
+        # Only a new price or a move to another series/day needs scoring
+        scored = previous and any(column in update_data for column in ("region_id", "commodity_id", "date", "price"))
+        anomaly = await score_price({**previous, **update_data}) if scored else None
+        updated = await execute(async_supabase.table("prices").update(update_data).eq("id", price_id))
+        write_hooks.rows_changed(removed=[previous] if previous and updated.data else [], added=updated.data)
+        record_anomaly(updated.data, anomaly)
+        return {"status": "success", "data": updated.data, "anomaly": anomaly}
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/data/{price_id}")
-def delete_price(price_id: str):
+async def delete_price(price_id: str):
     try:
-        deleted = supabase.table("prices").delete().eq("id", price_id).execute()
+        deleted = await execute(async_supabase.table("prices").delete().eq("id", price_id))
+        write_hooks.rows_changed(removed=deleted.data)
         return {"status": "success", "data": deleted.data}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,249 @@
+"""Per-request stage timings, exported as Prometheus histograms.
+
+``MetricsMiddleware`` gives every request a ``RequestTimer`` (held in a
+context variable, so worker threads and stream tasks see it too). Code marks
+its stages with ``with stage("db"): ...``. Two stages come from the route
+class instead of explicit marks:
+
+- ``parse``: request start until the endpoint runs (routing, validation)
+- ``serialize``: endpoint return until the response starts (encoding the
+  returned value)
+
+Each response carries the stages in a ``Server-Timing`` header. For streamed
+responses the header is sent before the body, so it only covers the work
+done up to the first byte; the histograms record the whole stream.
+"""
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000, 1_000_000)
+BYTE_BUCKETS = tuple(256 * 4 ** i for i in range(11))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self.series.items())
+        for labels, counts, total in series:
+            label_text = _format_labels(self.labelnames, labels)
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from request start until the response is fully sent.",
+    ("route", "method", "status"), DURATION_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "http_request_stage_duration_seconds", "Time spent in each stage of a request.",
+    ("route", "stage"), DURATION_BUCKETS,
+)
+RESPONSE_ROWS = Histogram(
+    "http_response_rows", "Rows returned per response.", ("route",), ROW_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes", "Response body size.", ("route",), BYTE_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_DURATION, STAGE_DURATION, RESPONSE_ROWS, RESPONSE_BYTES)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render() -> str:
+    """All histograms in the Prometheus text exposition format"""
+    return "\n".join(line for histogram in HISTOGRAMS for line in histogram.render()) + "\n"
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.rows: Optional[int] = None
+        self.bytes = 0
+        self.endpoint_started: Optional[float] = None
+        self.endpoint_finished: Optional[float] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_rows(self, count: int) -> None:
+        self.rows = (self.rows or 0) + count
+
+    def server_timing(self) -> str:
+        stages = dict(self.stages, total=time.perf_counter() - self.started)
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages.items())
+
+
+_current: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Add the time spent in the block to the current request's ``name`` stage"""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def add_rows(count: int) -> None:
+    timer = _current.get()
+    if timer is not None:
+        timer.add_rows(count)
+
+
+async def count_rows(pages):
+    """Pass pages through, counting their rows as response rows"""
+    async for page in pages:
+        add_rows(len(page))
+        yield page
+
+
+def _result_rows(result) -> Optional[int]:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and isinstance(result.get("data"), list):
+        return len(result["data"])
+    return None
+
+
+def _timed_endpoint(endpoint):
+    """Record when the endpoint starts and returns, and how many rows it returned"""
+
+    def started():
+        timer = _current.get()
+        if timer is not None:
+            timer.endpoint_started = time.perf_counter()
+            timer.add("parse", timer.endpoint_started - timer.started)
+        return timer
+
+    def finished(timer, result):
+        if timer is not None:
+            timer.endpoint_finished = time.perf_counter()
+            rows = _result_rows(result)
+            if rows is not None:
+                timer.add_rows(rows)
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            timer = started()
+            result = await endpoint(*args, **kwargs)
+            finished(timer, result)
+            return result
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            timer = started()
+            result = endpoint(*args, **kwargs)
+            finished(timer, result)
+            return result
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """Route class that times its endpoint and labels metrics with its path template"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            request.scope["metrics_route"] = self.path
+            return await handler(request)
+
+        return timed_handler
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times requests and adds the ``Server-Timing`` header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timer = RequestTimer()
+        token = _current.set(timer)
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timer.endpoint_finished is not None:
+                    timer.add("serialize", time.perf_counter() - timer.endpoint_finished)
+                MutableHeaders(scope=message).append("Server-Timing", timer.server_timing())
+            elif message["type"] == "http.response.body":
+                timer.bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            route = scope.get("metrics_route", "unmatched")
+            REQUEST_DURATION.observe((route, scope["method"], str(status)), time.perf_counter() - timer.started)
+            for name, seconds in timer.stages.items():
+                STAGE_DURATION.observe((route, name), seconds)
+            if timer.rows is not None:
+                RESPONSE_ROWS.observe((route,), timer.rows)
+            RESPONSE_BYTES.observe((route,), timer.bytes)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from datetime import date
 
 class PriceData(BaseModel):
@@ -20,4 +20,27 @@ class PriceUpdate(BaseModel):
     commodity: Optional[str] = None
     date: Optional[str] = None
     price: Optional[float] = None
-    created_by: Optional[str] = None
\ No newline at end of file
+    created_by: Optional[str] = None
+
+class PriceSelection(BaseModel):
+    ids: Optional[List[str]] = None
+    regions: Optional[List[str]] = None
+    commodities: Optional[List[str]] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+class BulkPriceUpdate(PriceSelection):
+    update: PriceUpdate
+    dry_run: bool = False
+
+class DataQuery(BaseModel):
+    name: str
+    regions: Optional[List[str]] = None
+    commodities: Optional[List[str]] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    limit: Optional[int] = Field(None, ge=1)
+
+class BatchRequest(BaseModel):
+    queries: List[DataQuery]
+    ids: Literal["uuid", "code"] = "uuid"
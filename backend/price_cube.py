@@ -0,0 +1,505 @@
+"""Dense, memory-mapped price cube: commodity x region x day.
+
+The prices table holds close to one price per (region, commodity, date), so
+its bulk is stored as a dense float32 array with NaN for missing cells, in a
+directory of ``.npy`` files:
+
+    meta.json        first day, region/commodity ids (axis positions are
+                     their codes), created_by labels
+    price.npy        float32 (commodities, regions, days)
+    id.npy           row ids, same shape
+    created_by.npy   codes into the created_by labels (-1: none)
+    created_at.npy   audit timestamps, same shape
+    updated_at.npy
+    overflow.csv     rows that had no free cell when the cube was built
+
+The arrays are opened with ``np.load(mmap_mode="c")``. Every worker process
+maps the same pages from the page cache, and a write only copies the pages
+it touches into the writing process. Region, commodity and date filters
+become a slice of the cube (a date is an offset from the first day), so a
+query reads the cells it returns and nothing else.
+
+Rows without a cell (a date outside the cube, an unknown region) live in
+the columnar engine this class extends, and every query reads both. The
+overflow also keeps the extra prices of a cell found when the cube was
+built; new writes get the table's unique key instead, so an insert that
+repeats a (region, commodity, date) fails with the database's error. Like
+the ``local`` store, writes stay in the process that made them; rebuild the
+cube to persist them::
+
+    python price_cube.py --out price_cube [--table prices.csv | paths ...]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from postgrest.exceptions import APIError
+
+from columnar_store import (
+    PRICE_CLUSTER, PRICE_DEFAULTS, PRICE_KEY_INDEX, CategoryColumn, ColumnarEngine, create_price_engine, from_day,
+    price_schema, to_day,
+)
+from storage import Condition, QuerySpec
+
+ID_DTYPE = "S36"
+TIMESTAMP_DTYPE = "S40"
+AUDIT_COLUMNS = ("created_at", "updated_at")
+TABLE_COLUMNS = ("id", "region_id", "commodity_id", "date", "price", "created_by", "created_at", "updated_at")
+
+
+def _referenced(conditions: Sequence[Condition]) -> List[str]:
+    """Columns a (nested) condition list reads"""
+    names = []
+    for column, op, value in conditions:
+        names.extend(_referenced(value) if column is None else [column])
+    return names
+
+
+def _decode_prices(values: np.ndarray) -> np.ndarray:
+    """float32 cells -> the shortest decimals that round-trip (12345.67, not
+    12345.669921875). Rounding to 7 significant digits finds them for
+    ordinary prices; the rest go through their string repr."""
+    exact = values.astype(np.float64)
+    with np.errstate(divide="ignore"):
+        digits = 6 - np.floor(np.log10(np.abs(exact)))
+    digits[~np.isfinite(digits)] = 0
+    scale = 10.0 ** np.abs(digits)
+    rounded = np.where(digits >= 0, np.round(exact * scale) / scale, np.round(exact / scale) * scale)
+    missed = rounded.astype(np.float32) != values
+    if missed.any():
+        rounded[missed] = values[missed].astype(str).astype(np.float64)
+    return rounded
+
+
+def _decode_text(values: np.ndarray) -> np.ndarray:
+    return np.array([value.decode() or None for value in values.tolist()], dtype=object)
+
+
+class CubeEngine(ColumnarEngine):
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json")) as handle:
+            meta = json.load(handle)
+        super().__init__(price_schema(meta["regions"], meta["commodities"]), cluster_by=PRICE_CLUSTER,
+                         defaults=PRICE_DEFAULTS)
+        self.directory = directory
+        self.first_day = to_day(meta["first_day"])
+        self.owners = CategoryColumn(meta["created_by"])
+
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="c")
+
+        self.price = load("price")
+        self.shape = self.price.shape
+        # Flat views over the same mapping; a cell is an index into them
+        self.cell_price = self.price.reshape(-1)
+        self.cell_id = load("id").reshape(-1)
+        self.cell_owner = load("created_by").reshape(-1)
+        self.cell_audit = {name: load(name).reshape(-1) for name in AUDIT_COLUMNS}
+        # Sorted ids of the cells as opened (built on the first id lookup),
+        # plus the cells written since
+        self.id_order = None
+        self.written_ids: Dict[str, int] = {}
+
+        overflow = os.path.join(directory, "overflow.csv")
+        if os.path.exists(overflow):
+            super().load_csv(overflow)
+        # After the overflow, which may repeat the keys of cells
+        self.unique_index = PRICE_KEY_INDEX
+
+    # Cells
+    def _cells_for_ids(self, values) -> np.ndarray:
+        if self.id_order is None:
+            self.id_order = np.argsort(self.cell_id)
+            self.sorted_ids = self.cell_id[self.id_order]
+        targets = np.array([str(value).encode() for value in values], dtype=ID_DTYPE)
+        at = np.searchsorted(self.sorted_ids, targets).clip(max=len(self.sorted_ids) - 1)
+        cells = np.concatenate([
+            self.id_order[at],
+            np.array([self.written_ids.get(str(value), -1) for value in values], dtype=np.int64),
+        ])
+        cells = cells[cells >= 0]
+        # Entries may be stale (the cell was cleared or rewritten); keep those still holding the id
+        return np.unique(cells[np.isin(self.cell_id[cells], targets)])
+
+    def _cube_cells(self, where: List[Condition]):
+        """Occupied cells inside the top-level region/commodity/date/id filters,
+        and the conditions left to check on them"""
+        commodities, regions, days = self.shape
+        selected = {"commodity_id": None, "region_id": None}
+        low, high = 0, days - 1
+        id_cells = None
+        residual = []
+        for condition in where:
+            column, op, value = condition
+            if column in selected and op in ("eq", "in"):
+                kind = self.schema[column]
+                size = commodities if column == "commodity_id" else regions
+                codes = np.unique(np.array([kind.encode(v) for v in (value if op == "in" else [value])], dtype=np.int64))
+                codes = codes[(codes >= 0) & (codes < size)]
+                current = selected[column]
+                selected[column] = codes if current is None else np.intersect1d(current, codes)
+            elif column == "date" and op in ("eq", "gt", "gte", "lt", "lte") and value is not None:
+                day = to_day(value) - self.first_day
+                if op in ("eq", "gte"):
+                    low = max(low, day)
+                if op == "gt":
+                    low = max(low, day + 1)
+                if op in ("eq", "lte"):
+                    high = min(high, day)
+                if op == "lt":
+                    high = min(high, day - 1)
+            elif column == "id" and op in ("eq", "in"):
+                cells = self._cells_for_ids(value if op == "in" else [value])
+                id_cells = cells if id_cells is None else np.intersect1d(id_cells, cells)
+            else:
+                residual.append(condition)
+
+        if id_cells is not None:
+            # A handful of cells: check the other filters on them directly
+            commodity, region, day = np.unravel_index(id_cells, self.shape)
+            keep = (day >= low) & (day <= high)
+            if selected["commodity_id"] is not None:
+                keep &= np.isin(commodity, selected["commodity_id"])
+            if selected["region_id"] is not None:
+                keep &= np.isin(region, selected["region_id"])
+            return id_cells[keep], residual
+
+        commodity_axis = selected["commodity_id"]
+        region_axis = selected["region_id"]
+        if commodity_axis is None:
+            commodity_axis = np.arange(commodities)
+        if region_axis is None:
+            region_axis = np.arange(regions)
+        if low > high or not len(commodity_axis) or not len(region_axis):
+            return np.empty(0, dtype=np.int64), residual
+        block = self.price[np.ix_(commodity_axis, region_axis, np.arange(low, high + 1))]
+        commodity, region, day = np.nonzero(~np.isnan(block))
+        cells = np.ravel_multi_index((commodity_axis[commodity], region_axis[region], day + low), self.shape)
+        return cells.astype(np.int64), residual
+
+    def _gather(self, cells: np.ndarray, names: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Cells as encoded columns, the way the columnar engine stores rows"""
+        _, regions, days = self.shape
+        columns = {}
+        for name in names:
+            if name == "commodity_id":
+                values = (cells // (regions * days)).astype(self.schema[name].dtype)
+            elif name == "region_id":
+                values = (cells // days % regions).astype(self.schema[name].dtype)
+            elif name == "date":
+                values = (cells % days + self.first_day).astype(self.schema[name].dtype)
+            elif name == "price":
+                values = _decode_prices(self.cell_price[cells])
+            elif name == "id":
+                values = _decode_text(self.cell_id[cells])
+            elif name == "created_by":
+                labels = np.array(self.owners.labels + [None], dtype=object)
+                values = labels[self.cell_owner[cells]]
+            else:
+                values = _decode_text(self.cell_audit[name][cells])
+            columns[name] = values
+        return columns
+
+    def _candidates(self, where: List[Condition], names: Sequence[str]):
+        """``(engine, residual, cells, overflow)``: a throwaway engine holding
+        ``names`` of the cube cells and the overflow rows inside the narrowing
+        filters (cells first), and the conditions still to check on it"""
+        cells, residual = self._cube_cells(where)
+        overflow = self._match(where)
+        needed = [name for name in dict.fromkeys(list(names) + _referenced(residual)) if name in self.schema]
+        needed = needed or ["date"]
+        cube_columns = self._gather(cells, needed)
+        candidates = ColumnarEngine({name: self.schema[name] for name in needed})
+        candidates.columns = {
+            name: np.concatenate([cube_columns[name], self.columns[name][overflow]]) for name in needed
+        }
+        return candidates, residual, cells, overflow
+
+    def _rows(self, positions: np.ndarray, cells: np.ndarray, overflow: np.ndarray,
+              names: Sequence[str]) -> List[Dict[str, Any]]:
+        """Decode candidate rows; only the returned ones are read from the cube"""
+        in_cube = positions < len(cells)
+        columns = self._gather(cells[positions[in_cube]], names)
+        decoded = [self.schema[name].decode_many(columns[name]) for name in names]
+        cube_rows = [dict(zip(names, values)) for values in zip(*decoded)]
+        if in_cube.all():
+            return cube_rows
+        cube_rows = iter(cube_rows)
+        overflow_rows = iter(self._decode(overflow[positions[~in_cube] - len(cells)], names))
+        return [next(cube_rows) if flag else next(overflow_rows) for flag in in_cube.tolist()]
+
+    def _clear(self, cells: np.ndarray) -> None:
+        self.cell_price[cells] = np.nan
+        self.cell_id[cells] = b""
+
+    @staticmethod
+    def _id_spec(ids: List[str]) -> QuerySpec:
+        spec = QuerySpec("prices")
+        spec.where.append(Condition("id", "in", ids))
+        return spec
+
+    # StorageEngine interface
+    def select(self, spec: QuerySpec):
+        with self.lock:
+            names = self._column_names(spec.columns)
+            if spec.head:
+                cells, residual = self._cube_cells(spec.where)
+                if not residual:
+                    return [], len(cells) + len(self._match(spec.where)) if spec.count else None
+            candidates, residual, cells, overflow = self._candidates(spec.where, [column for column, _ in spec.order])
+            positions = candidates._match(residual)
+            count = len(positions) if spec.count else None
+            if spec.head:
+                return [], count
+            stop = None if spec.limit is None else spec.offset + spec.limit
+            positions = candidates._sorted(positions, spec.order, stop)[spec.offset:stop]
+            return self._rows(positions, cells, overflow, names), count
+
+    def insert(self, rows: List[Dict[str, Any]]):
+        return self._insert(rows, check=self.unique_index is not None)
+
+    def _insert(self, rows: List[Dict[str, Any]], check: bool):
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return []
+        with self.lock:
+            for row in rows:
+                for name in row:
+                    if name not in self.schema:
+                        raise ValueError(f"Unknown column '{name}'")
+            encoded = self._encode_rows(rows)
+            inserted = [
+                dict(zip(self.schema, values))
+                for values in zip(*(self.schema[name].decode_many(encoded[name]) for name in self.schema))
+            ]
+
+            commodities, regions, days = self.shape
+            commodity = encoded["commodity_id"].astype(np.int64)
+            region = encoded["region_id"].astype(np.int64)
+            day = encoded["date"].astype(np.int64) - self.first_day
+            inside = (commodity >= 0) & (commodity < commodities) & (region >= 0) & (region < regions) \
+                & (day >= 0) & (day < days) & ~np.isnan(encoded["price"])
+            cells = np.full(len(rows), -1, dtype=np.int64)
+            cells[inside] = np.ravel_multi_index((commodity[inside], region[inside], day[inside]), self.shape)
+            fits = inside.copy()
+            fits[inside] = np.isnan(self.cell_price[cells[inside]])
+            if check:
+                # Cells and overflow rows share one key space
+                self._check_unique(encoded, taken=inside & ~fits)
+            # Unchecked, two new rows for one free cell: the first takes it
+            candidates = np.flatnonzero(fits)
+            _, first = np.unique(cells[candidates], return_index=True)
+            fits[:] = False
+            fits[candidates[first]] = True
+
+            placed = cells[fits]
+            self.cell_price[placed] = encoded["price"][fits]
+            self.cell_id[placed] = np.array([str(v).encode() for v in encoded["id"][fits]], dtype=ID_DTYPE)
+            self.cell_owner[placed] = self.owners.encode_for_write(encoded["created_by"][fits])
+            for name in AUDIT_COLUMNS:
+                self.cell_audit[name][placed] = np.array(
+                    [b"" if v is None else str(v).encode() for v in encoded[name][fits]], dtype=TIMESTAMP_DTYPE
+                )
+            self.written_ids.update(zip(encoded["id"][fits].tolist(), placed.tolist()))
+            if not fits.all():
+                self._append({name: values[~fits] for name, values in encoded.items()})
+            return inserted
+
+    def _matching(self, where: List[Condition]):
+        """Full rows matching ``where``, which of them are in the cube, and
+        their cells"""
+        candidates, residual, cells, overflow = self._candidates(where, [])
+        positions = candidates._match(residual)
+        rows = self._rows(positions, cells, overflow, list(self.schema))
+        in_cube = positions < len(cells)
+        return rows, in_cube.tolist(), cells[positions[in_cube]]
+
+    def update(self, spec: QuerySpec, values: Dict[str, Any]):
+        for name in values:
+            if name not in self.schema:
+                raise ValueError(f"Unknown column '{name}'")
+        with self.lock:
+            rows, in_cube, cells = self._matching(spec.where)
+            # A cube row is cleared and written again, to the same cell unless
+            # its region, commodity or date changed; a change onto a key in
+            # use fails and leaves the cells as they were
+            moved = []
+            if len(cells):
+                prices, ids = self.cell_price[cells].copy(), self.cell_id[cells].copy()
+                self._clear(cells)
+                check = self.unique_index is not None and any(name in values for name in PRICE_CLUSTER)
+                try:
+                    moved = self._insert([dict(row, **values) for row, flag in zip(rows, in_cube) if flag], check)
+                except APIError:
+                    self.cell_price[cells], self.cell_id[cells] = prices, ids
+                    raise
+            overflow_ids = [row["id"] for row, flag in zip(rows, in_cube) if not flag]
+            updated = super().update(self._id_spec(overflow_ids), values) if overflow_ids else []
+            return updated + moved
+
+    def delete(self, spec: QuerySpec):
+        with self.lock:
+            rows, in_cube, cells = self._matching(spec.where)
+            self._clear(cells)
+            overflow_ids = [row["id"] for row, flag in zip(rows, in_cube) if not flag]
+            if overflow_ids:
+                super().delete(self._id_spec(overflow_ids))
+            return rows
+
+    def upsert(self, rows: List[Dict[str, Any]], on_conflict: Sequence[str]):
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return []
+        with self.lock:
+            if set(on_conflict) != set(PRICE_CLUSTER):
+                results = []
+                for row in rows:
+                    spec = QuerySpec("prices")
+                    spec.where.extend(Condition(name, "eq", row.get(name)) for name in on_conflict)
+                    results.extend(self.update(spec, row) or self.insert([row]))
+                return results
+
+            rows = self._latest_per_key(rows, on_conflict)
+            commodities, regions, days = self.shape
+            commodity = self.schema["commodity_id"].encode_many([row.get("commodity_id") for row in rows]).astype(np.int64)
+            region = self.schema["region_id"].encode_many([row.get("region_id") for row in rows]).astype(np.int64)
+            day = self.schema["date"].encode_many([row.get("date") for row in rows]).astype(np.int64) - self.first_day
+            inside = (commodity >= 0) & (commodity < commodities) & (region >= 0) & (region < regions) \
+                & (day >= 0) & (day < days)
+            cells = np.full(len(rows), -1, dtype=np.int64)
+            cells[inside] = np.ravel_multi_index((commodity[inside], region[inside], day[inside]), self.shape)
+            occupied = inside.copy()
+            occupied[inside] = ~np.isnan(self.cell_price[cells[inside]])
+
+            # A row whose cell holds the key: merge into the stored row and
+            # write it back to the same cell
+            hits = cells[occupied]
+            names = list(self.schema)
+            columns = self._gather(hits, names)
+            stored = [dict(zip(names, values)) for values in zip(*(self.schema[name].decode_many(columns[name])
+                                                                     for name in names))]
+            merged = [dict(previous, **row) for previous, row in zip(stored, np.array(rows, dtype=object)[occupied])]
+            self._clear(hits)
+            results = self._insert(merged, check=False)
+            # The rest may match an overflow row, or take a free cell
+            return results + super().upsert(list(np.array(rows, dtype=object)[~occupied]), on_conflict)
+
+    def replace_all(self, rows: List[Dict[str, Any]]):
+        with self.lock:
+            self.cell_price[:] = np.nan
+            self.cell_id[:] = b""
+            self.written_ids.clear()
+            super().replace_all([])
+            self.insert(rows)
+
+
+def write_cube(directory: str, engine: ColumnarEngine) -> Dict[str, Any]:
+    """Write the rows of a price engine as a cube directory.
+
+    Where several rows share a (region, commodity, date) cell the last one
+    gets the cell and the others go to ``overflow.csv``.
+    """
+    if not len(engine):
+        raise ValueError("No rows to write")
+    columns = engine.columns
+    regions = engine.schema["region_id"].labels
+    commodities = engine.schema["commodity_id"].labels
+    first_day, last_day = int(columns["date"].min()), int(columns["date"].max())
+    shape = (len(commodities), len(regions), last_day - first_day + 1)
+    cells = np.ravel_multi_index(
+        (columns["commodity_id"].astype(np.int64), columns["region_id"].astype(np.int64),
+         columns["date"].astype(np.int64) - first_day),
+        shape,
+    )
+    _, last = np.unique(cells[::-1], return_index=True)
+    keep = np.zeros(len(cells), dtype=bool)
+    keep[len(cells) - 1 - last] = True
+
+    os.makedirs(directory, exist_ok=True)
+
+    def create(name, dtype, fill):
+        array = open_memmap(os.path.join(directory, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+        array[:] = fill
+        return array
+
+    placed = cells[keep]
+    price = create("price", np.float32, np.nan)
+    price.reshape(-1)[placed] = columns["price"][keep]
+    ids = create("id", ID_DTYPE, b"")
+    ids.reshape(-1)[placed] = np.array([str(v).encode() for v in columns["id"][keep]], dtype=ID_DTYPE)
+    owners = CategoryColumn()
+    owner = create("created_by", np.int32, -1)
+    owner.reshape(-1)[placed] = owners.encode_for_write(columns["created_by"][keep])
+    for name in AUDIT_COLUMNS:
+        audit = create(name, TIMESTAMP_DTYPE, b"")
+        audit.reshape(-1)[placed] = np.array(
+            [b"" if v is None else str(v).encode() for v in columns[name][keep]], dtype=TIMESTAMP_DTYPE
+        )
+    for array in (price, ids, owner):
+        array.flush()
+
+    meta = {
+        "first_day": from_day(first_day),
+        "shape": list(shape),
+        "regions": regions,
+        "commodities": commodities,
+        "created_by": owners.labels,
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as handle:
+        json.dump(meta, handle, indent=2)
+
+    overflow = os.path.join(directory, "overflow.csv")
+    if not keep.all():
+        import pandas as pd
+
+        positions = np.flatnonzero(~keep)
+        pd.DataFrame(engine._decode(positions, list(TABLE_COLUMNS))).to_csv(overflow, index=False)
+    elif os.path.exists(overflow):
+        os.remove(overflow)
+    return {"rows": len(cells), "cells": int(keep.sum()), "overflow": int((~keep).sum()), "shape": shape}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build a memory-mapped price cube")
+    parser.add_argument("paths", nargs="*", help="Wide/keyed/tidy price files (see bulk_ingest.py)")
+    parser.add_argument("--out", required=True, help="Cube directory")
+    parser.add_argument("--table", help="CSV export of the prices table (id, region_id, commodity_id, date, ...)")
+    parser.add_argument("--created-by", default="", help="created_by for rows from price files")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    engine = create_price_engine()
+    if args.table:
+        engine.load_csv(args.table)
+    elif args.paths:
+        import bulk_ingest
+
+        rows, _ = bulk_ingest.prepare_rows(bulk_ingest.load_paths(args.paths), args.created_by, skip_missing=True)
+        engine.insert(rows)
+    else:
+        from supabase_client import supabase
+
+        start, page_size = 0, 1000
+        while True:
+            page = supabase.table("prices").select("*").order("id").range(start, start + page_size - 1).execute().data
+            engine.insert(page)
+            if len(page) < page_size:
+                break
+            start += page_size
+    print(f"Loaded {len(engine)} rows in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    summary = write_cube(args.out, engine)
+    print(f"Wrote {summary['cells']} cells of a {'x'.join(map(str, summary['shape']))} cube "
+          f"({summary['overflow']} overflow rows) to {args.out} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""LRU cache for read endpoint results, invalidated by writes.
+
+Entries are keyed on the normalized filter set (sorted region/commodity ids,
+date range) plus whatever else shapes the result (endpoint, limit, grouping).
+The cache is a write listener: a changed row only drops entries whose
+filters could have matched it, so writes to other regions, commodities or
+dates leave cached results in place.
+
+Its size limit is a payload budget: entries are counted by the estimated
+size of their JSON, not by the memory their Python objects retain, which is
+roughly two to three times more for rows of prices.
+"""
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+
+class CacheFilter(NamedTuple):
+    region_ids: Optional[frozenset]
+    commodity_ids: Optional[frozenset]
+    start: Optional[str]
+    end: Optional[str]
+
+    @classmethod
+    def of(cls, region_ids=None, commodity_ids=None, start_date: Optional[date] = None,
+           end_date: Optional[date] = None) -> "CacheFilter":
+        return cls(
+            frozenset(region_ids) if region_ids else None,
+            frozenset(commodity_ids) if commodity_ids else None,
+            start_date.isoformat() if start_date else None,
+            end_date.isoformat() if end_date else None,
+        )
+
+    def key(self) -> tuple:
+        return (
+            tuple(sorted(self.region_ids)) if self.region_ids is not None else None,
+            tuple(sorted(self.commodity_ids)) if self.commodity_ids is not None else None,
+            self.start,
+            self.end,
+        )
+
+    def matches(self, row: Dict[str, Any]) -> bool:
+        """Whether a single row falls inside the filters"""
+        if self.region_ids is not None and row.get("region_id") not in self.region_ids:
+            return False
+        if self.commodity_ids is not None and row.get("commodity_id") not in self.commodity_ids:
+            return False
+        day = str(row.get("date"))[:10]
+        return (not self.start or day >= self.start) and (not self.end or day <= self.end)
+
+    def overlaps(self, changed: Dict[Tuple[str, str], List[str]]) -> bool:
+        """Whether any changed (region, commodity) -> sorted dates falls inside"""
+        for (region_id, commodity_id), dates in changed.items():
+            if self.region_ids is not None and region_id not in self.region_ids:
+                continue
+            if self.commodity_ids is not None and commodity_id not in self.commodity_ids:
+                continue
+            low = bisect_left(dates, self.start) if self.start else 0
+            high = bisect_right(dates, self.end) if self.end else len(dates)
+            if low < high:
+                return True
+        return False
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate JSON size of a cached result, without serializing all of it.
+
+    Lists are sized from up to three sampled items (first, middle, last)
+    times their length; results are lists of similar rows, so this stays
+    close to the real size at a constant cost.
+    """
+    if isinstance(value, list):
+        if not value:
+            return 2
+        samples = [value[0], value[len(value) // 2], value[-1]][:len(value)]
+        # json.dumps separates items with ", " and keys from values with ": "
+        return len(value) * sum(estimate_size(item) + 2 for item in samples) // len(samples)
+    if isinstance(value, dict):
+        return sum(len(str(key)) + 6 + estimate_size(item) for key, item in value.items())
+    return len(json.dumps(value, default=str))
+
+
+class Entry(NamedTuple):
+    value: Any
+    filters: CacheFilter
+    size: int
+    expires: float
+
+
+class QueryCache:
+    def __init__(self, max_payload_bytes: int = 64 << 20, ttl: float = 60.0):
+        # Budget for the summed estimate_size() of the entries
+        self.max_payload_bytes = max_payload_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, Entry]" = OrderedDict()
+        self.payload_bytes = 0
+        # Bumped on every invalidation; results computed across a bump are not stored
+        self.generation = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def _drop(self, key) -> None:
+        entry = self.entries.pop(key)
+        self.payload_bytes -= entry.size
+
+    def _lookup(self, key):
+        """``(hit, value, generation)`` for a key"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry.expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry.value, self.generation
+                self._drop(key)
+                self.expirations += 1
+            self.misses += 1
+            return False, None, self.generation
+
+    def _store(self, key, filters: CacheFilter, value, generation: int) -> None:
+        size = estimate_size(value)
+        if size > self.max_payload_bytes:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = Entry(value, filters, size, time.monotonic() + self.ttl)
+            self.payload_bytes += size
+            while self.payload_bytes > self.max_payload_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, kind: str, filters: CacheFilter, extra: tuple, compute: Callable[[], Any]) -> Any:
+        key = (kind, filters.key(), extra)
+        hit, value, generation = self._lookup(key)
+        if not hit:
+            value = compute()
+            self._store(key, filters, value, generation)
+        return value
+
+    async def aget_or_compute(self, kind: str, filters: CacheFilter, extra: tuple,
+                              compute: Callable[[], Awaitable[Any]]) -> Any:
+        key = (kind, filters.key(), extra)
+        hit, value, generation = self._lookup(key)
+        if not hit:
+            value = await compute()
+            self._store(key, filters, value, generation)
+        return value
+
+    # Write listener interface
+    def rows_changed(self, removed, added) -> None:
+        changed: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        for row in list(removed) + list(added):
+            changed[(row["region_id"], row["commodity_id"])].append(str(row["date"])[:10])
+        for dates in changed.values():
+            dates.sort()
+        with self.lock:
+            self.generation += 1
+            stale = [key for key, entry in self.entries.items() if entry.filters.overlaps(changed)]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.payload_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "payload_bytes": self.payload_bytes,
+                "max_payload_bytes": self.max_payload_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,149 @@
+"""Rolling price indicators for every (region, commodity) series.
+
+Rows are pivoted into one ``(days, series)`` matrix with a row per calendar
+day, and each indicator is computed for all series at once with whole-array
+NumPy operations:
+
+- ``ma_<n>``: mean of the prices observed in the last ``n`` days
+- ``volatility_<n>``: standard deviation of the daily log returns in the last
+  ``n`` days (returns between prices on consecutive days only)
+- ``wow``/``mom``/``yoy``: percent change against the price one week, month
+  or year earlier, i.e. the latest price on or before that day and at most
+  ``CARRY_DAYS`` older than it
+
+Window sums are differences of cumulative sums, so the cost of a window does
+not depend on its length. Indicator values are returned for the observed days
+of the requested range; earlier rows only feed the windows and lags.
+"""
+import re
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_INDICATORS = ("ma_7", "ma_30", "volatility_30", "wow", "mom", "yoy")
+MAX_WINDOW = 365
+
+# How far back a lagged price may be carried forward over missing days
+CARRY_DAYS = 31
+
+CHANGE_PERIODS = {
+    "wow": (pd.DateOffset(weeks=1), 7),
+    "mom": (pd.DateOffset(months=1), 31),
+    "yoy": (pd.DateOffset(years=1), 366),
+}
+
+WINDOW_PATTERN = re.compile(r"^(ma|volatility)_(\d+)$")
+
+# (output name, kind, window in days or None for changes)
+Indicator = Tuple[str, str, Optional[int]]
+
+
+def parse(names: Iterable[str]) -> List[Indicator]:
+    """Indicator names -> specs; ValueError naming the ones that are not valid"""
+    parsed, invalid = [], []
+    for name in dict.fromkeys(names):
+        match = WINDOW_PATTERN.match(name)
+        if match and 2 <= int(match.group(2)) <= MAX_WINDOW:
+            parsed.append((name, match.group(1), int(match.group(2))))
+        elif name in CHANGE_PERIODS:
+            parsed.append((name, name, None))
+        else:
+            invalid.append(name)
+    if invalid:
+        raise ValueError(f"Unknown indicators: {', '.join(invalid)}")
+    return parsed
+
+
+def history_start(start_date: Optional[date], parsed: List[Indicator]) -> Optional[date]:
+    """First day of data the indicators for days from ``start_date`` depend on"""
+    if start_date is None:
+        return None
+    lookback = max(
+        window if window else CHANGE_PERIODS[kind][1] + CARRY_DAYS
+        for _, kind, window in parsed
+    )
+    return start_date - timedelta(days=lookback)
+
+
+def _frame(pages: Iterable[List[Dict[str, Any]]]) -> pd.DataFrame:
+    columns = ["region_id", "commodity_id", "date", "price"]
+    frames = [pd.DataFrame(page, columns=columns) for page in pages]
+    frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    frame = frame.dropna(subset=["price"])
+    return frame.assign(date=pd.to_datetime(frame["date"].astype(str).str[:10]), price=frame["price"].astype(float))
+
+
+def _window_sums(values: np.ndarray, window: int):
+    """Per-column sums, sums of squares and counts of the non-NaN values in
+    the last ``window`` rows, for every row"""
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    zero = np.zeros((1, values.shape[1]))
+    totals = [np.concatenate((zero, np.cumsum(a, axis=0))) for a in (filled, filled * filled, present)]
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    return [total[end] - total[start] for total in totals]
+
+
+def _mean(values: np.ndarray, window: int) -> np.ndarray:
+    sums, _, counts = _window_sums(values, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _std(values: np.ndarray, window: int) -> np.ndarray:
+    sums, squares, counts = _window_sums(values, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = (squares - sums * sums / counts) / (counts - 1)
+    return np.where(counts > 1, np.sqrt(np.clip(variance, 0, None)), np.nan)
+
+
+def _change(prices: np.ndarray, days: pd.DatetimeIndex, offset: pd.DateOffset) -> np.ndarray:
+    carried = pd.DataFrame(prices).ffill(limit=CARRY_DAYS).to_numpy()
+    lagged = ((days - offset) - days[0]).days.to_numpy()
+    base = np.full_like(prices, np.nan)
+    valid = lagged >= 0
+    base[valid] = carried[lagged[valid]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (prices / base - 1) * 100
+
+
+def indicators(pages: Iterable[List[Dict[str, Any]]], parsed: List[Indicator],
+               start_date: Optional[date] = None) -> List[Dict[str, Any]]:
+    """One row per observed (region, commodity, date) from ``start_date`` on,
+    with the price and one key per indicator, ordered by series and date."""
+    frame = _frame(pages)
+    if frame.empty:
+        return []
+    wide = frame.pivot_table(index="date", columns=["region_id", "commodity_id"], values="price", aggfunc="mean")
+    days = pd.date_range(wide.index.min(), wide.index.max(), freq="D")
+    prices = wide.reindex(days).to_numpy(dtype=float)
+
+    values = {}
+    for name, kind, window in parsed:
+        if kind == "ma":
+            values[name] = _mean(prices, window)
+        elif kind == "volatility":
+            log_prices = np.log(prices)
+            returns = np.vstack((np.full((1, prices.shape[1]), np.nan), np.diff(log_prices, axis=0)))
+            values[name] = _std(returns, window)
+        else:
+            values[name] = _change(prices, days, CHANGE_PERIODS[kind][0])
+
+    keep = ~np.isnan(prices)
+    if start_date:
+        keep[days < pd.Timestamp(start_date)] = False
+    series, rows = np.nonzero(keep.T)
+    region_ids = np.array([region_id for region_id, _ in wide.columns], dtype=object)
+    commodity_ids = np.array([commodity_id for _, commodity_id in wide.columns], dtype=object)
+    result = pd.DataFrame({
+        "region_id": region_ids[series],
+        "commodity_id": commodity_ids[series],
+        "date": days[rows].strftime("%Y-%m-%d"),
+        "price": prices[rows, series],
+        **{name: array[rows, series] for name, array in values.items()},
+    })
+    result = result.astype(object).where(result.notna(), None)
+    return result.to_dict("records")
@@ -0,0 +1,331 @@
+"""Price rollups per (region, commodity) at week, month and year grain.
+
+Each cell holds the sum, count, min, max and last price of one series in one
+bucket. Writes update the cells they touch in O(1): an added row is folded
+in, a removed row (a delete, or the old image of an update) is taken back out
+of the sum and count. Min, max and last cannot be taken back out, so when a
+removed price was one of them the cell is marked stale and recomputed from
+its raw rows the next time a query reads it.
+
+Aggregates are answered from the coarsest cells that fit the date range
+(whole years, then whole months around them); only the partial months or
+weeks at the ends of the range are read as raw rows.
+"""
+import threading
+from datetime import date, timedelta
+from itertools import count as counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from aggregation import GROUP_COLUMNS, SOURCE_COLUMNS
+
+FetchRows = Callable[[Optional[List[str]], Optional[List[str]], Optional[date], Optional[date]], List[Dict[str, Any]]]
+
+GRAINS = ("week", "month", "year")
+
+# Grains that make up each output bucket, coarsest first
+PLANS = {
+    None: ("year", "month"),
+    "year": ("year", "month"),
+    "quarter": ("month",),
+    "month": ("month",),
+    "week": ("week",),
+}
+
+STATISTICS = ("mean", "min", "max", "last", "count")
+
+# Cell fields
+SUM, COUNT, MIN, MAX, LAST_DATE, LAST_ID, LAST_PRICE = range(7)
+
+ONE_DAY = timedelta(days=1)
+
+
+def bucket_start(grain: str, day: date) -> date:
+    if grain == "week":
+        return day - timedelta(days=day.weekday())
+    if grain == "month":
+        return day.replace(day=1)
+    if grain == "quarter":
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    return date(day.year, 1, 1)
+
+
+def bucket_end(grain: str, start: date) -> date:
+    if grain == "week":
+        return start + timedelta(days=6)
+    if grain == "month":
+        return (start + timedelta(days=32)).replace(day=1) - ONE_DAY
+    return date(start.year, 12, 31)
+
+
+def cover(start: Optional[date], end: Optional[date], grains: Tuple[str, ...]):
+    """Split ``[start, end]`` (None: unbounded) into ``(grain, first, last)``
+    ranges of whole buckets and the ``(start, end)`` raw ranges left over"""
+    if not grains:
+        return [], [(start, end)]
+    grain, finer = grains[0], grains[1:]
+    first = start
+    if start is not None and bucket_start(grain, start) != start:
+        first = bucket_end(grain, bucket_start(grain, start)) + ONE_DAY
+    last = None
+    if end is not None:
+        last = bucket_start(grain, end)
+        if bucket_end(grain, last) != end:
+            last = bucket_start(grain, last - ONE_DAY)
+    if first is not None and last is not None and first > last:
+        return cover(start, end, finer)
+
+    ranges, raw = [(grain, first, last)], []
+    edges = []
+    if start is not None and start < first:
+        edges.append((start, first - ONE_DAY))
+    if end is not None and bucket_end(grain, last) < end:
+        edges.append((bucket_end(grain, last) + ONE_DAY, end))
+    for edge_start, edge_end in edges:
+        edge_ranges, edge_raw = cover(edge_start, edge_end, finer)
+        ranges.extend(edge_ranges)
+        raw.extend(edge_raw)
+    return ranges, raw
+
+
+def _parse(row: Dict[str, Any]):
+    return (row["region_id"], row["commodity_id"]), date.fromisoformat(str(row["date"])[:10]), str(row["id"]), float(row["price"])
+
+
+def _new_cell(day: date, row_id: str, price: float) -> list:
+    return [price, 1, price, price, day, row_id, price]
+
+
+def _merge(cell: list, other: list) -> None:
+    cell[SUM] += other[SUM]
+    cell[COUNT] += other[COUNT]
+    cell[MIN] = min(cell[MIN], other[MIN])
+    cell[MAX] = max(cell[MAX], other[MAX])
+    if (other[LAST_DATE], other[LAST_ID]) > (cell[LAST_DATE], cell[LAST_ID]):
+        cell[LAST_DATE], cell[LAST_ID], cell[LAST_PRICE] = other[LAST_DATE], other[LAST_ID], other[LAST_PRICE]
+
+
+def _bucket_starts(grain: str, dates: pd.Series) -> pd.Series:
+    if grain == "week":
+        return (dates - pd.to_timedelta(dates.dt.weekday, unit="D")).dt.date
+    return dates.dt.to_period("M" if grain == "month" else "Y").dt.start_time.dt.date
+
+
+class Rollups:
+    def __init__(self, client, fetch_rows: FetchRows, page_size: int = 1000):
+        self.client = client
+        self.fetch_rows = fetch_rows
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        # grain -> (region_id, commodity_id) -> bucket start -> cell
+        self.cells: Optional[Dict[str, Dict[Tuple[str, str], Dict[date, list]]]] = None
+        # (grain, series, bucket start) -> version, bumped whenever the cell changes
+        self.stale: Dict[Tuple[str, Tuple[str, str], date], int] = {}
+        self.versions = counter(1)
+
+    @staticmethod
+    def supports(bucket: Optional[str], stats: Iterable[str]) -> bool:
+        return bucket in PLANS and all(stat in STATISTICS for stat in stats)
+
+    # Building
+    @staticmethod
+    def _cells_from_frame(frame: pd.DataFrame) -> Dict[str, Dict[Tuple[str, str], Dict[date, list]]]:
+        frame = frame.sort_values(["date", "id"], kind="stable")
+        cells = {}
+        for grain in GRAINS:
+            grouped = frame.assign(bucket=_bucket_starts(grain, frame["date"])).groupby(
+                ["region_id", "commodity_id", "bucket"], sort=False
+            )
+            summary = grouped["price"].agg(["sum", "count", "min", "max", "last"])
+            lasts = grouped[["date", "id"]].last()
+            series_cells: Dict[Tuple[str, str], Dict[date, list]] = {}
+            for (region_id, commodity_id, start), total, n, low, high, price, day, row_id in zip(
+                summary.index.tolist(), summary["sum"].tolist(), summary["count"].tolist(),
+                summary["min"].tolist(), summary["max"].tolist(), summary["last"].tolist(),
+                lasts["date"].dt.date.tolist(), lasts["id"].tolist(),
+            ):
+                series_cells.setdefault((region_id, commodity_id), {})[start] = [
+                    total, n, low, high, day, row_id, price
+                ]
+            cells[grain] = series_cells
+        return cells
+
+    def build(self) -> None:
+        """Recompute every cell from the whole table"""
+        columns = SOURCE_COLUMNS.split(",")
+        frames = []
+        start = 0
+        while True:
+            page = (
+                self.client.table("prices")
+                .select(SOURCE_COLUMNS)
+                .order("id")
+                .range(start, start + self.page_size - 1)
+                .execute()
+                .data
+            )
+            if page:
+                frames.append(pd.DataFrame(page, columns=columns))
+            if len(page) < self.page_size:
+                break
+            start += self.page_size
+        frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        frame["date"] = pd.to_datetime(frame["date"].astype(str).str[:10])
+        frame["price"] = pd.to_numeric(frame["price"]).astype(float)
+        frame["id"] = frame["id"].astype(str)
+        cells = self._cells_from_frame(frame)
+        with self.lock:
+            self.cells = cells
+            self.stale.clear()
+
+    def _ready(self) -> None:
+        if self.cells is None:
+            self.build()
+
+    # Write listener interface
+    def _touch(self, key) -> None:
+        self.stale[key] = next(self.versions)
+
+    def _add(self, row) -> None:
+        series, day, row_id, price = _parse(row)
+        for grain in GRAINS:
+            start = bucket_start(grain, day)
+            buckets = self.cells[grain].setdefault(series, {})
+            cell = buckets.get(start)
+            if cell is None:
+                buckets[start] = _new_cell(day, row_id, price)
+            else:
+                _merge(cell, _new_cell(day, row_id, price))
+            key = (grain, series, start)
+            if key in self.stale:
+                self._touch(key)
+
+    def _remove(self, row) -> None:
+        series, day, row_id, price = _parse(row)
+        for grain in GRAINS:
+            start = bucket_start(grain, day)
+            buckets = self.cells[grain].get(series, {})
+            cell = buckets.get(start)
+            if cell is None:
+                continue
+            key = (grain, series, start)
+            cell[SUM] -= price
+            cell[COUNT] -= 1
+            if cell[COUNT] <= 0:
+                del buckets[start]
+                self.stale.pop(key, None)
+            elif key in self.stale or price <= cell[MIN] or price >= cell[MAX] or (day, row_id) == (cell[LAST_DATE], cell[LAST_ID]):
+                self._touch(key)
+
+    def rows_changed(self, removed, added) -> None:
+        with self.lock:
+            if self.cells is None:
+                return
+            for row in removed:
+                self._remove(row)
+            for row in added:
+                self._add(row)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.cells = None
+            self.stale.clear()
+
+    # Queries
+    def _refresh(self, keys) -> None:
+        """Recompute stale cells from their raw rows (outside the lock; a cell
+        written to meanwhile stays stale for the next read)"""
+        for key in keys:
+            with self.lock:
+                version = self.stale.get(key)
+            if version is None:
+                continue
+            grain, (region_id, commodity_id), start = key
+            cell = None
+            for row in self.fetch_rows([region_id], [commodity_id], start, bucket_end(grain, start)):
+                _, day, row_id, price = _parse(row)
+                if cell is None:
+                    cell = _new_cell(day, row_id, price)
+                else:
+                    _merge(cell, _new_cell(day, row_id, price))
+            with self.lock:
+                if self.cells is None or self.stale.get(key) != version:
+                    continue
+                del self.stale[key]
+                buckets = self.cells[grain].setdefault((region_id, commodity_id), {})
+                if cell is None:
+                    buckets.pop(start, None)
+                else:
+                    buckets[start] = cell
+
+    def _collect(self, ranges, region_ids, commodity_ids):
+        """Copies of the cells inside ``ranges`` as (series, bucket start, cell),
+        plus the keys of the stale ones among them"""
+        regions = set(region_ids) if region_ids else None
+        commodities = set(commodity_ids) if commodity_ids else None
+        parts, stale = [], []
+        with self.lock:
+            for grain, first, last in ranges:
+                for series, buckets in self.cells[grain].items():
+                    if regions is not None and series[0] not in regions:
+                        continue
+                    if commodities is not None and series[1] not in commodities:
+                        continue
+                    for start, cell in buckets.items():
+                        if (first is None or start >= first) and (last is None or start <= last):
+                            parts.append((series, start, list(cell)))
+                            if (grain, series, start) in self.stale:
+                                stale.append((grain, series, start))
+        return parts, stale
+
+    def aggregate(self, region_ids: Optional[List[str]], commodity_ids: Optional[List[str]],
+                  start_date: Optional[date] = None, end_date: Optional[date] = None, group_by: str = "both",
+                  bucket: Optional[str] = None, stats: Iterable[str] = ("mean", "min", "max", "count")) -> List[Dict[str, Any]]:
+        """Same rows as ``aggregation.aggregate`` over the raw rows, for the
+        buckets in ``PLANS`` and the statistics in ``STATISTICS``"""
+        self._ready()
+        stats = list(dict.fromkeys(stats))
+        group_columns = list(GROUP_COLUMNS[group_by])
+
+        if start_date and end_date and start_date > end_date:
+            ranges, raw_ranges = [], []
+        else:
+            ranges, raw_ranges = cover(start_date, end_date, PLANS[bucket])
+
+        parts, stale = self._collect(ranges, region_ids, commodity_ids)
+        if stale:
+            self._refresh(stale)
+            parts, _ = self._collect(ranges, region_ids, commodity_ids)
+        for lo, hi in raw_ranges:
+            for row in self.fetch_rows(region_ids, commodity_ids, lo, hi):
+                series, day, row_id, price = _parse(row)
+                parts.append((series, day, _new_cell(day, row_id, price)))
+
+        groups: Dict[tuple, list] = {}
+        for (region_id, commodity_id), start, cell in parts:
+            values = {"region_id": region_id, "commodity_id": commodity_id}
+            key = tuple(values[column] for column in group_columns)
+            if bucket:
+                key += (bucket_start(bucket, start),)
+            if key in groups:
+                _merge(groups[key], cell)
+            else:
+                groups[key] = cell
+
+        if not groups and not group_columns and not bucket:
+            return [{stat: 0 if stat == "count" else None for stat in stats}]
+
+        result = []
+        for key in sorted(groups):
+            cell = groups[key]
+            row = dict(zip(group_columns, key))
+            if bucket:
+                row["bucket"] = key[-1].isoformat()
+            values = {
+                "mean": cell[SUM] / cell[COUNT], "min": cell[MIN], "max": cell[MAX],
+                "last": cell[LAST_PRICE], "count": cell[COUNT],
+            }
+            row.update((stat, values[stat]) for stat in stats)
+            result.append(row)
+        return result
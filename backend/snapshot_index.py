@@ -0,0 +1,162 @@
+"""As-of price lookups from a per-(region, commodity) sorted date index.
+
+Each series keeps its days (as ordinals) and prices in two NumPy arrays
+sorted by day. The price of a series as of a day is found by binary search:
+the last observed day on or before it, if that is at most ``max_age_days``
+earlier (several prices on that day are averaged, as in the other series
+endpoints). A region x commodity snapshot is one search per series.
+
+The index is a write listener: an added row is inserted at its sorted
+position and a removed one taken out, so lookups never rescan the table.
+The latest price of every series is kept alongside and updated on each
+write, so the current snapshot needs no search at all.
+"""
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from aggregation import SOURCE_COLUMNS
+
+Series = Tuple[str, str]
+
+# Ordinal of 1970-01-01, to turn datetime64[D] values into date ordinals
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def _parse(row: Dict[str, Any]):
+    return (row["region_id"], row["commodity_id"]), date.fromisoformat(str(row["date"])[:10]).toordinal(), float(row["price"])
+
+
+def _last(days: np.ndarray, prices: np.ndarray, end: int) -> Tuple[int, float]:
+    """Day and mean price of the last observed day among the first ``end`` entries"""
+    day = days[end - 1]
+    start = int(np.searchsorted(days, day, "left"))
+    return int(day), float(prices[start:end].mean())
+
+
+class SnapshotIndex:
+    def __init__(self, client, page_size: int = 1000):
+        self.client = client
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        # series -> (days, prices), both sorted by day
+        self.series: Optional[Dict[Series, Tuple[np.ndarray, np.ndarray]]] = None
+        # series -> (day, price) of its last observed day
+        self.latest: Dict[Series, Tuple[int, float]] = {}
+
+    # Building
+    def load(self, frame: pd.DataFrame) -> None:
+        """Replace the index with the ``region_id, commodity_id, date, price`` rows of ``frame``"""
+        frame = frame.dropna(subset=["price"])
+        days = pd.to_datetime(frame["date"].astype(str).str[:10]).to_numpy("datetime64[D]").astype(np.int64)
+        frame = frame.assign(day=days + EPOCH, price=frame["price"].astype(float))
+        frame = frame.sort_values(["region_id", "commodity_id", "day"], kind="stable")
+        series = {}
+        for key, group in frame.groupby(["region_id", "commodity_id"], sort=False):
+            series[key] = (group["day"].to_numpy(), group["price"].to_numpy())
+        latest = {key: _last(days, prices, len(days)) for key, (days, prices) in series.items()}
+        with self.lock:
+            self.series = series
+            self.latest = latest
+
+    def build(self) -> None:
+        """Load every row of the table"""
+        columns = SOURCE_COLUMNS.split(",")
+        frames = []
+        start = 0
+        while True:
+            page = (
+                self.client.table("prices")
+                .select(SOURCE_COLUMNS)
+                .order("id")
+                .range(start, start + self.page_size - 1)
+                .execute()
+                .data
+            )
+            if page:
+                frames.append(pd.DataFrame(page, columns=columns))
+            if len(page) < self.page_size:
+                break
+            start += self.page_size
+        self.load(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns))
+
+    def _ready(self) -> None:
+        if self.series is None:
+            self.build()
+
+    # Write listener interface
+    def _refresh_latest(self, key: Series) -> None:
+        days, prices = self.series.get(key, (None, None))
+        if days is None or not len(days):
+            self.series.pop(key, None)
+            self.latest.pop(key, None)
+        else:
+            self.latest[key] = _last(days, prices, len(days))
+
+    def _add(self, row) -> Series:
+        key, day, price = _parse(row)
+        days, prices = self.series.get(key, (np.empty(0, dtype=np.int64), np.empty(0)))
+        at = int(np.searchsorted(days, day, "right"))
+        self.series[key] = (np.insert(days, at, day), np.insert(prices, at, price))
+        return key
+
+    def _remove(self, row) -> Series:
+        key, day, price = _parse(row)
+        days, prices = self.series.get(key, (np.empty(0, dtype=np.int64), np.empty(0)))
+        start, end = np.searchsorted(days, day, "left"), np.searchsorted(days, day, "right")
+        matches = np.flatnonzero(prices[start:end] == price)
+        if len(matches):
+            at = start + int(matches[0])
+            self.series[key] = (np.delete(days, at), np.delete(prices, at))
+        return key
+
+    def rows_changed(self, removed, added) -> None:
+        with self.lock:
+            if self.series is None:
+                return
+            touched = {self._remove(row) for row in removed} | {self._add(row) for row in added}
+            for key in touched:
+                self._refresh_latest(key)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.series = None
+            self.latest = {}
+
+    # Queries
+    def snapshot(self, region_ids: List[str], commodity_ids: List[str], as_of: Optional[date],
+                 max_age_days: int) -> Dict[str, Any]:
+        """Prices as of ``as_of`` (default: the last day with a price) for every
+        region x commodity pair, with how many days old each one is; None
+        where a series has no price within ``max_age_days`` before ``as_of``"""
+        self._ready()
+        with self.lock:
+            if as_of is None:
+                days = [day for day, _ in self.latest.values()]
+                as_of = date.fromordinal(max(days)) if days else date.today()
+            target = as_of.toordinal()
+            prices, ages = [], []
+            for region_id in region_ids:
+                price_row, age_row = [], []
+                for commodity_id in commodity_ids:
+                    found = self._as_of((region_id, commodity_id), target)
+                    if found is None or target - found[0] > max_age_days:
+                        price_row.append(None)
+                        age_row.append(None)
+                    else:
+                        price_row.append(found[1])
+                        age_row.append(target - found[0])
+                prices.append(price_row)
+                ages.append(age_row)
+        return {"as_of": as_of.isoformat(), "prices": prices, "age_days": ages}
+
+    def _as_of(self, key: Series, target: int) -> Optional[Tuple[int, float]]:
+        latest = self.latest.get(key)
+        if latest is None or latest[0] <= target:
+            return latest
+        days, prices = self.series[key]
+        end = int(np.searchsorted(days, target, "right"))
+        return _last(days, prices, end) if end else None
@@ -0,0 +1,338 @@
+"""Pluggable storage engines behind the supabase client interface.
+
+The API code talks to ``supabase.table(...)`` query chains. A ``LocalClient``
+exposes the same chain (``select().eq().in_().gte().lte().limit().execute()``
+plus ``insert``/``update``/``upsert``/``delete``) on top of in-process engines, so
+``main.py`` runs unchanged whichever engine is configured.
+"""
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import anyio
+
+
+class Condition(NamedTuple):
+    column: str
+    op: str
+    value: Any
+
+
+def _split_top_level(text: str) -> List[str]:
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        current.append(char)
+    if current:
+        parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def parse_logic_tree(text: str) -> List[Condition]:
+    """Parse a PostgREST logic filter such as ``a.gt.1,and(a.eq.1,b.gt.x)``.
+
+    Nested groups become conditions with ``column=None`` and ``op`` set to
+    ``"and"``/``"or"``; their value is the list of child conditions.
+    """
+    conditions = []
+    for part in _split_top_level(text):
+        for group in ("and", "or"):
+            if part.startswith(group + "(") and part.endswith(")"):
+                conditions.append(Condition(None, group, parse_logic_tree(part[len(group) + 1:-1])))
+                break
+        else:
+            try:
+                column, op, value = part.split(".", 2)
+            except ValueError:
+                raise ValueError(f"Invalid filter '{part}'")
+            if op == "in":
+                value = [_unquote(v) for v in _split_top_level(value.strip()[1:-1])]
+            else:
+                value = _unquote(value)
+            conditions.append(Condition(column, op, value))
+    return conditions
+
+
+class QuerySpec:
+    """Everything a query chain collected before ``execute()``."""
+
+    def __init__(self, table: str):
+        self.table = table
+        self.action = "select"
+        self.columns = "*"
+        self.count: Optional[str] = None
+        self.head = False
+        self.where: List[Condition] = []
+        self.order: List[Tuple[str, bool]] = []
+        self.limit: Optional[int] = None
+        self.offset = 0
+        self.payload: Any = None
+        self.on_conflict: List[str] = []
+
+
+class APIResponse:
+    def __init__(self, data: List[Dict[str, Any]], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class StorageEngine:
+    """Interface every local engine implements.
+
+    ``select`` returns ``(rows, count)``; ``count`` is only computed when the
+    spec asks for it. Writes return the affected rows, like PostgREST does with
+    ``return=representation``.
+    """
+
+    def select(self, spec: QuerySpec) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        raise NotImplementedError
+
+    def insert(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update(self, spec: QuerySpec, values: Dict[str, Any]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete(self, spec: QuerySpec) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def upsert(self, rows: List[Dict[str, Any]], on_conflict: Sequence[str]) -> List[Dict[str, Any]]:
+        """Update the rows whose ``on_conflict`` columns match, insert the rest"""
+        raise NotImplementedError
+
+    def replace_all(self, rows: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+
+class QueryBuilder:
+    """Mimics the postgrest request builder for a single table."""
+
+    def __init__(self, engine: StorageEngine, table: str):
+        self._engine = engine
+        self._spec = QuerySpec(table)
+        self._calls: List[Tuple[str, tuple, dict]] = []
+
+    def _record(self, name, args, kwargs):
+        self._calls.append((name, args, kwargs))
+        return self
+
+    # Actions
+    def select(self, *columns: str, count: Optional[str] = None, head: Optional[bool] = None):
+        self._spec.action = "select"
+        self._spec.columns = ",".join(columns) if columns else "*"
+        self._spec.count = count
+        self._spec.head = bool(head)
+        return self._record("select", columns, {"count": count, "head": head})
+
+    def insert(self, json, *, count: Optional[str] = None):
+        self._spec.action = "insert"
+        self._spec.payload = json if isinstance(json, list) else [json]
+        self._spec.count = count
+        return self._record("insert", (json,), {"count": count})
+
+    def update(self, json: Dict[str, Any], *, count: Optional[str] = None):
+        self._spec.action = "update"
+        self._spec.payload = dict(json)
+        self._spec.count = count
+        return self._record("update", (json,), {"count": count})
+
+    def delete(self, *, count: Optional[str] = None):
+        self._spec.action = "delete"
+        self._spec.count = count
+        return self._record("delete", (), {"count": count})
+
+    def upsert(self, json, *, count: Optional[str] = None, on_conflict: str = "", default_to_null: bool = True):
+        # Local engines always fill missing columns with their defaults
+        self._spec.action = "upsert"
+        self._spec.payload = json if isinstance(json, list) else [json]
+        self._spec.on_conflict = [column.strip() for column in on_conflict.split(",") if column.strip()] or ["id"]
+        self._spec.count = count
+        return self._record(
+            "upsert", (json,), {"count": count, "on_conflict": on_conflict, "default_to_null": default_to_null}
+        )
+
+    # Filters
+    def _filter(self, name, column, op, value):
+        self._spec.where.append(Condition(column, op, value))
+        return self._record(name, (column, value), {})
+
+    def eq(self, column: str, value: Any):
+        return self._filter("eq", column, "eq", value)
+
+    def neq(self, column: str, value: Any):
+        return self._filter("neq", column, "neq", value)
+
+    def gt(self, column: str, value: Any):
+        return self._filter("gt", column, "gt", value)
+
+    def gte(self, column: str, value: Any):
+        return self._filter("gte", column, "gte", value)
+
+    def lt(self, column: str, value: Any):
+        return self._filter("lt", column, "lt", value)
+
+    def lte(self, column: str, value: Any):
+        return self._filter("lte", column, "lte", value)
+
+    def in_(self, column: str, values):
+        return self._filter("in_", column, "in", list(values))
+
+    def or_(self, filters: str):
+        self._spec.where.append(Condition(None, "or", parse_logic_tree(filters)))
+        return self._record("or_", (filters,), {})
+
+    # Modifiers
+    def order(self, column: str, *, desc: bool = False):
+        self._spec.order.append((column, desc))
+        return self._record("order", (column,), {"desc": desc})
+
+    def limit(self, size: int):
+        self._spec.limit = size
+        return self._record("limit", (size,), {})
+
+    def offset(self, size: int):
+        self._spec.offset = size
+        return self._record("offset", (size,), {})
+
+    def range(self, start: int, end: int):
+        self._spec.offset = start
+        self._spec.limit = end - start + 1
+        return self._record("range", (start, end), {})
+
+    def execute(self) -> APIResponse:
+        spec = self._spec
+        if spec.action == "select":
+            rows, count = self._engine.select(spec)
+            return APIResponse(rows, count)
+        if spec.action == "insert":
+            rows = self._engine.insert(spec.payload)
+        elif spec.action == "update":
+            rows = self._engine.update(spec, spec.payload)
+        elif spec.action == "upsert":
+            rows = self._engine.upsert(spec.payload, spec.on_conflict)
+        else:
+            rows = self._engine.delete(spec)
+        return APIResponse(rows, len(rows) if spec.count else None)
+
+
+class LocalClient:
+    """Client exposing in-process engines through ``table(name)``."""
+
+    def __init__(self, engines: Dict[str, StorageEngine]):
+        self.engines = engines
+
+    def table(self, name: str) -> QueryBuilder:
+        if name not in self.engines:
+            raise ValueError(f"Unknown table '{name}'")
+        return QueryBuilder(self.engines[name], name)
+
+
+class MirroredQueryBuilder(QueryBuilder):
+    """Reads from the local engine; writes go to the remote table first and
+    the returned rows are then applied locally so both stay in step."""
+
+    def __init__(self, engine: StorageEngine, table: str, remote):
+        super().__init__(engine, table)
+        self._remote = remote
+
+    def execute(self) -> APIResponse:
+        spec = self._spec
+        if spec.action == "select":
+            return super().execute()
+
+        remote_query = self._remote.table(spec.table)
+        for name, args, kwargs in self._calls:
+            remote_query = getattr(remote_query, name)(*args, **kwargs)
+        response = remote_query.execute()
+
+        rows = response.data or []
+        ids = [row["id"] for row in rows if "id" in row]
+        if spec.action in ("update", "upsert", "delete") and ids:
+            id_spec = QuerySpec(spec.table)
+            id_spec.where.append(Condition("id", "in", ids))
+            self._engine.delete(id_spec)
+        if spec.action in ("insert", "update", "upsert") and rows:
+            self._engine.insert(rows)
+        return response
+
+
+class MirroredClient(LocalClient):
+    def __init__(self, engines: Dict[str, StorageEngine], remote):
+        super().__init__(engines)
+        self.remote = remote
+        self._sync_lock = threading.Lock()
+
+    def table(self, name: str) -> QueryBuilder:
+        if name not in self.engines:
+            return self.remote.table(name)
+        return MirroredQueryBuilder(self.engines[name], name, self.remote)
+
+    def sync(self, name: str, page_size: int = 1000) -> int:
+        """Reload a local table from its remote counterpart."""
+        with self._sync_lock:
+            rows: List[Dict[str, Any]] = []
+            start = 0
+            while True:
+                page = (
+                    self.remote.table(name)
+                    .select("*")
+                    .order("id")
+                    .range(start, start + page_size - 1)
+                    .execute()
+                    .data
+                )
+                rows.extend(page)
+                if len(page) < page_size:
+                    break
+                start += page_size
+            self.engines[name].replace_all(rows)
+            return len(rows)
+
+
+class AsyncQueryBuilder:
+    """Awaitable ``execute()`` over a synchronous query builder.
+
+    Chain calls are forwarded as they are; ``execute()`` runs in a worker
+    thread so a large local query never blocks the event loop.
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __getattr__(self, name):
+        method = getattr(self._builder, name)
+
+        def chain(*args, **kwargs):
+            self._builder = method(*args, **kwargs)
+            return self
+
+        return chain
+
+    async def execute(self) -> APIResponse:
+        return await anyio.to_thread.run_sync(self._builder.execute)
+
+
+class AsyncLocalClient:
+    """Async facade over a ``LocalClient``/``MirroredClient``."""
+
+    def __init__(self, client: LocalClient):
+        self.client = client
+
+    def table(self, name: str) -> AsyncQueryBuilder:
+        return AsyncQueryBuilder(self.client.table(name))
+
+    async def aclose(self) -> None:
+        pass
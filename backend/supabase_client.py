@@ -1,10 +1,101 @@
+import inspect
 import os
+import httpx
 from supabase import create_client
+from postgrest import AsyncPostgrestClient
 from dotenv import load_dotenv
 
+from storage import LocalClient, MirroredClient, AsyncLocalClient
+from columnar_store import create_price_engine
+from price_cube import CubeEngine
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY) # type: ignore
+# Storage engine behind `supabase`:
+#   "supabase" - every query goes to the remote PostgREST API (default)
+#   "local"    - in-process columnar store, optionally seeded from PRICE_STORE_SEED
+#   "synced"   - columnar store loaded from the remote prices table; reads are
+#                served locally and writes go to Supabase first
+#   "cube"     - memory-mapped price cube built by price_cube.py in PRICE_CUBE_DIR;
+#                writes stay in the process, like "local"
+PRICE_STORE = os.getenv("PRICE_STORE", "supabase").strip().lower()
+PRICE_STORE_SEED = os.getenv("PRICE_STORE_SEED")
+PRICE_CUBE_DIR = os.getenv("PRICE_CUBE_DIR", "price_cube")
+
+
+def create_store_client():
+    if PRICE_STORE == "supabase":
+        return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY) # type: ignore
+
+    if PRICE_STORE == "cube":
+        return LocalClient({"prices": CubeEngine(PRICE_CUBE_DIR)})
+
+    # The local store enforces the natural key itself; a mirror takes what the remote accepted
+    engines = {"prices": create_price_engine(unique=PRICE_STORE == "local")}
+
+    if PRICE_STORE == "local":
+        if PRICE_STORE_SEED:
+            engines["prices"].load_csv(PRICE_STORE_SEED)
+        return LocalClient(engines)
+
+    if PRICE_STORE == "synced":
+        remote = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY) # type: ignore
+        client = MirroredClient(engines, remote)
+        client.sync("prices")
+        return client
+
+    raise ValueError(f"Unknown PRICE_STORE '{PRICE_STORE}'")
+
+
+supabase = create_store_client()
+
+# Connection pool shared by every request of the async client
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "100"))
+SUPABASE_POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "10"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "1") == "1"
+
+
+def create_pooled_session(base_url: str, headers: dict) -> httpx.AsyncClient:
+    """One bounded, keep-alive (HTTP/2) connection pool for the async PostgREST client."""
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT, pool=SUPABASE_POOL_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_POOL_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+        follow_redirects=True,
+        http2=SUPABASE_HTTP2,
+    )
+
+
+def create_async_store_client():
+    """Client with an awaitable ``execute()`` for the async endpoints.
+
+    Remote reads and writes go through PostgREST on the pooled session above;
+    local engines are wrapped so their (in-process) queries run in a worker
+    thread.
+    """
+    if PRICE_STORE == "supabase":
+        if "http_client" not in inspect.signature(AsyncPostgrestClient.__init__).parameters:
+            raise RuntimeError("postgrest does not accept http_client=; install the version pinned in requirements.txt")
+        base_url = f"{SUPABASE_URL}/rest/v1"
+        headers = {"apikey": SUPABASE_SERVICE_ROLE_KEY, "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}"}
+        session = create_pooled_session(base_url, headers) # type: ignore
+        client = AsyncPostgrestClient(base_url, headers=headers, http_client=session) # type: ignore
+        if client.session is not session:
+            raise RuntimeError("postgrest ignored the pooled http_client; install the version pinned in requirements.txt")
+        return client
+    return AsyncLocalClient(supabase)
+
+
+async_supabase = create_async_store_client()
@@ -0,0 +1,36 @@
+"""Listeners notified after rows of the prices table change.
+
+Write endpoints report the row images they removed and added (an update is
+both), so derived structures can be maintained without rescanning the table.
+A listener implements ``rows_changed(removed, added)`` and ``reset()``; the
+latter is used after bulk operations where row images are not available.
+"""
+import logging
+from typing import Any, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+_listeners: List[Any] = []
+
+
+def register(listener) -> None:
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def rows_changed(removed: Iterable[Dict[str, Any]] = (), added: Iterable[Dict[str, Any]] = ()) -> None:
+    removed, added = list(removed), list(added)
+    if not removed and not added:
+        return
+    for listener in list(_listeners):
+        try:
+            listener.rows_changed(removed, added)
+        except Exception:
+            # A stale derived structure must never fail the write itself
+            logger.exception("Write listener %r failed; resetting it", listener)
+            listener.reset()
+
+
+def table_reset() -> None:
+    for listener in list(_listeners):
+        listener.reset()
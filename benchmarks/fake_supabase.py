@@ -0,0 +1,65 @@
+"""In-memory stand-in for ``supabase_client.supabase`` used by the benchmarks.
+
+``FakeSupabase`` is a ``LocalClient`` over the columnar prices engine, so it
+answers the same ``table().select().eq().in_().gte().lte().limit().execute()``
+chains as the real client, with no network. Each ``execute()`` can wait a
+fixed round-trip time plus a per-row transfer time, to approximate what a
+remote PostgREST call would add on top of the query itself.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from columnar_store import create_price_engine  # noqa: E402
+from storage import AsyncLocalClient, LocalClient, QueryBuilder  # noqa: E402
+
+import synthetic_data  # noqa: E402
+
+
+class FakeQueryBuilder(QueryBuilder):
+    def __init__(self, engine, table, client):
+        super().__init__(engine, table)
+        self._client = client
+
+    def execute(self):
+        response = super().execute()
+        self._client.calls += 1
+        delay = self._client.latency + self._client.row_latency * len(response.data or [])
+        if delay:
+            time.sleep(delay)
+        return response
+
+
+class FakeSupabase(LocalClient):
+    def __init__(self, latency_ms: float = 0.0, row_latency_us: float = 0.0):
+        # Unique (region, commodity, date) like the real table, so writes fail where they would there
+        super().__init__({"prices": create_price_engine(unique=True)})
+        self.latency = latency_ms / 1000
+        self.row_latency = row_latency_us / 1_000_000
+        self.calls = 0
+
+    def table(self, name: str) -> FakeQueryBuilder:
+        if name not in self.engines:
+            raise ValueError(f"Unknown table '{name}'")
+        return FakeQueryBuilder(self.engines[name], name, self)
+
+    def seed(self, rows: int, seed: int = 0) -> int:
+        """Fill the prices table with about ``rows`` synthetic rows"""
+        frame = synthetic_data.generate(rows, seed)
+        return self.engines["prices"].load_columns(synthetic_data.to_price_columns(frame, seed))
+
+
+def install(fake: FakeSupabase) -> None:
+    """Point ``supabase_client`` at the fake; call before importing ``main``.
+
+    ``main`` binds ``supabase``/``async_supabase`` at import time, so the
+    API, the count index and the bulk writers all see the fake.
+    """
+    os.environ.setdefault("PRICE_STORE", "local")
+    import supabase_client
+
+    supabase_client.supabase = fake
+    supabase_client.async_supabase = AsyncLocalClient(fake)
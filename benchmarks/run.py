@@ -0,0 +1,311 @@
+"""Offline latency, throughput and memory benchmarks for the API.
+
+Every (mode, rows) combination runs in a fresh process on a ``FakeSupabase``
+seeded with synthetic rows, so nothing touches the network:
+
+    testclient - requests go through FastAPI's TestClient in the same process
+    uvicorn    - a real uvicorn process (serve.py) is driven over HTTP
+
+Each scenario sends ``--repeat`` requests. The first is reported as
+``cold_ms`` (in testclient mode the write listeners, i.e. the query cache and
+count index, are reset before it); the rest give the warm p50/p95/p99 and
+requests per second. ``peak_rss_bytes`` is the high-water mark of the process
+serving the API, seeding included.
+
+    python benchmarks/run.py --rows 100000 1000000 --out bench.json
+    python benchmarks/run.py --rows 1000000 --env QUERY_CACHE=1 --env COUNT_INDEX=1
+    python benchmarks/run.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ("testclient", "uvicorn")
+DEFAULT_ROWS = (100_000, 1_000_000)
+SERVER_START_TIMEOUT = 1800
+
+MULTI_REGIONS = ["Aceh", "Bali", "Banten", "Jawa Barat", "Jawa Timur"]
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    path: str
+    params: Optional[Dict[str, Any]] = None
+    # Request body for the i-th request
+    body: Optional[Callable[[int], Dict[str, Any]]] = None
+
+
+def scenarios(rows: int, seed: int) -> List[Scenario]:
+    import synthetic_data
+
+    first, last = synthetic_data.date_range(rows)
+    recent = max(first, last - timedelta(days=29))
+    rng = random.Random(seed)
+
+    def new_price(i):
+        # Days after the generated range, so every insert is a new (region, commodity, date)
+        day = last + timedelta(days=i + 1)
+        return {"region": "Aceh", "commodity": "Beras Medium", "date": day.isoformat(),
+                "price": round(rng.uniform(10000, 15000), 2), "created_by": "benchmark"}
+
+    return [
+        Scenario("data_single_region", "GET", "/data", {"regions": ["Aceh"]}),
+        Scenario("data_multi_region", "GET", "/data", {"regions": MULTI_REGIONS}),
+        Scenario("data_wide_range", "GET", "/data", {
+            "commodities": ["Beras Medium"], "start_date": first.isoformat(), "end_date": last.isoformat()
+        }),
+        Scenario("data_narrow_range", "GET", "/data", {
+            "commodities": ["Beras Medium"], "start_date": recent.isoformat(), "end_date": last.isoformat()
+        }),
+        Scenario("count_all", "GET", "/data/count"),
+        Scenario("count_single_region", "GET", "/data/count", {"regions": ["Aceh"]}),
+        Scenario("count_multi_region", "GET", "/data/count", {"regions": MULTI_REGIONS}),
+        Scenario("count_wide_range", "GET", "/data/count", {
+            "commodities": ["Beras Medium"], "start_date": first.isoformat(), "end_date": last.isoformat()
+        }),
+        # Update and delete work on the rows the insert scenario created
+        Scenario("write_insert", "POST", "/data", body=new_price),
+        Scenario("write_update", "PUT", "/data/{id}", body=lambda i: {"price": round(rng.uniform(10000, 15000), 2)}),
+        Scenario("write_delete", "DELETE", "/data/{id}"),
+    ]
+
+
+def summarize(name: str, latencies: List[float], errors: int, result_rows: Optional[int]) -> Dict[str, Any]:
+    warm = np.array(latencies[1:] or latencies) * 1000
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "rows_per_request": result_rows,
+        "cold_ms": latencies[0] * 1000,
+        "p50_ms": float(np.percentile(warm, 50)),
+        "p95_ms": float(np.percentile(warm, 95)),
+        "p99_ms": float(np.percentile(warm, 99)),
+        "mean_ms": float(warm.mean()),
+        "requests_per_second": float(len(warm) / warm.sum() * 1000) if warm.sum() else None,
+    }
+
+
+def run_scenarios(send, plan: List[Scenario], repeat: int, reset: Optional[Callable[[], None]] = None):
+    results = []
+    inserted: List[str] = []
+    for scenario in plan:
+        if reset:
+            reset()
+        latencies, errors, result_rows = [], 0, None
+        for i in range(repeat):
+            path = scenario.path.format(id=inserted[i]) if "{id}" in scenario.path else scenario.path
+            body = scenario.body(i) if scenario.body else None
+            started = time.perf_counter()
+            response = send(scenario.method, path, params=scenario.params, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+                continue
+            payload = response.json()
+            if isinstance(payload, list):
+                result_rows = len(payload)
+            elif scenario.name == "write_insert":
+                inserted.append(payload["data"][0]["id"])
+        results.append(summarize(scenario.name, latencies, errors, result_rows))
+        print(f"  {scenario.name:<22} p50 {results[-1]['p50_ms']:9.2f} ms  p99 {results[-1]['p99_ms']:9.2f} ms",
+              file=sys.stderr)
+    return results
+
+
+def peak_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_testclient(args) -> Dict[str, Any]:
+    import fake_supabase
+
+    started = time.perf_counter()
+    fake = fake_supabase.FakeSupabase(args.latency_ms, args.row_latency_us)
+    loaded = fake.seed(args.rows, args.seed)
+    load_seconds = time.perf_counter() - started
+    fake_supabase.install(fake)
+
+    import write_hooks
+    from fastapi.testclient import TestClient
+    import main as api
+
+    with TestClient(api.app) as client:
+        results = run_scenarios(client.request, scenarios(args.rows, args.seed), args.repeat, write_hooks.table_reset)
+    return {"rows": loaded, "load_seconds": load_seconds, "peak_rss_bytes": peak_rss(), "scenarios": results}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_uvicorn(args) -> Dict[str, Any]:
+    import requests
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    command = [
+        sys.executable, os.path.join(HERE, "serve.py"), "--rows", str(args.rows), "--seed", str(args.seed),
+        "--port", str(port), "--latency-ms", str(args.latency_ms), "--row-latency-us", str(args.row_latency_us),
+    ]
+    started = time.perf_counter()
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    session = requests.Session()
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            if time.perf_counter() - started > SERVER_START_TIMEOUT:
+                raise RuntimeError("Server did not start in time")
+            try:
+                session.get(f"{base}/", timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        load_seconds = time.perf_counter() - started
+
+        def send(method, path, **kwargs):
+            return session.request(method, base + path, **kwargs)
+
+        results = run_scenarios(send, scenarios(args.rows, args.seed), args.repeat)
+    finally:
+        server.terminate()
+        output, _ = server.communicate(timeout=60)
+    lines = [line for line in output.splitlines() if line.startswith("{")]
+    served = json.loads(lines[-1]) if lines else {}
+    return {"rows": served.get("rows"), "load_seconds": load_seconds,
+            "peak_rss_bytes": served.get("peak_rss_bytes"), "scenarios": results}
+
+
+def run_worker(args) -> int:
+    sys.path.insert(0, HERE)
+    run = run_testclient if args.worker == "testclient" else run_uvicorn
+    result = {"mode": args.worker, "requested_rows": args.rows, **run(args)}
+    json.dump(result, sys.stdout)
+    return 0
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(args) -> int:
+    env = dict(os.environ)
+    for assignment in args.env:
+        key, _, value = assignment.partition("=")
+        env[key] = value
+
+    results = []
+    for mode in args.modes:
+        for rows in args.rows:
+            print(f"{mode}, {rows} rows", file=sys.stderr)
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker", mode, "--rows", str(rows),
+                "--seed", str(args.seed), "--repeat", str(args.repeat),
+                "--latency-ms", str(args.latency_ms), "--row-latency-us", str(args.row_latency_us),
+            ]
+            completed = subprocess.run(command, stdout=subprocess.PIPE, text=True, env=env)
+            if completed.returncode != 0:
+                print(f"{mode} with {rows} rows failed (exit code {completed.returncode})", file=sys.stderr)
+                continue
+            results.append(json.loads(completed.stdout))
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "latency_ms": args.latency_ms,
+            "row_latency_us": args.row_latency_us,
+            "env": args.env,
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Results written to {args.out}", file=sys.stderr)
+    return 0
+
+
+def mebibytes(size: Optional[int]) -> str:
+    return "?" if size is None else f"{size / 2**20:.0f}"
+
+
+def compare(old_path: str, new_path: str) -> int:
+    """Print new/old ratios of the headline numbers of two result files"""
+    with open(old_path) as handle:
+        old = json.load(handle)
+    with open(new_path) as handle:
+        new = json.load(handle)
+
+    def index(report):
+        return {(r["mode"], r["requested_rows"]): r for r in report["results"]}
+
+    old_runs, new_runs = index(old), index(new)
+    for key in sorted(old_runs.keys() & new_runs.keys()):
+        before, after = old_runs[key], new_runs[key]
+        print(f"{key[0]}, {key[1]} rows: peak RSS {mebibytes(before['peak_rss_bytes'])} -> "
+              f"{mebibytes(after['peak_rss_bytes'])} MiB")
+        after_scenarios = {s["name"]: s for s in after["scenarios"]}
+        for scenario in before["scenarios"]:
+            other = after_scenarios.get(scenario["name"])
+            if not other:
+                continue
+            ratios = "  ".join(
+                f"{metric} {scenario[metric]:8.2f} -> {other[metric]:8.2f} ({other[metric] / scenario[metric]:5.2f}x)"
+                for metric in ("p50_ms", "p99_ms")
+                if scenario[metric]
+            )
+            print(f"  {scenario['name']:<22} {ratios}")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the API against an in-memory fake Supabase")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_ROWS),
+                        help="Table sizes to benchmark, e.g. 100000 1000000 10000000")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=30, help="Requests per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated round trip per query")
+    parser.add_argument("--row-latency-us", type=float, default=0.0, help="Simulated transfer time per returned row")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Environment for the API process, e.g. QUERY_CACHE=1")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.worker:
+        args.rows = args.rows[0]
+        return run_worker(args)
+    return run_all(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
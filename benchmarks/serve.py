@@ -0,0 +1,40 @@
+"""Run the API under uvicorn on a seeded ``FakeSupabase``.
+
+Started by ``run.py`` for the ``uvicorn`` mode. On shutdown (SIGINT/SIGTERM)
+the process prints its row count and peak RSS as JSON on stdout.
+"""
+import argparse
+import json
+import resource
+import signal
+import sys
+
+import uvicorn
+
+import fake_supabase
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the API on synthetic data")
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--row-latency-us", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    fake = fake_supabase.FakeSupabase(args.latency_ms, args.row_latency_us)
+    rows = fake.seed(args.rows, args.seed)
+    fake_supabase.install(fake)
+    import main as api
+
+    # uvicorn re-raises the shutdown signal once it has stopped; a no-op
+    # handler lets the process get on to reporting instead of dying
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    uvicorn.run(api.app, host="127.0.0.1", port=args.port, log_level="warning")
+    print(json.dumps({"rows": rows, "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Synthetic price data shaped like ``data_prep/outputfinal.csv``.
+
+Every (commodity, region) series in the template file is extended back in
+time to reach the requested row count. Prices follow a mean-reverting random
+walk around the series' observed level, with that series' day-to-day
+volatility, so filters and aggregates see realistic distributions.
+
+    python benchmarks/synthetic_data.py --rows 1000000 --out prices_1m.csv
+"""
+import argparse
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from id_mapping import region_map, commodity_map  # noqa: E402
+
+TEMPLATE_PATH = os.path.join(ROOT, "data_prep", "outputfinal.csv")
+END_DATE = date(2024, 12, 31)
+
+# Daily pull of the log price back towards the series level
+MEAN_REVERSION = 0.02
+
+
+def series_templates(path: str = TEMPLATE_PATH) -> pd.DataFrame:
+    """Level and daily log-return volatility of every (commodity, region) series"""
+    if not os.path.exists(path):
+        pairs = pd.MultiIndex.from_product([list(commodity_map), list(region_map)], names=["commodity", "region"])
+        return pd.DataFrame({"level": 20000.0, "volatility": 0.01}, index=pairs).reset_index()
+
+    frame = pd.read_csv(path)
+    keys = frame["id"].str.rsplit("/", n=2, expand=True)
+    frame = frame.assign(commodity=keys[0], region=keys[1], date=keys[2]).sort_values(["commodity", "region", "date"])
+    frame["log_return"] = np.log(frame["price"]).groupby([frame["commodity"], frame["region"]]).diff()
+    templates = frame.groupby(["commodity", "region"], sort=True).agg(
+        level=("price", "mean"), volatility=("log_return", "std")
+    ).reset_index()
+    templates["volatility"] = templates["volatility"].fillna(0.01).clip(lower=1e-4)
+    return templates
+
+
+def days_per_series(rows: int, series: int) -> int:
+    return max(1, rows // series)
+
+
+def date_range(rows: int, end: date = END_DATE, path: str = TEMPLATE_PATH):
+    """First and last date ``generate(rows)`` will produce"""
+    days = days_per_series(rows, len(series_templates(path)))
+    return end - timedelta(days=days - 1), end
+
+
+def generate(rows: int, seed: int = 0, end: date = END_DATE, path: str = TEMPLATE_PATH) -> pd.DataFrame:
+    """About ``rows`` rows (a whole number of days per series), ordered by
+    commodity, region and date, with columns commodity, region, date, price"""
+    templates = series_templates(path)
+    series = len(templates)
+    days = days_per_series(rows, series)
+    rng = np.random.default_rng(seed)
+
+    shocks = rng.standard_normal((series, days)) * templates["volatility"].to_numpy()[:, None]
+    deviation = np.empty_like(shocks)
+    deviation[:, 0] = shocks[:, 0]
+    for day in range(1, days):
+        deviation[:, day] = (1 - MEAN_REVERSION) * deviation[:, day - 1] + shocks[:, day]
+    prices = templates["level"].to_numpy()[:, None] * np.exp(deviation)
+
+    dates = np.arange(np.datetime64(end) - (days - 1), np.datetime64(end) + 1)
+    return pd.DataFrame({
+        "commodity": np.repeat(templates["commodity"].to_numpy(), days),
+        "region": np.repeat(templates["region"].to_numpy(), days),
+        "date": np.tile(dates, series),
+        "price": prices.ravel(),
+    })
+
+
+def to_outputfinal(frame: pd.DataFrame) -> pd.DataFrame:
+    """``id,price`` frame with ids like ``Commodity/Region/YYYY-MM-DD``"""
+    ids = frame["commodity"] + "/" + frame["region"] + "/" + frame["date"].dt.strftime("%Y-%m-%d")
+    return pd.DataFrame({"id": ids, "price": frame["price"]})
+
+
+def random_uuids(count: int, rng: np.random.Generator, chunk_size: int = 1 << 18) -> np.ndarray:
+    """Version 4 UUID strings, built a chunk of byte rows at a time instead of
+    one ``uuid4()`` call per row"""
+    digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    ids = np.empty(count, dtype=object)
+    for start in range(0, count, chunk_size):
+        size = min(chunk_size, count - start)
+        raw = rng.integers(0, 256, (size, 16), dtype=np.uint8)
+        raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+        raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+        nibbles = np.stack([raw >> 4, raw & 0x0F], axis=2).reshape(size, 32)
+        text = np.ascontiguousarray(np.insert(digits[nibbles], [8, 12, 16, 20], ord("-"), axis=1))
+        ids[start:start + size] = text.view("S36").ravel().astype("U36")
+    return ids
+
+
+def to_price_columns(frame: pd.DataFrame, seed: int = 0, created_by: str = "benchmark"):
+    """Columns of the ``prices`` table for ``ColumnarEngine.load_columns``"""
+    count = len(frame)
+    created_at = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": random_uuids(count, np.random.default_rng(seed + 1)),
+        "region_id": frame["region"].map(region_map).to_numpy(),
+        "commodity_id": frame["commodity"].map(commodity_map).to_numpy(),
+        "date": frame["date"].to_numpy("datetime64[D]"),
+        "price": frame["price"].to_numpy(),
+        "created_by": np.full(count, created_by, dtype=object),
+        "created_at": np.full(count, created_at, dtype=object),
+        "updated_at": np.full(count, created_at, dtype=object),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Write outputfinal.csv-shaped synthetic price data")
+    parser.add_argument("--rows", type=int, required=True, help="Approximate number of rows")
+    parser.add_argument("--out", required=True, help="CSV file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    frame = to_outputfinal(generate(args.rows, args.seed))
+    frame.to_csv(args.out, index=False)
+    print(f"{len(frame)} rows written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""Gap filling for the wide ``data prep/<split>/<Commodity>.csv`` files.
+
+Every region column of a commodity file is one daily series. Series are
+split by volatility (mean absolute daily log return):
+
+* stagnant - prices that move little (rice, sugar, flour, ...) get their gaps
+             filled by linear interpolation
+* volatile - the rest get wavelet inpainting: starting from the interpolated
+             series, the gaps are repeatedly replaced by a denoised
+             reconstruction from an undecimated B3-spline ("a trous")
+             wavelet transform, so the fill picks up the significant
+             short-scale moves around the gap edges
+
+Only the finest scales are used. Masking observed stretches of the train
+files shows coarser scales pull gaps towards a blurred local mean and double
+the error of plain interpolation, while two scales match it.
+
+Both run on the whole (days x regions) array of a file at once, in log
+prices; observed prices are never changed. Files are processed in parallel
+on a process pool, and the result is written as one tidy CSV (``region``,
+``commodity``, ``date``, ``price`` plus a ``filled`` flag) that
+``backend/bulk_ingest.py`` loads as is.
+
+CLI::
+
+    python gap_fill.py [--split train] [--out prices_filled.csv] [--workers N]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+DATA_PREP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Mean absolute daily log return below which a series counts as stagnant
+STAGNANT_VOLATILITY = 0.005
+# Wavelet inpainting: scales, iterations and the detail threshold in noise sigmas
+WAVELET_LEVELS = 2
+WAVELET_ITERATIONS = 5
+WAVELET_THRESHOLD = 3.0
+# B3-spline smoothing kernel of the a trous transform
+B3_KERNEL = np.array([1, 4, 6, 4, 1]) / 16
+
+
+def volatility(log_values: np.ndarray) -> np.ndarray:
+    """Mean absolute daily log return per column, over consecutive observed days"""
+    changes = np.abs(np.diff(log_values, axis=0))
+    counts = (~np.isnan(changes)).sum(axis=0)
+    return np.divide(np.nansum(changes, axis=0), counts, out=np.full(counts.shape, np.nan), where=counts > 0)
+
+
+def interpolate(values: np.ndarray) -> np.ndarray:
+    """Fill NaNs of every column by linear interpolation between the nearest
+    observed days (nearest value before the first and after the last one)"""
+    steps, width = values.shape
+    observed = ~np.isnan(values)
+    index = np.arange(steps)[:, None]
+    previous = np.maximum.accumulate(np.where(observed, index, -1), axis=0)
+    following = np.minimum.accumulate(np.where(observed, index, steps)[::-1], axis=0)[::-1]
+    left = np.where(previous >= 0, previous, following).clip(0, steps - 1)
+    right = np.where(following < steps, following, previous).clip(0, steps - 1)
+    columns = np.arange(width)
+    low, high = values[left, columns], values[right, columns]
+    span = right - left
+    weight = np.divide(index - left, span, out=np.zeros(values.shape), where=span > 0)
+    return np.where(observed, values, low + (high - low) * weight)
+
+
+def _smooth(values: np.ndarray, step: int) -> np.ndarray:
+    """One a trous smoothing: the B3 kernel with holes of ``step`` along axis 0"""
+    steps = len(values)
+    padded = np.pad(values, ((2 * step, 2 * step), (0, 0)), mode="edge")
+    return sum(weight * padded[k * step:k * step + steps] for k, weight in enumerate(B3_KERNEL))
+
+
+def wavelet_denoise(values: np.ndarray, levels: int = WAVELET_LEVELS,
+                    threshold: float = WAVELET_THRESHOLD) -> np.ndarray:
+    """Reconstruction from the a trous transform with every detail scale
+    hard-thresholded at ``threshold`` robust noise sigmas (per column)"""
+    approximation = values
+    result = np.zeros_like(values)
+    for level in range(levels):
+        smoothed = _smooth(approximation, 2 ** level)
+        detail = approximation - smoothed
+        sigma = np.median(np.abs(detail - np.median(detail, axis=0)), axis=0) / 0.6745
+        result += np.where(np.abs(detail) > threshold * sigma, detail, 0.0)
+        approximation = smoothed
+    return result + approximation
+
+
+def wavelet_fill(values: np.ndarray, iterations: int = WAVELET_ITERATIONS) -> np.ndarray:
+    """Fill NaNs by iterated wavelet denoising, keeping observed values"""
+    missing = np.isnan(values)
+    filled = interpolate(values)
+    if not missing.any():
+        return filled
+    for _ in range(iterations):
+        filled = np.where(missing, wavelet_denoise(filled), values)
+    return filled
+
+
+def fill_wide(frame: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+    """``Date`` + region columns -> the same frame over every day with gaps
+    filled, and a per-region flag for the volatile series"""
+    frame = frame.assign(Date=pd.to_datetime(frame["Date"])).set_index("Date").sort_index()
+    frame = frame[~frame.index.duplicated(keep="last")]
+    frame = frame.reindex(pd.date_range(frame.index.min(), frame.index.max(), freq="D"))
+    prices = frame.to_numpy(dtype=float)
+    prices[prices <= 0] = np.nan
+
+    logs = np.log(prices)
+    volatile = volatility(logs) >= STAGNANT_VOLATILITY
+    filled = interpolate(logs)
+    if volatile.any():
+        filled[:, volatile] = wavelet_fill(logs[:, volatile])
+    return pd.DataFrame(np.exp(filled), index=frame.index, columns=frame.columns), volatile
+
+
+def process_file(path: str) -> Tuple[pd.DataFrame, dict]:
+    """One commodity file -> tidy filled rows and a summary"""
+    commodity = os.path.splitext(os.path.basename(path))[0]
+    raw = pd.read_csv(path)
+    filled, volatile = fill_wide(raw)
+
+    observed = raw.assign(Date=pd.to_datetime(raw["Date"])).set_index("Date")
+    observed = observed[~observed.index.duplicated(keep="last")].reindex(filled.index)
+    was_missing = (observed.isna() | (observed <= 0)).to_numpy()
+
+    regions = np.asarray(filled.columns)
+    days = filled.index.strftime("%Y-%m-%d").to_numpy()
+    values = filled.to_numpy()
+    keep = ~np.isnan(values)
+    tidy = pd.DataFrame({
+        "region": np.broadcast_to(regions, values.shape)[keep],
+        "commodity": commodity,
+        "date": np.broadcast_to(days[:, None], values.shape)[keep],
+        "price": values[keep].round(2),
+        "filled": was_missing[keep],
+    })
+    summary = {
+        "commodity": commodity,
+        "stagnant": int((~volatile).sum()),
+        "volatile": int(volatile.sum()),
+        "filled": int(tidy["filled"].sum()),
+        "rows": len(tidy),
+    }
+    return tidy, summary
+
+
+def run(paths: List[str], workers: int = 1) -> pd.DataFrame:
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            results = list(pool.map(process_file, paths))
+    else:
+        results = [process_file(path) for path in paths]
+    for _, summary in results:
+        print(f"  {summary['commodity']:<32} {summary['stagnant']:>3} stagnant {summary['volatile']:>3} volatile "
+              f"{summary['filled']:>6} of {summary['rows']} cells filled")
+    frames = [tidy for tidy, _ in results]
+    if not frames:
+        return pd.DataFrame(columns=["region", "commodity", "date", "price", "filled"])
+    return pd.concat(frames, ignore_index=True).sort_values(["date", "region", "commodity"], ignore_index=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fill the gaps of the wide commodity price files")
+    parser.add_argument("paths", nargs="*", help="Wide CSV files (default: every file of --split)")
+    parser.add_argument("--split", default="train", help="Folder under 'data prep' to read by default")
+    parser.add_argument("--out", default=os.path.join(DATA_PREP_DIR, "prices_filled.csv"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    paths = args.paths or sorted(glob.glob(os.path.join(DATA_PREP_DIR, "data prep", args.split, "*.csv")))
+    if not paths:
+        print("No input files found", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    result = run(paths, args.workers)
+    result.to_csv(args.out, index=False)
+    print(f"Wrote {len(result)} rows ({int(result['filled'].sum())} filled) to {args.out} "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
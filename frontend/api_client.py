@@ -0,0 +1,273 @@
+"""Shared client for the backend API.
+
+All pages go through one pooled ``requests.Session`` (keep-alive, retries on
+idempotent requests). Reads are memoized with ``st.cache_data`` keyed on
+their parameters, so Streamlit reruns and other sessions asking for the same
+filters do not hit the network; writes made through this module, and the
+dashboard's Fetch Data button, clear the read caches.
+"""
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+
+# Seconds a read result is reused before asking the API again
+READ_CACHE_TTL = int(os.getenv("API_CACHE_TTL", "300"))
+POOL_SIZE = int(os.getenv("API_POOL_SIZE", "10"))
+REQUEST_TIMEOUT = float(os.getenv("API_TIMEOUT", "60"))
+
+ID_DICTIONARY_HEADER = "X-Id-Dictionary"
+WATERMARK_HEADER = "X-Watermark"
+
+
+class APIError(Exception):
+    """Non-2xx response from the API"""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+@st.cache_resource
+def get_session():
+    """One pooled session per server process, shared by every user session"""
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def request(method, path, **kwargs):
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    response = get_session().request(method, f"{API_BASE_URL}{path}", **kwargs)
+    _record_timing(method, path, response)
+    if response.status_code != 200:
+        raise APIError(response.status_code, response.text)
+    return response
+
+
+def parse_server_timing(header):
+    """``Server-Timing`` header -> {stage: milliseconds}"""
+    timings = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+def _record_timing(method, path, response):
+    header = response.headers.get("Server-Timing")
+    if header:
+        st.session_state.setdefault("server_timings", {})[f"{method} {path}"] = parse_server_timing(header)
+
+
+def server_timings():
+    """Stage timings (ms) of the last request to each endpoint in this session.
+
+    Reads answered from the cache keep the timings of the request that filled it.
+    """
+    return dict(st.session_state.get("server_timings", {}))
+
+
+def _params(params):
+    """Cache-friendly, order-independent form of a params dict"""
+    return tuple(sorted(
+        (key, tuple(value) if isinstance(value, (list, tuple)) else value)
+        for key, value in params.items()
+        if value is not None
+    ))
+
+
+def _query(params):
+    """``_params`` output back into a requests params list"""
+    return [(key, v) for key, value in params for v in (value if isinstance(value, tuple) else (value,))]
+
+
+# Reads (cached)
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def _get_json(path, params):
+    return request("GET", path, params=_query(params)).json()
+
+
+def get_json(path, params=None):
+    return _get_json(path, _params(params or {}))
+
+
+def decode_ids(records, dictionary):
+    """Rows with integer region/commodity codes -> DataFrame.
+
+    Each coded column becomes a Categorical of ids plus a ``*_name``
+    Categorical of names, built from the codes directly (no per-row lookup).
+    """
+    df = pd.DataFrame(records)
+    for column, entry in dictionary.items():
+        if column not in df:
+            continue
+        codes = df[column].fillna(-1).astype("int16").to_numpy()
+        df[column] = pd.Categorical.from_codes(codes, categories=entry["ids"])
+        df[column.replace("_id", "_name")] = pd.Categorical.from_codes(codes, categories=entry["names"])
+    return df
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def _get_coded(path, params):
+    response = request("GET", path, params=_query(params) + [("ids", "code")])
+    return decode_ids(response.json(), json.loads(response.headers[ID_DICTIONARY_HEADER]))
+
+
+def get_frame(path, params=None):
+    """JSON rows as a DataFrame, with ids sent as compact codes and decoded
+    into Categoricals (``region_id``/``region_name``, ``commodity_id``/``commodity_name``)"""
+    return _get_coded(path, _params(params or {}))
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def _get_records(params):
+    response = request("GET", "/data", params=_query(params) + [("format", "arrow")], stream=True)
+    # Arrow IPC stream straight into columnar pandas: date32 -> datetime64,
+    # dictionary-encoded ids -> Categorical, no per-row Python objects
+    table = pa.ipc.open_stream(response.raw).read_all()
+    return table.to_pandas(date_as_object=False), response.headers.get(WATERMARK_HEADER)
+
+
+def get_records(params):
+    """Every matching price record as a DataFrame (streamed as Arrow IPC), and
+    the watermark to ask ``get_changes`` for what changed after it"""
+    return _get_records(_params(params))
+
+
+def get_changes(params, watermark):
+    """``{"watermark", "upserts", "deleted"}``: rows inserted or updated and
+    ids deleted since ``watermark``. None when the server can no longer tell
+    (restart, too old), in which case the caller refetches everything."""
+    try:
+        return request("GET", "/data", params=_query(_params(params)) + [("since", watermark)]).json()
+    except APIError as e:
+        if e.status_code == 410:
+            return None
+        raise
+
+
+def get_aggregate(params, group_by, stats, bucket=None):
+    return get_json("/data/aggregate", {**params, "group_by": group_by, "bucket": bucket, "stats": list(stats)})
+
+
+def get_series(params, max_points):
+    return get_frame("/data/series", {**params, "max_points": max_points})
+
+
+def get_rolling(params, indicators=None):
+    """Moving averages, volatility and week/month/year-over-year changes per
+    region and commodity, computed on the server (see ``get_frame``)"""
+    return get_frame("/analytics/rolling", {**params, "indicators": list(indicators) if indicators else None})
+
+
+def get_snapshot(as_of=None, regions=None, commodities=None, max_age_days=None):
+    """Region x commodity price board as of a day: ``{"as_of", "regions",
+    "commodities", "prices", "age_days"}`` with one row per region"""
+    return get_json("/data/snapshot", {
+        "as_of": as_of, "regions": regions, "commodities": commodities, "max_age_days": max_age_days,
+    })
+
+
+def get_count(params):
+    return get_json("/data/count", params).get("total_count")
+
+
+def search_entries(params, cursor=None, page_size=20, sort="-date"):
+    """One page of picker rows: ``{"items": [{id, label, region, commodity,
+    date, price}], "next_cursor"}``"""
+    return get_json("/data/search", {**params, "sort": sort, "cursor": cursor, "page_size": page_size})
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def _get_batch(queries):
+    response = request("POST", "/data/batch", json={"queries": json.loads(queries), "ids": "code"})
+    dictionary = json.loads(response.headers[ID_DICTIONARY_HEADER])
+    return {name: decode_ids(rows, dictionary) for name, rows in response.json()["results"].items()}
+
+
+def get_batch(queries):
+    """Several ``/data`` filter sets in one request -> ``{name: DataFrame}``.
+
+    Each query is a dict of ``/data`` params (regions, commodities,
+    start_date, end_date, limit) plus a unique ``name``; the server runs them
+    concurrently and overlapping ones share a scan.
+    """
+    return _get_batch(json.dumps(queries, sort_keys=True, default=str))
+
+
+def clear_read_cache():
+    _get_json.clear()
+    _get_coded.clear()
+    _get_records.clear()
+    _get_batch.clear()
+
+
+def get_anomalies(limit=100):
+    """Writes flagged as unusual, newest first (not cached: the list changes with every write)"""
+    return request("GET", "/anomalies", params={"limit": limit}).json()
+
+
+def dismiss_anomaly(price_id):
+    return request("DELETE", f"/anomalies/{price_id}").json()
+
+
+# Writes (invalidate cached reads)
+def add_price(payload):
+    result = request("POST", "/data", json=payload).json()
+    clear_read_cache()
+    return result
+
+
+def upsert_price(payload):
+    """Insert or replace the price of the payload's (region, commodity, date)"""
+    result = request("PUT", "/data/by-key", json=payload).json()
+    clear_read_cache()
+    return result
+
+
+def update_price(price_id, payload):
+    result = request("PUT", f"/data/{price_id}", json=payload).json()
+    clear_read_cache()
+    return result
+
+
+def delete_price(price_id):
+    result = request("DELETE", f"/data/{price_id}").json()
+    clear_read_cache()
+    return result
+
+
+def bulk_update_prices(selection, update, dry_run=False):
+    """One update for every row matching ``selection`` (ids and/or region,
+    commodity and date filters)"""
+    result = request("PUT", "/data/bulk", json={**selection, "update": update, "dry_run": dry_run}).json()
+    if not dry_run:
+        clear_read_cache()
+    return result
+
+
+def bulk_delete_prices(selection, dry_run=False):
+    result = request("DELETE", "/data", params=_query(_params({**selection, "dry_run": "true" if dry_run else None}))).json()
+    if not dry_run:
+        clear_read_cache()
+    return result
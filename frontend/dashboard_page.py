@@ -6,12 +6,11 @@ import io
 import sys
 import os
 
+import api_client
+
 # Add backend directory to path for importing id_mapping
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
-# API base URL
-API_BASE_URL = "http://localhost:8000"
-
 # Try to import plotly, but don't fail if not available
 try:
     import plotly.express as px
@@ -20,6 +19,19 @@ except ImportError:
     PLOTLY_AVAILABLE = False
     st.warning("Plotly not available. Install with: pip install plotly")
 
+# Points per region-commodity line in the trend chart; render time depends on
+# this, not on the length of the date range
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "400"))
+
+# Rows per period in the year-over-year comparison
+COMPARE_LIMIT = int(os.getenv("COMPARE_LIMIT", "50000"))
+
+# LTTB downsampling shared with the backend; without it lines are drawn in full
+try:
+    from downsample import lttb, series_bounds
+except ImportError:
+    lttb = None
+
 # Try to import the mapping dictionaries
 try:
     from id_mapping import region_map, commodity_map
@@ -77,15 +89,33 @@ def dashboard_page():
     ]
     selected_commodities = st.sidebar.multiselect("Commodities", commodities, default=commodities[:5])
     
-    # Fetch data button
-    if st.sidebar.button("Fetch Data", type="primary"):
-        fetch_and_display_data(start_date, end_date, selected_regions, selected_commodities)
+    # Raw records are only transferred when asked for
+    show_raw = st.sidebar.checkbox("Show raw records", value=False)
+    compare = st.sidebar.checkbox("Compare with the same period last year", value=False)
+    board = st.sidebar.checkbox("Show price board", value=False)
+    
+    # Fetch data button; the filters are remembered so later reruns redraw
+    # the same view (from the API client cache, without network calls)
+    fetch_clicked = st.sidebar.button("Fetch Data", type="primary")
+    if fetch_clicked or 'dashboard_filters' not in st.session_state:
+        st.session_state.dashboard_filters = (start_date, end_date, selected_regions, selected_commodities, show_raw, compare, board)
+    if fetch_clicked:
+        # An explicit fetch asks the API again instead of showing reads cached
+        # up to API_CACHE_TTL seconds ago; raw records still sync as a delta
+        api_client.clear_read_cache()
     
-    # Auto-fetch on page load
-    if 'data_fetched' not in st.session_state:
-        fetch_and_display_data(start_date, end_date, selected_regions, selected_commodities)
+    fetch_and_display_data(*st.session_state.dashboard_filters, refresh=fetch_clicked)
+    show_server_timings()
+
+def show_server_timings():
+    """Where the API spent its time on the requests behind this view"""
+    timings = api_client.server_timings()
+    if timings:
+        with st.sidebar.expander("⏱️ Server timing (ms)"):
+            st.dataframe(pd.DataFrame.from_dict(timings, orient="index").fillna(0).round(1))
+            st.caption("From the Server-Timing header of the last request to each endpoint")
 
-def fetch_and_display_data(start_date, end_date, regions, commodities):
+def fetch_and_display_data(start_date, end_date, regions, commodities, show_raw=False, compare=False, board=False, refresh=False):
     try:
         # Build query parameters
         params = {}
@@ -100,102 +130,214 @@ def fetch_and_display_data(start_date, end_date, regions, commodities):
         if commodities:
             params['commodities'] = commodities
         
-        # Set a higher limit to get more data
-        params['limit'] = 50000  # Increased from default 10000
-        
-        # Make API request with filters
+        # Summary statistics are computed on the server
         with st.spinner("Fetching data..."):
-            response = requests.get(f"{API_BASE_URL}/data", params=params)
+            summary = api_client.get_aggregate(params, 'none', ['count', 'mean', 'min', 'max'])[0]
+            
+        if summary['count']:
+            # Display data
+            st.subheader(f"Price Data ({summary['count']:,} records)")
             
-        if response.status_code == 200:
-            data = response.json()
+            # Show summary statistics
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Total Records", summary['count'])
+            with col2:
+                st.metric("Avg Price", f"Rp {summary['mean']:.2f}")
+            with col3:
+                st.metric("Min Price", f"Rp {summary['min']:.2f}")
+            with col4:
+                st.metric("Max Price", f"Rp {summary['max']:.2f}")
             
-            if data:
-                # Convert to DataFrame
-                df = pd.DataFrame(data)
-                
-                # Convert date strings to datetime
-                if 'date' in df.columns:
-                    df['date'] = pd.to_datetime(df['date'])
-                
-                if not df.empty:
-                    # Add readable names
-                    if region_id_to_name:
-                        df['region_name'] = df['region_id'].map(region_id_to_name)
-                    else:
-                        df['region_name'] = df['region_id']
-                        
-                    if commodity_id_to_name:
-                        df['commodity_name'] = df['commodity_id'].map(commodity_id_to_name)
-                    else:
-                        df['commodity_name'] = df['commodity_id']
-                        
-                    df['created_by_name'] = df['created_by']  # Assuming created_by is already a name
-                    
-                    # Display data
-                    st.subheader(f"Price Data ({len(df)} records)")
-                    
-                    # Show information about data limits
-                    if len(data) >= 50000:
-                        st.warning("⚠️ Showing maximum 50,000 records. There might be more data available.")
-                    
-                    # Show summary statistics
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric("Total Records", len(df))
-                    with col2:
-                        if 'price' in df.columns:
-                            st.metric("Avg Price", f"Rp {df['price'].mean():.2f}")
-                    with col3:
-                        if 'price' in df.columns:
-                            st.metric("Min Price", f"Rp {df['price'].min():.2f}")
-                    with col4:
-                        if 'price' in df.columns:
-                            st.metric("Max Price", f"Rp {df['price'].max():.2f}")
-                    
-                    # Create line plot if plotly is available
-                    if PLOTLY_AVAILABLE:
-                        create_line_plot(df)
-                    else:
-                        st.info("Install plotly to see price trend charts: pip install plotly")
-                    
-                    # Display dataframe (without id columns and with readable names)
-                    display_columns = ['date', 'region_name', 'commodity_name', 'price', 'created_by_name']
-                    display_df = df[display_columns].copy()
-                    display_df.columns = ['Date', 'Region', 'Commodity', 'Price (Rp)', 'Created By']
-                    
-                    st.dataframe(display_df, use_container_width=True)
-                    
-                    # CSV export
-                    csv = display_df.to_csv(index=False)
-                    st.download_button(
-                        label="Download CSV",
-                        data=csv,
-                        file_name=f"price_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv"
-                    )
-                    
-                    # Store data in session state
-                    st.session_state.current_data = df
-                    st.session_state.data_fetched = True
-                    
-                else:
-                    st.warning("No data found for the selected filters.")
-                    st.session_state.current_data = None
-                    
+            # Total across the full history (counted on the server)
+            history_total = fetch_history_count(regions, commodities)
+            if history_total is not None:
+                st.caption(f"{history_total:,} records across the full history for the selected regions and commodities")
+            
+            # Create line plot if plotly is available
+            if PLOTLY_AVAILABLE:
+                create_line_plot(fetch_trend_data(params))
+            else:
+                st.info("Install plotly to see price trend charts: pip install plotly")
+            
+            if compare:
+                display_comparison(start_date, end_date, regions, commodities)
+            
+            if board:
+                display_price_board(end_date, regions, commodities)
+            
+            if show_raw:
+                display_raw_data(params, refresh)
             else:
-                st.warning("No data found for the selected filters.")
-                st.session_state.current_data = None
-                
+                st.info("Tick 'Show raw records' in the sidebar to load the individual price records.")
+            
         else:
-            st.error(f"Error fetching data: {response.status_code}")
-            st.error(response.text)
+            st.warning("No data found for the selected filters.")
+            st.session_state.current_data = None
             
+    except api_client.APIError as e:
+        st.error(f"Error fetching data: {e.status_code}")
+        st.error(e.text)
     except requests.exceptions.ConnectionError:
         st.error("Cannot connect to the API server. Please make sure the backend is running.")
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
 
+def add_readable_names(df):
+    if region_id_to_name:
+        df['region_name'] = df['region_id'].map(region_id_to_name)
+    else:
+        df['region_name'] = df['region_id']
+        
+    if commodity_id_to_name:
+        df['commodity_name'] = df['commodity_id'].map(commodity_id_to_name)
+    else:
+        df['commodity_name'] = df['commodity_id']
+    return df
+
+def fetch_trend_data(params):
+    """Price series per region and commodity, downsampled on the server"""
+    df = api_client.get_series(params, CHART_MAX_POINTS)
+    if df.empty:
+        return df
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+def prepare_records(df):
+    df = add_readable_names(df)
+    df['created_by_name'] = df['created_by']  # Assuming created_by is already a name
+    return df
+
+def merge_changes(df, changes):
+    """Apply upserted rows and deleted ids from the API to a records DataFrame"""
+    upserts = pd.DataFrame(changes['upserts'])
+    stale = set(changes['deleted'])
+    if not upserts.empty:
+        stale.update(upserts['id'])
+    if not stale:
+        return df
+    df = df[~df['id'].isin(stale)]
+    if not upserts.empty:
+        upserts['date'] = pd.to_datetime(upserts['date']).astype(df['date'].dtype)
+        for column in ('region_id', 'commodity_id'):
+            upserts[column] = upserts[column].astype(df[column].dtype)
+        upserts = prepare_records(upserts)
+        df = pd.concat([df, upserts[df.columns]], ignore_index=True)
+    return df.sort_values(['date', 'id'], ignore_index=True)
+
+def load_records(params, refresh):
+    """Records for params, kept in st.session_state.current_data.
+
+    Reruns reuse them as they are; a Fetch Data click only asks the API for
+    what changed since the last fetch and merges it in. A full fetch happens
+    for new filters or when the server can no longer provide the changes.
+    """
+    sync = st.session_state.get('current_data_sync')
+    current = st.session_state.get('current_data')
+    if current is not None and sync and sync['params'] == params:
+        if not refresh:
+            return current
+        changes = api_client.get_changes(params, sync['watermark']) if sync['watermark'] else None
+        if changes is not None:
+            st.session_state.current_data = merge_changes(current, changes)
+            sync['watermark'] = changes['watermark']
+            return st.session_state.current_data
+    
+    with st.spinner("Fetching raw records..."):
+        df, watermark = api_client.get_records(params)
+    
+    # Dates arrive as datetime64 and ids as categoricals, so naming them only
+    # maps the few distinct categories
+    df = prepare_records(df)
+    st.session_state.current_data = df
+    st.session_state.current_data_sync = {'params': params, 'watermark': watermark}
+    return df
+
+def display_raw_data(params, refresh=False):
+    """Show every matching record as a table with a CSV export"""
+    df = load_records(params, refresh)
+    
+    if df.empty:
+        return
+    
+    # Display dataframe (without id columns and with readable names)
+    display_columns = ['date', 'region_name', 'commodity_name', 'price', 'created_by_name']
+    display_df = df[display_columns].copy()
+    display_df.columns = ['Date', 'Region', 'Commodity', 'Price (Rp)', 'Created By']
+    
+    st.dataframe(display_df, use_container_width=True)
+    
+    # CSV export
+    csv = display_df.to_csv(index=False)
+    st.download_button(
+        label="Download CSV",
+        data=csv,
+        file_name=f"price_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+        mime="text/csv"
+    )
+
+def last_year(day):
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:  # 29 February
+        return day.replace(year=day.year - 1, day=28)
+
+def display_comparison(start_date, end_date, regions, commodities):
+    """Average price per commodity against the same dates one year earlier"""
+    query = {'regions': regions, 'commodities': commodities, 'limit': COMPARE_LIMIT}
+    with st.spinner("Fetching comparison..."):
+        results = api_client.get_batch([
+            {**query, 'name': 'current', 'start_date': start_date, 'end_date': end_date},
+            {**query, 'name': 'last_year', 'start_date': last_year(start_date), 'end_date': last_year(end_date)},
+        ])
+    
+    st.subheader("📅 Compared with the same period last year")
+    means = {
+        name: df.groupby('commodity_name', observed=True)['price'].mean() if not df.empty else pd.Series(dtype=float)
+        for name, df in results.items()
+    }
+    table = pd.DataFrame({'This period (Rp)': means['current'], 'Last year (Rp)': means['last_year']})
+    if table.empty:
+        st.info("No data for the comparison.")
+        return
+    table['Change (%)'] = (table['This period (Rp)'] / table['Last year (Rp)'] - 1) * 100
+    table.index.name = 'Commodity'
+    st.dataframe(table.round(2), use_container_width=True)
+    if any(len(df) >= COMPARE_LIMIT for df in results.values()):
+        st.caption(f"Averages use the first {COMPARE_LIMIT:,} records of each period.")
+
+def display_price_board(as_of, regions, commodities):
+    """Latest price of each commodity in each region on the end date"""
+    snapshot = api_client.get_snapshot(as_of.isoformat() if as_of else None, regions, commodities)
+    st.subheader(f"🗺️ Price board as of {snapshot['as_of']}")
+    table = pd.DataFrame(snapshot['prices'], index=snapshot['regions'], columns=snapshot['commodities'])
+    table.index.name = 'Region'
+    st.dataframe(table, use_container_width=True)
+    st.caption(f"Where a day has no price, the last one from up to {snapshot['max_age_days']} days earlier is shown.")
+
+def fetch_history_count(regions, commodities):
+    """Total number of records for the selection, ignoring the date range"""
+    params = {}
+    if regions:
+        params['regions'] = regions
+    if commodities:
+        params['commodities'] = commodities
+    try:
+        return api_client.get_count(params)
+    except (api_client.APIError, requests.exceptions.RequestException):
+        return None
+
+def downsample_for_chart(df, max_points=CHART_MAX_POINTS):
+    """Keep at most max_points per region-commodity line (LTTB keeps peaks and troughs)"""
+    if lttb is None or df.empty:
+        return df
+    df = df.sort_values(['region_commodity', 'date'], kind='stable').reset_index(drop=True)
+    starts, lengths = series_bounds(df['region_commodity'].to_numpy())
+    if lengths.max() <= max_points:
+        return df
+    days = df['date'].to_numpy('datetime64[D]').astype('int64')
+    return df.iloc[lttb(days, df['price'].to_numpy(), starts, lengths, max_points)]
+
 def create_line_plot(df):
     """Create a line plot showing price trends by region and commodity"""
     if not PLOTLY_AVAILABLE:
@@ -209,10 +351,10 @@ def create_line_plot(df):
     
     try:
         # Create a combined category for legend
-        df['region_commodity'] = df['region_name'] + ' - ' + df['commodity_name']
+        df['region_commodity'] = df['region_name'].astype(str) + ' - ' + df['commodity_name'].astype(str)
         
-        # Sort by date
-        df_sorted = df.sort_values('date')
+        # Downsample long lines, then sort by date
+        df_sorted = downsample_for_chart(df).sort_values('date')
         
         # Create the line plot
         fig = px.line(
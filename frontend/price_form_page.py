@@ -1,10 +1,11 @@
 import streamlit as st
 import requests
 from datetime import date
-import pandas as pd
 
-# API base URL
-API_BASE_URL = "http://localhost:8000"
+import api_client
+
+# Picker rows per /data/search request
+SEARCH_PAGE_SIZE = 20
 
 def price_form_page():
     st.title("📝 Add/Update Price Data")
@@ -24,6 +25,7 @@ def price_form_page():
 
 def add_new_price_form():
     st.header("Add New Price Entry")
+    st.caption("An existing entry for the same region, commodity and date is replaced.")
     
     with st.form("add_price_form"):
         # Region selection
@@ -112,6 +114,12 @@ def update_price_form():
             
             if search_button:
                 search_price_entries(search_region, search_commodity, search_date)
+
+        selected_id = show_entry_picker("update", "update")
+        if selected_id:
+            st.session_state.selected_update_id = selected_id
+            st.session_state.update_search_completed = True
+            st.rerun()
     
     # Show update form if search is completed and ID is selected
     elif st.session_state.selected_update_id:
@@ -124,77 +132,7 @@ def update_price_form():
             st.rerun()
 
 def search_price_entries(region, commodity, search_date):
-    try:
-        # Build query parameters
-        params = {}
-        if region and region != "All":
-            params['regions'] = [region]
-        if commodity and commodity != "All":
-            params['commodities'] = [commodity]
-        if search_date:
-            params['start_date'] = search_date.isoformat()
-            params['end_date'] = search_date.isoformat()
-        
-        # Make API request
-        with st.spinner("Searching for price entries..."):
-            response = requests.get(f"{API_BASE_URL}/data", params=params)
-            
-        if response.status_code == 200:
-            data = response.json()
-            
-            if data:
-                df = pd.DataFrame(data)
-                
-                # Convert date strings to datetime
-                if 'date' in df.columns:
-                    df['date'] = pd.to_datetime(df['date'])
-                
-                # Display found entries
-                st.subheader(f"Found {len(df)} price entries")
-                
-                # Create selection interface
-                if 'id' in df.columns:
-                    options = []
-                    for _, row in df.iterrows():
-                        date_str = row.get('date', 'N/A')
-                        if date_str is not None and hasattr(date_str, 'strftime'):
-                            date_str = date_str.strftime('%Y-%m-%d')
-                        option_text = f"ID: {row['id']} | {date_str} | {row.get('region_id', 'N/A')} | {row.get('commodity_id', 'N/A')} | Rp {row.get('price', 0):.2f}"
-                        options.append((row['id'], option_text))
-                    
-                    if options:
-                        selected_option = st.selectbox(
-                            "Choose entry to update:",
-                            options=[opt[1] for opt in options],
-                            key="update_selection"
-                        )
-                        
-                        # Get the selected ID
-                        selected_id = None
-                        for opt_id, opt_text in options:
-                            if opt_text == selected_option:
-                                selected_id = opt_id
-                                break
-                        
-                        if selected_id:
-                            st.session_state.selected_update_id = selected_id
-                            st.session_state.update_search_completed = True
-                            st.rerun()
-                    else:
-                        st.warning("No price entries found.")
-                else:
-                    st.warning("No price entries found.")
-            else:
-                st.warning("No price entries found for the selected criteria.")
-                
-        else:
-            st.error(f"Error searching data: {response.status_code}")
-            st.error(response.text)
-            
-    except requests.exceptions.ConnectionError:
-        st.error("Cannot connect to the API server. Please make sure the backend is running.")
-    except Exception as e:
-        st.error(f"An error occurred: {str(e)}")
+    start_entry_search("update", search_params(region, commodity, search_date))
 
 def show_update_form(price_id):
     st.subheader(f"Update Price Entry (ID: {price_id})")
@@ -223,6 +161,7 @@ def show_update_form(price_id):
                 # Reset session state after successful update
                 st.session_state.update_search_completed = False
                 st.session_state.selected_update_id = None
+                st.session_state.pop("update_search", None)
             else:
                 st.error("Please enter a valid price.")
 
@@ -270,6 +209,12 @@ def delete_price_form():
             
             if search_button:
                 search_price_entries_for_delete(search_region, search_commodity, search_date)
+
+        selected_id = show_entry_picker("delete", "delete")
+        if selected_id:
+            st.session_state.selected_delete_id = selected_id
+            st.session_state.delete_search_completed = True
+            st.rerun()
     
     # Show delete confirmation if search is completed and ID is selected
     elif st.session_state.selected_delete_id:
@@ -282,77 +227,7 @@ def delete_price_form():
             st.rerun()
 
 def search_price_entries_for_delete(region, commodity, search_date):
-    try:
-        # Build query parameters
-        params = {}
-        if region and region != "All":
-            params['regions'] = [region]
-        if commodity and commodity != "All":
-            params['commodities'] = [commodity]
-        if search_date:
-            params['start_date'] = search_date.isoformat()
-            params['end_date'] = search_date.isoformat()
-        
-        # Make API request
-        with st.spinner("Searching for price entries..."):
-            response = requests.get(f"{API_BASE_URL}/data", params=params)
-            
-        if response.status_code == 200:
-            data = response.json()
-            
-            if data:
-                df = pd.DataFrame(data)
-                
-                # Convert date strings to datetime
-                if 'date' in df.columns:
-                    df['date'] = pd.to_datetime(df['date'])
-                
-                # Display found entries
-                st.subheader(f"Found {len(df)} price entries")
-                
-                # Create selection interface
-                if 'id' in df.columns:
-                    options = []
-                    for _, row in df.iterrows():
-                        date_str = row.get('date', 'N/A')
-                        if date_str is not None and hasattr(date_str, 'strftime'):
-                            date_str = date_str.strftime('%Y-%m-%d')
-                        option_text = f"ID: {row['id']} | {date_str} | {row.get('region_id', 'N/A')} | {row.get('commodity_id', 'N/A')} | Rp {row.get('price', 0):.2f}"
-                        options.append((row['id'], option_text))
-                    
-                    if options:
-                        selected_option = st.selectbox(
-                            "Choose entry to delete:",
-                            options=[opt[1] for opt in options],
-                            key="delete_selection"
-                        )
-                        
-                        # Get the selected ID
-                        selected_id = None
-                        for opt_id, opt_text in options:
-                            if opt_text == selected_option:
-                                selected_id = opt_id
-                                break
-                        
-                        if selected_id:
-                            st.session_state.selected_delete_id = selected_id
-                            st.session_state.delete_search_completed = True
-                            st.rerun()
-                    else:
-                        st.warning("No price entries found.")
-                else:
-                    st.warning("No price entries found.")
-            else:
-                st.warning("No price entries found for the selected criteria.")
-                
-        else:
-            st.error(f"Error searching data: {response.status_code}")
-            st.error(response.text)
-            
-    except requests.exceptions.ConnectionError:
-        st.error("Cannot connect to the API server. Please make sure the backend is running.")
-    except Exception as e:
-        st.error(f"An error occurred: {str(e)}")
+    start_entry_search("delete", search_params(region, commodity, search_date))
 
 def show_delete_confirmation(price_id):
     st.subheader(f"Delete Price Entry (ID: {price_id})")
@@ -372,6 +247,68 @@ def show_delete_confirmation(price_id):
             # Reset session state after successful deletion
             st.session_state.delete_search_completed = False
             st.session_state.selected_delete_id = None
+            st.session_state.pop("delete_search", None)
+
+def search_params(region, commodity, search_date):
+    params = {}
+    if region and region != "All":
+        params['regions'] = [region]
+    if commodity and commodity != "All":
+        params['commodities'] = [commodity]
+    if search_date:
+        params['start_date'] = search_date.isoformat()
+        params['end_date'] = search_date.isoformat()
+    return params
+
+def start_entry_search(prefix, params):
+    """Start a picker search; only its first page is fetched"""
+    st.session_state[f"{prefix}_search"] = {"params": params, "items": [], "cursor": None}
+    load_entry_page(prefix)
+
+def load_entry_page(prefix):
+    """Append the next page of labelled rows from /data/search to a picker"""
+    search = st.session_state[f"{prefix}_search"]
+    try:
+        with st.spinner("Searching for price entries..."):
+            page = api_client.search_entries(search["params"], search["cursor"], SEARCH_PAGE_SIZE)
+        search["items"].extend(page["items"])
+        search["cursor"] = page["next_cursor"]
+    except api_client.APIError as e:
+        st.error(f"Error searching data: {e.status_code}")
+        st.error(e.text)
+    except requests.exceptions.ConnectionError:
+        st.error("Cannot connect to the API server. Please make sure the backend is running.")
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+
+def show_entry_picker(prefix, action):
+    """Selectbox over the pages loaded so far; returns the id once the user confirms it"""
+    search = st.session_state.get(f"{prefix}_search")
+    if not search:
+        return None
+    if not search["items"]:
+        st.warning("No price entries found for the selected criteria.")
+        return None
+
+    labels = {item["id"]: item["label"] for item in search["items"]}
+    more = " (more available)" if search["cursor"] else ""
+    st.subheader(f"Showing {len(labels)} price entries{more}")
+    selected_id = st.selectbox(
+        f"Choose entry to {action}:",
+        options=list(labels),
+        format_func=labels.get,
+        key=f"{prefix}_selection"
+    )
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if search["cursor"] and st.button("Load more", type="secondary", key=f"{prefix}_more"):
+            load_entry_page(prefix)
+            st.rerun()
+    with col2:
+        if st.button(f"{action.capitalize()} selected entry", type="primary", key=f"{prefix}_choose"):
+            return selected_id
+    return None
 
 def add_price_entry(region, commodity, date_val, price, created_by):
     try:
@@ -383,21 +320,33 @@ def add_price_entry(region, commodity, date_val, price, created_by):
             "created_by": created_by
         }
         
-        with st.spinner("Adding price entry..."):
-            response = requests.post(f"{API_BASE_URL}/data", json=payload)
+        # One round trip: an existing entry for the region/commodity/date is replaced
+        with st.spinner("Saving price entry..."):
+            result = api_client.upsert_price(payload)
         
-        if response.status_code == 200:
-            st.success("Price entry added successfully!")
-            st.json(response.json())
+        if result.get("action") == "updated":
+            st.success("Existing price entry updated successfully!")
         else:
-            st.error(f"Error adding price entry: {response.status_code}")
-            st.error(response.text)
+            st.success("Price entry added successfully!")
+        show_anomaly(result)
+        st.json(result)
             
+    except api_client.APIError as e:
+        st.error(f"Error adding price entry: {e.status_code}")
+        st.error(e.text)
     except requests.exceptions.ConnectionError:
         st.error("Cannot connect to the API server. Please make sure the backend is running.")
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
 
+def show_anomaly(result):
+    """Warn when the API flagged the saved price as unusual"""
+    anomaly = result.get("anomaly")
+    if not anomaly or not anomaly.get("flagged"):
+        return
+    expected = f" (recent prices are around Rp {anomaly['expected']:,.2f})" if anomaly.get("expected") else ""
+    st.warning(f"⚠️ This price looks unusual{expected}. It was saved and flagged for review; please check it for typos.")
+
 def update_price_entry(price_id, price, created_by):
     try:
         payload = {
@@ -406,15 +355,15 @@ def update_price_entry(price_id, price, created_by):
         }
         
         with st.spinner("Updating price entry..."):
-            response = requests.put(f"{API_BASE_URL}/data/{price_id}", json=payload)
+            result = api_client.update_price(price_id, payload)
         
-        if response.status_code == 200:
-            st.success("Price entry updated successfully!")
-            st.json(response.json())
-        else:
-            st.error(f"Error updating price entry: {response.status_code}")
-            st.error(response.text)
+        st.success("Price entry updated successfully!")
+        show_anomaly(result)
+        st.json(result)
             
+    except api_client.APIError as e:
+        st.error(f"Error updating price entry: {e.status_code}")
+        st.error(e.text)
     except requests.exceptions.ConnectionError:
         st.error("Cannot connect to the API server. Please make sure the backend is running.")
     except Exception as e:
@@ -423,15 +372,14 @@ def update_price_entry(price_id, price, created_by):
 def delete_price_entry(price_id):
     try:
         with st.spinner("Deleting price entry..."):
-            response = requests.delete(f"{API_BASE_URL}/data/{price_id}")
+            result = api_client.delete_price(price_id)
         
-        if response.status_code == 200:
-            st.success("Price entry deleted successfully!")
-            st.json(response.json())
-        else:
-            st.error(f"Error deleting price entry: {response.status_code}")
-            st.error(response.text)
+        st.success("Price entry deleted successfully!")
+        st.json(result)
             
+    except api_client.APIError as e:
+        st.error(f"Error deleting price entry: {e.status_code}")
+        st.error(e.text)
     except requests.exceptions.ConnectionError:
         st.error("Cannot connect to the API server. Please make sure the backend is running.")
     except Exception as e: